@@ -0,0 +1,320 @@
+from __future__ import annotations
+
+import logging
+import re
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Iterable
+
+from sqlalchemy import select
+
+from db.async_repo import AsyncReadSessionLocal
+from db.models import CdekCityName
+from db.repo import dialect_insert
+from db.write_queue import write_queue
+
+logger = logging.getLogger("box_bot")
+
+# ==================== Название города → city_code СДЭК ====================
+# Каждый поиск ПВЗ спрашивал /v2/location/cities, хотя почти весь трафик — одни
+# и те же несколько сотен городов. CityResolver отвечает из памяти:
+#
+#   - названия нормализуются (normalize_city): регистр, ё/е, «г.»/«город», дефисы,
+#     регион в скобках или после названия;
+#   - префиксное дерево (trie) названий: из запроса «Нижний Новгород Ленина 5»
+#     берётся самое длинное известное название, стоящее в начале;
+#   - промах — запрос в живой API; ответ запоминается в cdek_city_names (source="api")
+#     и в памяти, «не нашёл» — до следующей синхронизации;
+#   - только если API ничего не нашёл или не ответил — нечёткий поиск по тому же
+#     дереву (опечатки вроде «Масква», расстояние Левенштейна 1–2). Раньше API его
+#     не ставим: в индексе только города с ПВЗ, и настоящий «Пушкино» иначе стал бы
+#     «Пушкиным», а «Королёво» — «Королёвом». По той же причине не принимается
+#     название, отличающееся от запроса только последней буквой.
+#
+# Таблица наполняется из справочника ПВЗ (cdek.points.DeliveryPointCatalog.cities()):
+# нужны только города, где есть ПВЗ. Одноимённые города — побеждает тот, где больше ПВЗ.
+# fetch(name) — запрос /v2/location/cities (в bot.py): список городов или None при ошибке.
+
+CitiesFetch = Callable[[str], Awaitable[list[dict] | None]]
+# Сколько слов запроса пробовать как название города
+MAX_NAME_WORDS = 4
+# Предел запомненных «не нашёл» (мусорные запросы не должны расти без конца)
+MAX_UNKNOWN = 10_000
+
+_PARENS = re.compile(r"\([^)]*\)")
+_LOCALITY = re.compile(r"^(?:г|гор|город|пгт|рп|пос|поселок|с|село|д|дер|деревня|ст|станица)(?:\.\s*|\s+)")
+_LOCALITY_TAIL = re.compile(r"\s+(?:г|город)\.?$")
+_REGION_TAIL = re.compile(r"\s+\S+\s+(?:обл|область|край|р-н|район|ао|автономный округ)\.?$")
+_REPUBLIC_TAIL = re.compile(r"\s+(?:респ|республика)\.?\s+\S+$")
+_JUNK = re.compile(r"[^\w\s]")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_city(name: str) -> str:
+    """«г. Ростов-на-Дону (Ростовская обл.)» → «ростов на дону»."""
+    s = (name or "").lower().replace("ё", "е")
+    s = _PARENS.sub(" ", s).split(",", 1)[0].strip()
+    s = _LOCALITY.sub("", s)
+    s = _REPUBLIC_TAIL.sub("", s)
+    s = _REGION_TAIL.sub("", s)
+    s = _LOCALITY_TAIL.sub("", s)
+    s = _JUNK.sub(" ", s.replace("-", " "))
+    return _SPACES.sub(" ", s).strip()
+
+
+@dataclass(slots=True)
+class CityEntry:
+    code: int
+    title: str
+    region: str | None
+    weight: int
+    source: str
+
+
+class _Node:
+    __slots__ = ("children", "entry")
+
+    def __init__(self):
+        self.children: dict[str, _Node] = {}
+        self.entry: CityEntry | None = None
+
+
+class CityTrie:
+    """Префиксное дерево нормализованных названий."""
+
+    def __init__(self):
+        self.root = _Node()
+
+    def insert(self, name: str, entry: CityEntry):
+        node = self.root
+        for ch in name:
+            node = node.children.setdefault(ch, _Node())
+        node.entry = entry
+
+    def longest_prefix(self, text: str) -> tuple[str, CityEntry] | None:
+        """Самое длинное название в начале text, кончающееся на границе слова."""
+        node, found = self.root, None
+        for i, ch in enumerate(text):
+            node = node.children.get(ch)
+            if node is None:
+                break
+            if node.entry is not None and (i + 1 == len(text) or text[i + 1] == " "):
+                found = (text[:i + 1], node.entry)
+        return found
+
+    def complete(self, prefix: str, limit: int = 10) -> list[tuple[str, CityEntry]]:
+        """Названия, начинающиеся с prefix, — крупные города первыми."""
+        node = self.root
+        for ch in prefix:
+            node = node.children.get(ch)
+            if node is None:
+                return []
+        found = []
+        stack = [(prefix, node)]
+        while stack:
+            name, node = stack.pop()
+            if node.entry is not None:
+                found.append((name, node.entry))
+            stack.extend((name + ch, child) for ch, child in node.children.items())
+        found.sort(key=lambda item: (-item[1].weight, item[0]))
+        return found[:limit]
+
+    def fuzzy(self, word: str, max_dist: int) -> tuple[str, CityEntry] | None:
+        """Ближайшее по Левенштейну название (не дальше max_dist); при равенстве — крупнейший город."""
+        best: tuple[int, int, str, CityEntry] | None = None
+        first = list(range(len(word) + 1))
+        stack = [(ch, child, first, ch) for ch, child in self.root.children.items()]
+        while stack:
+            ch, node, prev, name = stack.pop()
+            row = [prev[0] + 1]
+            for i in range(1, len(word) + 1):
+                row.append(min(row[i - 1] + 1, prev[i] + 1, prev[i - 1] + (word[i - 1] != ch)))
+            if node.entry is not None and row[-1] <= max_dist:
+                candidate = (row[-1], -node.entry.weight, name, node.entry)
+                if best is None or candidate[:3] < best[:3]:
+                    best = candidate
+            if min(row) <= max_dist:
+                stack.extend((c, child, row, name + c) for c, child in node.children.items())
+        return (best[2], best[3]) if best else None
+
+
+def _max_typos(name: str) -> int:
+    return 0 if len(name) < 4 else 1 if len(name) < 8 else 2
+
+
+def _differs_by_last_letter(query: str, name: str) -> bool:
+    """«пушкино» / «пушкин»: скорее другой город, чем опечатка."""
+    short, long = sorted((query, name), key=len)
+    return len(long) - len(short) == 1 and long.startswith(short)
+
+
+class CityResolver:
+    def __init__(self, fetch: CitiesFetch):
+        self.fetch = fetch
+        self._names: dict[str, CityEntry] = {}
+        self._trie = CityTrie()
+        self._unknown: set[str] = set()
+        self.exact_hits = 0
+        self.prefix_hits = 0
+        self.fuzzy_hits = 0
+        self.misses = 0
+        self.api_calls = 0
+        self.api_errors = 0
+        self.learned = 0
+        self.fallback_time = 0.0
+        self.fallback_max = 0.0
+
+    def _put(self, name: str, entry: CityEntry):
+        self._names[name] = entry
+        self._trie.insert(name, entry)
+
+    async def load(self):
+        """Заполняет индекс из таблицы (на старте)."""
+        async with AsyncReadSessionLocal() as sess:
+            rows = (await sess.scalars(select(CdekCityName))).all()
+        for row in rows:
+            self._put(row.name, CityEntry(row.code, row.title, row.region, row.weight, row.source))
+        logger.info(f"Города СДЭК: загружено {len(self._names)} названий")
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    # ---------- поиск ----------
+
+    def lookup(self, name: str) -> CityEntry | None:
+        """Только из памяти: точное название, затем самое длинное в начале строки."""
+        query = normalize_city(name)
+        if not query:
+            return None
+        entry = self._names.get(query)
+        if entry is not None:
+            self.exact_hits += 1
+            return entry
+        found = self._trie.longest_prefix(" ".join(query.split(" ")[:MAX_NAME_WORDS]))
+        if found is not None:
+            self.prefix_hits += 1
+            return found[1]
+        return None
+
+    def correct(self, name: str) -> CityEntry | None:
+        """Название с опечаткой — из памяти; в resolve() только после API."""
+        words = normalize_city(name).split(" ")[:MAX_NAME_WORDS]
+        # Сначала весь запрос, потом всё более короткие наборы первых слов
+        for n in range(len(words), 0, -1):
+            candidate = " ".join(words[:n])
+            found = self._trie.fuzzy(candidate, _max_typos(candidate))
+            if found is not None:
+                if _differs_by_last_letter(candidate, found[0]):
+                    return None
+                return found[1]
+        return None
+
+    def suggest(self, prefix: str, limit: int = 10) -> list[CityEntry]:
+        """Города, чьё название начинается с prefix."""
+        query = normalize_city(prefix)
+        return [entry for _, entry in self._trie.complete(query, limit)] if query else []
+
+    async def resolve(self, name: str) -> int | None:
+        """
+        city_code по названию: из памяти, на промахе — из API (ответ запоминается);
+        API не нашёл или не ответил — название с опечаткой из памяти.
+        """
+        entry = self.lookup(name)
+        if entry is not None:
+            return entry.code
+        query = normalize_city(name)
+        if not query:
+            return None
+        self.misses += 1
+        code = None if query in self._unknown else await self._resolve_live(name, query)
+        if code is None:
+            entry = self.correct(name)
+            if entry is not None:
+                self.fuzzy_hits += 1
+                return entry.code
+        return code
+
+    async def _resolve_live(self, name: str, query: str) -> int | None:
+        started = time.perf_counter()
+        self.api_calls += 1
+        try:
+            cities = await self.fetch(name.strip())
+        finally:
+            elapsed = time.perf_counter() - started
+            self.fallback_time += elapsed
+            self.fallback_max = max(self.fallback_max, elapsed)
+        if cities is None:
+            self.api_errors += 1
+            return None
+        if not cities or cities[0].get("code") is None:
+            if len(self._unknown) >= MAX_UNKNOWN:
+                self._unknown.clear()
+            self._unknown.add(query)
+            return None
+        city = cities[0]
+        entry = CityEntry(int(city["code"]), city.get("city") or name.strip(), city.get("region"), 0, "api")
+        names = {query}
+        official = normalize_city(entry.title)
+        if official and official not in self._names:
+            names.add(official)
+        try:
+            await self._store({n: entry for n in names})
+            self.learned += len(names)
+        except Exception as e:
+            logger.error(f"Города СДЭК: не удалось сохранить '{name}' → {entry.code}: {e}")
+        return entry.code
+
+    # ---------- запись ----------
+
+    async def _store(self, entries: dict[str, CityEntry]):
+        rows = [{"name": name, "code": e.code, "title": e.title[:128], "region": e.region[:128] if e.region else None,
+                 "weight": e.weight, "source": e.source} for name, e in entries.items()]
+
+        async def unit(session):
+            insert = dialect_insert(session)
+            stmt = insert(CdekCityName).values(rows)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[CdekCityName.name],
+                set_={c: stmt.excluded[c] for c in ("code", "title", "region", "weight", "source")},
+            )
+            await session.execute(stmt)
+
+        if rows:
+            await write_queue.submit(unit)
+        for name, entry in entries.items():
+            self._put(name, entry)
+            self._unknown.discard(name)
+
+    async def sync_from_points(self, cities: Iterable[tuple[int, str, str | None, int]]) -> int:
+        """
+        Названия городов из справочника ПВЗ: (city_code, город, регион, число ПВЗ).
+        Пишутся только новые и изменившиеся названия. Возвращает их число.
+        """
+        best: dict[str, CityEntry] = {}
+        for code, title, region, weight in cities:
+            name = normalize_city(title)
+            if name and (name not in best or weight > best[name].weight):
+                best[name] = CityEntry(code, title, region, weight, "pvz")
+        changed = {name: entry for name, entry in best.items() if self._names.get(name) != entry}
+        for start in range(0, len(changed), 500):
+            await self._store(dict(list(changed.items())[start:start + 500]))
+        self._unknown.clear()
+        logger.info(f"Города СДЭК: из справочника ПВЗ {len(best)} названий, изменилось {len(changed)}")
+        return len(changed)
+
+    def stats(self) -> dict:
+        hits = self.exact_hits + self.prefix_hits
+        lookups = hits + self.misses
+        return {
+            "names": len(self._names),
+            "exact_hits": self.exact_hits,
+            "prefix_hits": self.prefix_hits,
+            "fuzzy_hits": self.fuzzy_hits,
+            "misses": self.misses,
+            "hit_ratio": round(hits / lookups, 3) if lookups else None,
+            "api_calls": self.api_calls,
+            "api_errors": self.api_errors,
+            "learned": self.learned,
+            "fallback_avg_ms": round(self.fallback_time / self.api_calls * 1000, 1) if self.api_calls else None,
+            "fallback_max_ms": round(self.fallback_max * 1000, 1) if self.api_calls else None,
+        }
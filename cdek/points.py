@@ -0,0 +1,328 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Awaitable, Callable
+
+from sqlalchemy import delete, select, update
+
+from db.async_repo import AsyncReadSessionLocal
+from db.models import CdekDeliveryPoint, CdekSyncState
+from db.repo import dialect_insert
+from db.write_queue import write_queue
+
+logger = logging.getLogger("box_bot")
+
+# ==================== Локальный справочник ПВЗ СДЭК ====================
+# Поиск ПВЗ скачивал справочник на каждый запрос: ввод кода — до 3000 точек по всей
+# России с линейным поиском, поиск по адресу — до 1000 точек города. Теперь
+# справочник /v2/deliverypoints лежит в таблице cdek_delivery_points и в памяти
+# (код → точка, city_code → точки), поиск идёт по памяти.
+#
+#   - sync() (в bot.py — раз в Config.CDEK_POINTS_SYNC_SEC) обходит справочник
+#     страницами по CDEK_POINTS_PAGE_SIZE и пишет (через write_queue) только точки,
+#     у которых изменился хэш; точки, которых нет в полном обходе, удаляются;
+#   - время последнего полного обхода хранится в cdek_sync_state: обход без
+#     изменений ничего не пишет в cdek_delivery_points, а записи промахов — не обход;
+#   - промах (кода или города нет в памяти) — запрос в живой API, ответ
+#     запоминается в таблице и в памяти; пустой ответ помнится до следующего sync().
+#     Точка, найденная по коду в незнакомом городе, пишется с partial = true: после
+#     перезапуска такой город по-прежнему считается неполным.
+#
+# fetch(params) — запрос /v2/deliverypoints (в bot.py — с прод-токеном):
+# список точек или None при ошибке API.
+
+CDEK_POINTS_PAGE_SIZE = int(os.getenv("CDEK_POINTS_PAGE_SIZE", "1000"))
+# Строка cdek_sync_state этого справочника
+SYNC_STATE_NAME = "delivery_points"
+# Тип точек — как в прежнем поиске: только ПВЗ (без постаматов)
+POINT_TYPE = "PVZ"
+COUNTRY_CODE = "RU"
+# Строк на один INSERT ... ON CONFLICT (единица очереди записи)
+WRITE_CHUNK = 500
+# Если полный обход вернул меньше этой доли известных точек — удаление пропускается
+# (справочник пришёл неполным: сбой API, а не закрытие половины ПВЗ)
+MIN_SEEN_SHARE = 0.5
+
+PointsFetch = Callable[[dict], Awaitable[list[dict] | None]]
+
+
+@dataclass(slots=True)
+class SyncResult:
+    complete: bool
+    pages: int = 0
+    seen: int = 0
+    changed: int = 0
+    removed: int = 0
+    duration: float = 0.0
+
+
+def point_hash(point: dict) -> str:
+    raw = json.dumps(point, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+
+def _city_code(point: dict) -> int | None:
+    code = (point.get("location") or {}).get("city_code")
+    try:
+        return int(code) if code is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class DeliveryPointCatalog:
+    def __init__(self, fetch: PointsFetch, page_size: int = CDEK_POINTS_PAGE_SIZE):
+        self.fetch = fetch
+        self.page_size = page_size
+        self._by_code: dict[str, dict] = {}        # КОД В ВЕРХНЕМ РЕГИСТРЕ → точка
+        self._hashes: dict[str, str] = {}
+        self._by_city: dict[int, dict[str, dict]] = {}
+        self._empty: set[tuple[str, str | int]] = set()  # ("code", код) / ("city", city_code) без точек
+        # Города, известные только по точкам, найденным по коду: их список ПВЗ неполон
+        self._partial_cities: set[int] = set()
+        self._sync_lock = asyncio.Lock()
+        self.last_sync: SyncResult | None = None
+        self.last_sync_at: datetime | None = None
+        self.hits = 0
+        self.misses = 0
+        self.api_fallbacks = 0
+        self.api_errors = 0
+
+    # ---------- индекс в памяти ----------
+
+    def _index(self, code: str, point: dict, digest: str):
+        key = code.upper()
+        old = self._by_code.get(key)
+        if old is not None:
+            self._unindex_city(key, old)
+        self._by_code[key] = point
+        self._hashes[key] = digest
+        city = _city_code(point)
+        if city is not None:
+            self._by_city.setdefault(city, {})[key] = point
+
+    def _unindex_city(self, key: str, point: dict):
+        city = _city_code(point)
+        points = self._by_city.get(city)
+        if points is not None:
+            points.pop(key, None)
+            if not points:
+                del self._by_city[city]
+
+    def _unindex(self, key: str):
+        point = self._by_code.pop(key, None)
+        self._hashes.pop(key, None)
+        if point is not None:
+            self._unindex_city(key, point)
+
+    async def load(self):
+        """Заполняет индекс из таблицы (на старте)."""
+        async with AsyncReadSessionLocal() as sess:
+            rows = (await sess.execute(
+                select(CdekDeliveryPoint.code, CdekDeliveryPoint.data, CdekDeliveryPoint.data_hash,
+                       CdekDeliveryPoint.partial)
+            )).all()
+            last = await sess.scalar(select(CdekSyncState.synced_at).where(CdekSyncState.name == SYNC_STATE_NAME))
+        for code, data, digest, partial in rows:
+            self._index(code, data, digest)
+            if partial and _city_code(data) is not None:
+                self._partial_cities.add(_city_code(data))
+        if last is not None and last.tzinfo is None:
+            last = last.replace(tzinfo=timezone.utc)
+        self.last_sync_at = last
+        logger.info(f"Справочник ПВЗ: загружено {len(self._by_code)} точек в {len(self._by_city)} городах")
+
+    # ---------- поиск ----------
+
+    async def get(self, code: str) -> dict | None:
+        """Точка по коду; нет в справочнике — из живого API."""
+        key = code.strip().upper()
+        point = self._by_code.get(key)
+        if point is not None or ("code", key) in self._empty:
+            self.hits += 1
+            return point
+        self.misses += 1
+        points = await self._fetch_live({"code": key}, ("code", key), partial=True)
+        return next((p for p in points if str(p.get("code", "")).upper() == key), None)
+
+    async def city_points(self, city_code: int) -> list[dict]:
+        """Все ПВЗ города; города нет в справочнике — из живого API."""
+        city_code = int(city_code)
+        points = self._by_city.get(city_code)
+        if (points is not None and city_code not in self._partial_cities) or ("city", city_code) in self._empty:
+            self.hits += 1
+            return list(points.values()) if points else []
+        self.misses += 1
+        return await self._fetch_live({"city_code": city_code}, ("city", city_code))
+
+    async def _fetch_live(self, params: dict, empty_key: tuple[str, str | int], partial: bool = False) -> list[dict]:
+        self.api_fallbacks += 1
+        points = await self.fetch({"type": POINT_TYPE, **params})
+        if points is None:
+            self.api_errors += 1
+            return []
+        if not points:
+            self._empty.add(empty_key)
+            return []
+        cities = {_city_code(p) for p in points} - {None}
+        if partial:
+            self._partial_cities |= cities - self._by_city.keys()
+        else:
+            self._partial_cities -= cities
+        try:
+            await self._store(points, partial)
+        except Exception as e:
+            # Ответ API всё равно отдаём — запомним при следующем промахе или sync()
+            logger.error(f"Справочник ПВЗ: не удалось сохранить ответ API {params}: {e}")
+        return points
+
+    # ---------- запись ----------
+
+    async def _store(self, points: list[dict], partial: bool = False):
+        """Upsert точек в таблицу; после commit — в индекс. partial — ответ поиска по коду."""
+        now = datetime.now(timezone.utc)
+        rows = []
+        for point in points:
+            code = str(point.get("code") or "")
+            if code:
+                city = _city_code(point)
+                rows.append({"code": code, "city_code": city, "data": point, "data_hash": point_hash(point),
+                             "synced_at": now, "partial": partial and city in self._partial_cities})
+        for start in range(0, len(rows), WRITE_CHUNK):
+            chunk = rows[start:start + WRITE_CHUNK]
+
+            async def unit(session, chunk=chunk):
+                insert = dialect_insert(session)
+                stmt = insert(CdekDeliveryPoint).values(chunk)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[CdekDeliveryPoint.code],
+                    set_={name: stmt.excluded[name]
+                          for name in ("city_code", "data", "data_hash", "synced_at", "partial")},
+                )
+                await session.execute(stmt)
+
+            await write_queue.submit(unit)
+            for row in chunk:
+                self._index(row["code"], row["data"], row["data_hash"])
+                self._empty.discard(("code", row["code"].upper()))
+                if row["city_code"] is not None:
+                    self._empty.discard(("city", row["city_code"]))
+
+    async def _remove(self, keys: list[str]):
+        codes = [str(self._by_code[key].get("code")) for key in keys]
+        for start in range(0, len(codes), WRITE_CHUNK):
+            chunk = codes[start:start + WRITE_CHUNK]
+
+            async def unit(session, chunk=chunk):
+                await session.execute(delete(CdekDeliveryPoint).where(CdekDeliveryPoint.code.in_(chunk)))
+
+            await write_queue.submit(unit)
+        for key in keys:
+            self._unindex(key)
+
+    # ---------- синхронизация ----------
+
+    async def sync(self) -> SyncResult:
+        """Полный обход справочника; пишутся только изменившиеся точки."""
+        async with self._sync_lock:
+            started = time.monotonic()
+            result = SyncResult(complete=False)
+            seen: set[str] = set()
+            page = 0
+            while True:
+                points = await self.fetch({"type": POINT_TYPE, "country_code": COUNTRY_CODE,
+                                           "page": page, "size": self.page_size})
+                if points is None:
+                    logger.error(f"Справочник ПВЗ: обход прерван на странице {page}, удаление пропущено")
+                    break
+                result.pages += 1
+                changed = []
+                for point in points:
+                    key = str(point.get("code") or "").upper()
+                    if not key:
+                        continue
+                    seen.add(key)
+                    if self._hashes.get(key) != point_hash(point):
+                        changed.append(point)
+                if changed:
+                    await self._store(changed)
+                    result.changed += len(changed)
+                if len(points) < self.page_size:
+                    result.complete = True
+                    break
+                page += 1
+            result.seen = len(seen)
+
+            if result.complete:
+                gone = [key for key in self._by_code if key not in seen]
+                if gone and len(seen) < len(self._by_code) * MIN_SEEN_SHARE:
+                    logger.warning(f"Справочник ПВЗ: пришло {len(seen)} точек из {len(self._by_code)} известных — "
+                                   f"удаление {len(gone)} пропущено")
+                    # Не полный обход: время sync не обновляется, bot.py повторит раньше
+                    result.complete = False
+                elif gone:
+                    await self._remove(gone)
+                    result.removed = len(gone)
+            if result.complete:
+                await self._mark_synced(datetime.now(timezone.utc))
+                self._empty.clear()
+                self._partial_cities.clear()
+
+            result.duration = time.monotonic() - started
+            self.last_sync = result
+            logger.info(f"Справочник ПВЗ: страниц {result.pages}, точек {result.seen}, изменилось {result.changed}, "
+                        f"удалено {result.removed}, {result.duration:.1f} с{'' if result.complete else ' (не полностью)'}")
+            return result
+
+    async def _mark_synced(self, now: datetime):
+        """После полного обхода: все точки известны полностью, время обхода — в cdek_sync_state."""
+        async def unit(session):
+            await session.execute(update(CdekDeliveryPoint).where(CdekDeliveryPoint.partial).values(partial=False))
+            insert = dialect_insert(session)
+            stmt = insert(CdekSyncState).values(name=SYNC_STATE_NAME, synced_at=now)
+            await session.execute(stmt.on_conflict_do_update(
+                index_elements=[CdekSyncState.name], set_={"synced_at": stmt.excluded.synced_at},
+            ))
+
+        await write_queue.submit(unit)
+        self.last_sync_at = now
+
+    def cities(self) -> list[tuple[int, str, str | None, int]]:
+        """(city_code, город, регион, число ПВЗ) по справочнику — для cdek.cities."""
+        result = []
+        for city_code, points in self._by_city.items():
+            location = next(iter(points.values())).get("location") or {}
+            if location.get("city"):
+                result.append((city_code, location["city"], location.get("region"), len(points)))
+        return result
+
+    def sync_due_in(self, interval: float) -> float:
+        """Через сколько секунд следующий sync() (0 — пора)."""
+        if not self._by_code or self.last_sync_at is None:
+            return 0.0
+        age = (datetime.now(timezone.utc) - self.last_sync_at).total_seconds()
+        return max(0.0, interval - age)
+
+    def stats(self) -> dict:
+        last = self.last_sync
+        lookups = self.hits + self.misses
+        return {
+            "points": len(self._by_code),
+            "cities": len(self._by_city),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+            "api_fallbacks": self.api_fallbacks,
+            "api_errors": self.api_errors,
+            "last_sync_at": self.last_sync_at.isoformat() if self.last_sync_at else None,
+            "last_sync": {
+                "complete": last.complete, "pages": last.pages, "seen": last.seen,
+                "changed": last.changed, "removed": last.removed, "duration_sec": round(last.duration, 1),
+            } if last else None,
+        }
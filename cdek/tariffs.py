@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Awaitable, Callable
+
+from sqlalchemy import delete, select
+
+from db.async_repo import AsyncReadSessionLocal
+from db.models import CdekTariffQuote
+from db.repo import dialect_insert
+from db.write_queue import write_queue
+
+logger = logging.getLogger("box_bot")
+
+# ==================== Кэш расчёта тарифов СДЭК ====================
+# Каждое нажатие на ПВЗ (cb_pvz_select) и отправка заказа (cb_admin_set_shipped)
+# ждали /v2/calculator/tarifflist, хотя для нашего пункта отправки и одной коробки
+# список тарифов до конкретного ПВЗ меняется редко. TariffQuoteCache хранит ответ
+# (tariff_codes) по ключу (пункт отправки, ПВЗ получателя, габариты) в памяти и
+# в таблице cdek_tariff_quotes — кэш переживает перезапуск:
+#
+#   - моложе CDEK_TARIFF_TTL_SEC — из кэша;
+#   - старше, но моложе CDEK_TARIFF_MAX_STALE_SEC — из кэша сразу, а свежий
+#     расчёт — в фоне (stale-while-revalidate);
+#   - старше или нет в кэше — ждём API. Если API не ответил, а в кэше есть хоть
+#     что-то, отдаём это (лучше старый тариф, чем цена по умолчанию).
+#
+# Запрос по одному ключу — один на всех (как токены в cdek.tokens). Ошибки API не
+# кэшируются. Габариты — часть ключа, а load(profile) на старте удаляет расчёты
+# для других габаритов: изменили Config.PACKAGE_* — старые цены не используются.
+
+CDEK_TARIFF_TTL_SEC = float(os.getenv("CDEK_TARIFF_TTL_SEC", "21600"))
+CDEK_TARIFF_MAX_STALE_SEC = float(os.getenv("CDEK_TARIFF_MAX_STALE_SEC", "604800"))
+
+
+@dataclass(slots=True, frozen=True)
+class PackageProfile:
+    weight_g: int
+    length_cm: int
+    width_cm: int
+    height_cm: int
+
+    @property
+    def key(self) -> str:
+        return f"{self.weight_g}g-{self.length_cm}x{self.width_cm}x{self.height_cm}"
+
+
+@dataclass(slots=True, frozen=True)
+class QuoteKey:
+    from_city: int
+    from_point: str
+    to_city: int
+    to_point: str
+    package: PackageProfile
+
+    @property
+    def id(self) -> tuple[str, str, str]:
+        return self.from_point, self.to_point, self.package.key
+
+
+@dataclass(slots=True)
+class _Quote:
+    tariffs: list[dict]
+    fetched_at: float  # time.time(): возраст считается и после перезапуска
+
+
+TariffsFetch = Callable[[QuoteKey], Awaitable[list[dict] | None]]
+
+
+class TariffQuoteCache:
+    def __init__(self, fetch: TariffsFetch, ttl: float = CDEK_TARIFF_TTL_SEC,
+                 max_stale: float = CDEK_TARIFF_MAX_STALE_SEC):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self._quotes: dict[tuple[str, str, str], _Quote] = {}
+        self._inflight: dict[tuple[str, str, str], asyncio.Future] = {}
+        self.fresh_hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.joined = 0
+        self.fetches = 0
+        self.fetch_failures = 0
+        self.stale_on_error = 0
+
+    async def load(self, profile: PackageProfile):
+        """Заполняет кэш из таблицы (на старте); расчёты для других габаритов удаляются."""
+        async with AsyncReadSessionLocal() as sess:
+            rows = (await sess.scalars(select(CdekTariffQuote))).all()
+        outdated = 0
+        for row in rows:
+            if row.profile != profile.key:
+                outdated += 1
+                continue
+            fetched_at = row.fetched_at
+            if fetched_at.tzinfo is None:
+                fetched_at = fetched_at.replace(tzinfo=timezone.utc)
+            self._quotes[(row.from_point, row.to_point, row.profile)] = _Quote(row.tariffs, fetched_at.timestamp())
+        if outdated:
+            async def unit(session):
+                await session.execute(delete(CdekTariffQuote).where(CdekTariffQuote.profile != profile.key))
+
+            await write_queue.submit(unit)
+            logger.info(f"Тарифы СДЭК: удалено {outdated} расчётов для прежних габаритов посылки")
+        logger.info(f"Тарифы СДЭК: загружено {len(self._quotes)} расчётов ({profile.key})")
+
+    async def get(self, key: QuoteKey) -> list[dict] | None:
+        """Список тарифов (tariff_codes); None — API не ответил и в кэше ничего нет."""
+        quote = self._quotes.get(key.id)
+        if quote is not None:
+            age = time.time() - quote.fetched_at
+            if age < self.ttl:
+                self.fresh_hits += 1
+                return quote.tariffs
+            if age < self.max_stale:
+                self.stale_hits += 1
+                if key.id not in self._inflight:
+                    self._start_fetch(key)
+                return quote.tariffs
+        self.misses += 1
+        return await self._refresh(key)
+
+    async def _refresh(self, key: QuoteKey) -> list[dict] | None:
+        future = self._inflight.get(key.id)
+        if future is None:
+            future = self._start_fetch(key)
+        else:
+            self.joined += 1
+        # shield: отмена одного ожидающего не отменяет расчёт для остальных
+        tariffs = await asyncio.shield(future)
+        if tariffs is None:
+            quote = self._quotes.get(key.id)
+            if quote is not None:
+                self.stale_on_error += 1
+                logger.warning(f"Тарифы СДЭК {key.to_point}: API не ответил, отдаём расчёт "
+                               f"{(time.time() - quote.fetched_at) / 3600:.0f} ч давности")
+                return quote.tariffs
+        return tariffs
+
+    def _start_fetch(self, key: QuoteKey) -> asyncio.Future:
+        future = asyncio.ensure_future(self._fetch(key))
+        self._inflight[key.id] = future
+        future.add_done_callback(lambda f: self._fetch_done(key, f))
+        return future
+
+    def _fetch_done(self, key: QuoteKey, future: asyncio.Future):
+        self._inflight.pop(key.id, None)
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"Тарифы СДЭК {key.to_point}: ошибка обновления: {future.exception()!r}")
+
+    async def _fetch(self, key: QuoteKey) -> list[dict] | None:
+        self.fetches += 1
+        try:
+            tariffs = await self.fetch(key)
+        except Exception as e:
+            logger.error(f"Тарифы СДЭК {key.to_point}: {e}")
+            tariffs = None
+        if tariffs is None:
+            self.fetch_failures += 1
+            return None
+        quote = _Quote(tariffs, time.time())
+        self._quotes[key.id] = quote
+        row = {"from_point": key.from_point, "to_point": key.to_point, "profile": key.package.key,
+               "from_city": key.from_city, "to_city": key.to_city, "tariffs": tariffs,
+               "fetched_at": datetime.fromtimestamp(quote.fetched_at, timezone.utc)}
+
+        async def unit(session):
+            insert = dialect_insert(session)
+            stmt = insert(CdekTariffQuote).values(row)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[CdekTariffQuote.from_point, CdekTariffQuote.to_point, CdekTariffQuote.profile],
+                set_={c: stmt.excluded[c] for c in ("from_city", "to_city", "tariffs", "fetched_at")},
+            )
+            await session.execute(stmt)
+
+        # Пользователь не ждёт записи: ошибка уйдёт в лог, в памяти расчёт уже есть
+        write_queue.submit_nowait(unit)
+        return tariffs
+
+    def stats(self) -> dict:
+        lookups = self.fresh_hits + self.stale_hits + self.misses
+        return {
+            "quotes": len(self._quotes),
+            "fresh_hits": self.fresh_hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.fresh_hits + self.stale_hits) / lookups, 3) if lookups else None,
+            "joined": self.joined,
+            "fetches": self.fetches,
+            "fetch_failures": self.fetch_failures,
+            "stale_on_error": self.stale_on_error,
+        }
@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+
+from net.http import Upstream
+
+logger = logging.getLogger("box_bot")
+
+# ==================== OAuth-токены СДЭК ====================
+# Токен /v2/oauth/token живёт expires_in секунд (у СДЭК — час), а запрашивали его
+# на каждый вызов API: поиск ПВЗ — два токена, проверка отправленных заказов —
+# по токену на заказ. CdekTokenManager держит токен в памяти:
+#
+#   - до истечения больше REFRESH_AHEAD_SEC — отдаём из памяти;
+#   - меньше REFRESH_AHEAD_SEC — отдаём из памяти и обновляем в фоне;
+#   - меньше EXPIRY_MARGIN_SEC (или токена нет) — ждём обновления.
+#
+# Обновление одно на всех (singleflight): кто пришёл, пока токен запрашивается,
+# ждёт тот же запрос. Если фоновое обновление не удалось, старый токен служит
+# до EXPIRY_MARGIN_SEC, а следующая фоновая попытка — не раньше чем через
+# RETRY_SEC. invalidate() — выбросить токен, на который API ответил 401.
+
+CDEK_TOKEN_REFRESH_AHEAD_SEC = float(os.getenv("CDEK_TOKEN_REFRESH_AHEAD_SEC", "300"))
+CDEK_TOKEN_EXPIRY_MARGIN_SEC = float(os.getenv("CDEK_TOKEN_EXPIRY_MARGIN_SEC", "30"))
+CDEK_TOKEN_RETRY_SEC = float(os.getenv("CDEK_TOKEN_RETRY_SEC", "30"))
+# Если СДЭК не прислал expires_in
+DEFAULT_EXPIRES_IN = 3600
+
+
+@dataclass(slots=True, frozen=True)
+class _Token:
+    value: str
+    expires_at: float  # time.monotonic()
+
+
+class CdekTokenManager:
+    def __init__(self, name: str, http: Upstream, client_id: str | None, client_secret: str | None,
+                 refresh_ahead: float = CDEK_TOKEN_REFRESH_AHEAD_SEC,
+                 expiry_margin: float = CDEK_TOKEN_EXPIRY_MARGIN_SEC,
+                 retry_delay: float = CDEK_TOKEN_RETRY_SEC):
+        self.name = name
+        self.http = http
+        self.client_id = (client_id or "").strip()
+        self.client_secret = (client_secret or "").strip()
+        self.refresh_ahead = refresh_ahead
+        self.expiry_margin = expiry_margin
+        self.retry_delay = retry_delay
+        self._retry_at = 0.0
+        self._token: _Token | None = None
+        self._inflight: asyncio.Future | None = None
+        self.hits = 0
+        self.fetches = 0
+        self.fetch_failures = 0
+        self.background_refreshes = 0
+        self.joined = 0
+        self.invalidations = 0
+
+    async def get(self) -> str | None:
+        """Действующий токен; None — не удалось получить (ошибка уже в логе)."""
+        token = self._token
+        if token is not None:
+            now = time.monotonic()
+            left = token.expires_at - now
+            if left > self.expiry_margin:
+                self.hits += 1
+                if left <= self.refresh_ahead and self._inflight is None and now >= self._retry_at:
+                    self.background_refreshes += 1
+                    self._start_refresh()
+                return token.value
+        return await self._refresh()
+
+    def invalidate(self, value: str | None = None):
+        """Забыть токен (API ответил 401). С value — только если это всё ещё он."""
+        if self._token is not None and (value is None or self._token.value == value):
+            self._token = None
+            self.invalidations += 1
+
+    async def _refresh(self) -> str | None:
+        if self._inflight is None:
+            self._start_refresh()
+        else:
+            self.joined += 1
+        # shield: отмена одного ожидающего не отменяет запрос для остальных
+        return await asyncio.shield(self._inflight)
+
+    def _start_refresh(self):
+        self._inflight = asyncio.ensure_future(self._fetch())
+        self._inflight.add_done_callback(self._refresh_done)
+
+    def _refresh_done(self, future: asyncio.Future):
+        self._inflight = None
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"СДЭК {self.name}: ошибка обновления токена: {future.exception()!r}")
+
+    async def _fetch(self) -> str | None:
+        if not self.client_id or not self.client_secret:
+            logger.error(f"СДЭК {self.name}: ключи пустые или отсутствуют!")
+            return None
+        self.fetches += 1
+        data = {"grant_type": "client_credentials", "client_id": self.client_id, "client_secret": self.client_secret}
+        response = None
+        try:
+            response = await self.http.post("/v2/oauth/token", data=data)
+            response.raise_for_status()
+            body = response.json()
+        except Exception as e:
+            self._failed()
+            logger.error(f"СДЭК {self.name}: ошибка получения токена: {e}")
+            if response is not None:
+                logger.error(f"Ответ: {response.status_code} {response.text[:500]}")
+            return None
+        value = body.get("access_token")
+        if not value:
+            self._failed()
+            logger.error(f"СДЭК {self.name}: токен не пришёл в ответе")
+            return None
+        expires_in = float(body.get("expires_in") or DEFAULT_EXPIRES_IN)
+        self._token = _Token(value, time.monotonic() + expires_in)
+        logger.info(f"СДЭК {self.name}: токен получен, действует {expires_in:.0f} с")
+        return value
+
+    def _failed(self):
+        self.fetch_failures += 1
+        self._retry_at = time.monotonic() + self.retry_delay
+
+    def stats(self) -> dict:
+        token = self._token
+        return {
+            "hits": self.hits,
+            "fetches": self.fetches,
+            "fetch_failures": self.fetch_failures,
+            "background_refreshes": self.background_refreshes,
+            "joined": self.joined,
+            "invalidations": self.invalidations,
+            "expires_in_sec": round(token.expires_at - time.monotonic()) if token else None,
+        }
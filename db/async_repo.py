@@ -0,0 +1,477 @@
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import delete, func, insert, literal, null, select, update
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from typing import Iterable, List
+
+from sqlalchemy.orm import joinedload, raiseload
+
+from .models import (
+    User, Product, Order, OrderAll, OrderEvent, OrderStatusCount, Payment, Access, RedeemCode, RedeemUse,
+    TZDateTime, orders_archive, payments_archive,
+)
+from .order_events import record_order_event, requeue, take_buffered
+from .read_model import get_user_state_row
+from .sql_profiler import SQL_PROFILING, sql_profiler
+from .repo import database_url, engine_kwargs, install_backend_setup, load_profile
+from .state_cache import STATE_FIELDS, configure_for, invalidate_on_commit, user_state_cache
+
+
+# Асинхронная версия db.repo для обработчиков aiogram (AsyncSession поверх aiosqlite/asyncpg).
+# Запросы и commit больше не блокируют event loop — медленный commit одного
+# пользователя не замораживает апдейты остальных.
+# Синхронный db.repo остаётся для инициализации БД на старте и для скриптов.
+
+def make_async_engine(db: str = "app.sqlite3", pragmas: dict | None = None,
+                      readonly: bool = False) -> AsyncEngine:
+    # db — путь к SQLite или URL БД (см. db.repo.database_url)
+    url = database_url(db, use_async=True)
+    engine = create_async_engine(url, **engine_kwargs(url))
+    install_backend_setup(engine.sync_engine, pragmas, readonly=readonly)
+    return engine
+
+
+# ==================== Engine на весь процесс ====================
+# expire_on_commit=False: после commit атрибуты не перечитываются лениво
+# (ленивая загрузка в AsyncSession невозможна без явного await).
+_async_engine: AsyncEngine | None = None
+_async_read_engine: AsyncEngine | None = None
+
+AsyncSessionLocal = async_sessionmaker(expire_on_commit=False)
+AsyncReadSessionLocal = async_sessionmaker(expire_on_commit=False)
+
+
+def init_async_engine(db: str = "app.sqlite3") -> AsyncEngine:
+    """Создаёт общий AsyncEngine (пишущий + read-only пул) и привязывает к ним сессии."""
+    global _async_engine, _async_read_engine
+    if _async_engine is None:
+        configure_for(db)
+        _async_engine = make_async_engine(db)
+        AsyncSessionLocal.configure(bind=_async_engine)
+        if SQL_PROFILING:
+            sql_profiler.install(_async_engine)
+    if _async_read_engine is None:
+        _async_read_engine = make_async_engine(db, readonly=True)
+        AsyncReadSessionLocal.configure(bind=_async_read_engine)
+        if SQL_PROFILING:
+            sql_profiler.install(_async_read_engine)
+    return _async_engine
+
+
+def get_async_engine() -> AsyncEngine:
+    if _async_engine is None:
+        raise RuntimeError("AsyncEngine не инициализирован — вызовите init_async_engine() при старте")
+    return _async_engine
+
+
+async def dispose_async_engine():
+    """Закрывает асинхронные пулы. Вызывается при остановке приложения."""
+    global _async_engine, _async_read_engine
+    if _async_read_engine is not None:
+        await _async_read_engine.dispose()
+        _async_read_engine = None
+        AsyncReadSessionLocal.configure(bind=None)
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = None
+        AsyncSessionLocal.configure(bind=None)
+
+
+async def get_or_create_user(session: AsyncSession, telegram_id: int, username: str | None = None) -> User:
+    user = await session.get(User, telegram_id)
+    if user is None:
+        user = User(
+            telegram_id=telegram_id,
+            username=username,
+            created_at=datetime.now(timezone.utc),
+            updated_at=datetime.now(timezone.utc)
+        )
+        session.add(user)
+        await session.flush()  # чтобы получить ID если понадобится
+        # создаём access по умолчанию
+        session.add(Access(user_id=telegram_id))
+    else:
+        if username and user.username != username:
+            user.username = username
+        user.updated_at = datetime.now(timezone.utc)
+    await session.refresh(user)
+    return user
+
+
+async def ensure_product(session: AsyncSession, code: str, title: str, description: str = "",
+                         price_kop: int = 0) -> Product:
+    product = await session.scalar(select(Product).where(Product.code == code))
+    if product is None:
+        product = Product(
+            code=code,
+            title=title,
+            description=description,
+            price_kop=price_kop,
+            is_active=True
+        )
+        session.add(product)
+        await session.flush()
+    return product
+
+
+async def update_user_state(session: AsyncSession, user: User):
+    await session.merge(user)
+    await session.commit()
+
+
+async def get_user_by_id(session: AsyncSession, telegram_id: int, profile: str = "state-only") -> User | None:
+    # populate_existing вместо get + refresh: один SELECT, свежие данные даже из identity map
+    return await session.get(User, telegram_id, options=load_profile(profile), populate_existing=True)
+
+
+async def get_user_state(session: AsyncSession, telegram_id: int) -> dict | None:
+    """Состояние пользователя (см. db.state_cache.STATE_FIELDS) — из кэша или лёгким SELECT."""
+    state = user_state_cache.get(telegram_id)
+    if state is not None:
+        return state
+    token = user_state_cache.write_token()
+    row = await get_user_state_row(session, telegram_id)
+    if row is None:
+        return None
+    state = dict(zip(STATE_FIELDS, row))
+    user_state_cache.fill(telegram_id, state, token)
+    return state
+
+
+async def create_order_db(session: AsyncSession, user_id: int, **kwargs) -> Order:
+    order = Order(user_id=user_id, **kwargs)
+    session.add(order)
+    await session.commit()
+    return order
+
+
+# Сброс ввода пользователя: флаги awaiting_* и временные данные текущей операции
+INPUT_STATE_RESET = {
+    "awaiting_redeem_code": False,
+    "awaiting_auth": False,
+    "awaiting_gift_message": False,
+    "awaiting_pvz_address": False,
+    "awaiting_manual_pvz": False,
+    "awaiting_manual_track": False,
+    "pvz_for_order_id": None,
+    "temp_gift_order_id": None,
+    "temp_pvz_list": null(),  # SQL NULL, а не JSON 'null'
+    "temp_selected_pvz": null(),
+    "temp_order_id_for_track": None,
+}
+
+
+async def reset_user_input_state(session: AsyncSession, telegram_id: int,
+                                 fields: Iterable[str] | None = None) -> bool:
+    """
+    Сбрасывает поля INPUT_STATE_RESET (или только fields) одним UPDATE.
+    Кэш состояния сбрасывается после commit. Возвращает, нашёлся ли пользователь.
+    Commit — на вызывающей стороне.
+    """
+    values = INPUT_STATE_RESET if fields is None else {f: INPUT_STATE_RESET[f] for f in fields}
+    result = await session.execute(update(User).where(User.telegram_id == telegram_id).values(**values))
+    invalidate_on_commit(session, telegram_id)
+    return result.rowcount > 0
+
+
+async def abandon_new_orders(session: AsyncSession, user_id: int) -> list[int]:
+    """
+    Все NEW-заказы пользователя → abandoned одним UPDATE ... RETURNING, сколько бы
+    заказов у него ни было. Возвращает id отменённых. Commit — на вызывающей стороне.
+    """
+    order_ids = list((await session.scalars(
+        update(Order)
+        .where(Order.user_id == user_id, Order.status == "new")
+        .values(status="abandoned")
+        .returning(Order.id)
+    )).all())
+    # Массовый UPDATE хуки журнала не видят — события пишем сами
+    for order_id in order_ids:
+        record_order_event(order_id, "status", "new", "abandoned", session=session)
+    return order_ids
+
+
+async def get_user_orders_db(session: AsyncSession, user_id: int, include_archive: bool = False) -> List[Order]:
+    # include_archive — только для показа: объекты из архива нельзя менять
+    entity = OrderAll if include_archive else Order
+    result = await session.scalars(
+        select(entity)
+        .where(entity.user_id == user_id)
+        .order_by(entity.id.desc())
+    )
+    return list(result.all())
+
+
+async def get_order_any(session: AsyncSession, order_id: int) -> Order | None:
+    """
+    Заказ с пользователем (как профиль admin-order-view): сначала горячая таблица,
+    затем архив. Заказ из архива — только для чтения.
+    """
+    order = await session.get(Order, order_id, options=load_profile("admin-order-view"))
+    if order is None:
+        order = await session.scalar(
+            select(OrderAll)
+            .where(OrderAll.id == order_id)
+            .options(joinedload(OrderAll.user).options(raiseload(User.orders), raiseload(User.access)))
+        )
+    return order
+
+
+async def get_orders_page(session: AsyncSession, statuses: list[str] | None = None,
+                          payment_kinds: list[str] | None = None, after_id: int | None = None,
+                          before_id: int | None = None, limit: int = 20,
+                          include_archive: bool = False) -> tuple[list[Order], bool]:
+    """
+    Страница заказов по id (keyset): after_id — следующая страница, before_id — предыдущая.
+    Заказы всегда по возрастанию id. Второе значение — есть ли ещё заказы дальше
+    в направлении листания. Берём limit + 1 строку вместо COUNT/OFFSET.
+    include_archive — читать через orders_all (горячие + архивные).
+    """
+    entity = OrderAll if include_archive else Order
+    stmt = select(entity)
+    if statuses is not None:
+        stmt = stmt.where(entity.status.in_(statuses))
+    if payment_kinds is not None:
+        stmt = stmt.where(entity.payment_kind.in_(payment_kinds))
+    if before_id is not None:
+        stmt = stmt.where(entity.id < before_id).order_by(entity.id.desc())
+    else:
+        if after_id is not None:
+            stmt = stmt.where(entity.id > after_id)
+        stmt = stmt.order_by(entity.id)
+    orders = list((await session.scalars(stmt.limit(limit + 1))).all())
+    has_more = len(orders) > limit
+    orders = orders[:limit]
+    if before_id is not None:
+        orders.reverse()
+    return orders, has_more
+
+
+async def get_order_status_counts(session: AsyncSession) -> dict[tuple[str, str | None], int]:
+    """Счётчики из order_status_counts: {(status, payment_kind): count}, без пустых."""
+    rows = await session.execute(
+        select(OrderStatusCount.status, OrderStatusCount.payment_kind, OrderStatusCount.count)
+        .where(OrderStatusCount.count > 0)
+    )
+    return {(status, kind or None): count for status, kind, count in rows}
+
+
+async def mark_code_used(session: AsyncSession, code: str, user_id: int):
+    exists = await session.scalar(select(RedeemUse).filter_by(redeem_code_id=code))
+    if not exists:
+        session.add(RedeemUse(redeem_code_id=code, user_id=user_id))
+        await session.commit()
+
+
+async def load_unused_codes(session: AsyncSession) -> set[str]:
+    return set(await session.scalars(select(RedeemCode.code).where(RedeemCode.is_used == False)))
+
+
+async def claim_redeem_code(session: AsyncSession, code: str, user_id: int) -> int | None:
+    """
+    Атомарная активация кода (compare-and-swap): один UPDATE ... WHERE is_used = 0
+    RETURNING id. Из двух одновременных попыток строку получит только одна.
+    RedeemUse добавляется в ту же транзакцию; commit — на вызывающей стороне.
+    Возвращает id кода или None, если кода нет или он уже использован.
+    """
+    candidate = (
+        select(RedeemCode.id)
+        .where(RedeemCode.code == code, RedeemCode.is_used == False)
+        .limit(1)
+        .scalar_subquery()
+    )
+    stmt = (
+        update(RedeemCode)
+        .where(RedeemCode.id == candidate, RedeemCode.is_used == False)
+        .values(is_used=True, used_by=user_id, used_at=datetime.now(timezone.utc))
+        .returning(RedeemCode.id)
+        .execution_options(synchronize_session=False)
+    )
+    code_id = (await session.execute(stmt)).scalar_one_or_none()
+    if code_id is not None:
+        session.add(RedeemUse(redeem_code_id=code_id, user_id=user_id))
+    return code_id
+
+
+async def grant_practices(session: AsyncSession, user: User, mask: int) -> int:
+    """
+    Открывает практики (маска по каталогу db.entitlements) и доступ к каналу.
+    Возвращает количество новых практик.
+    """
+    added = mask & ~user.practices_mask
+    user.practices_mask |= mask
+
+    access = await session.get(Access, user.telegram_id)
+    if access is None:
+        access = Access(user_id=user.telegram_id)
+        session.add(access)
+    access.channel_access = True
+    return added.bit_count()
+
+
+# ==================== Платежи заказа (бывший extra_data["pending_payments"]) ====================
+
+async def add_pending_payment(session: AsyncSession, order_id: int, kind: str,
+                              yookassa_payment_id: str, amount_kop: int) -> Payment:
+    payment = Payment(
+        order_id=order_id,
+        kind=kind,
+        yookassa_payment_id=yookassa_payment_id,
+        amount_kop=amount_kop,
+        status="pending",
+    )
+    session.add(payment)
+    return payment
+
+
+async def get_pending_payments(session: AsyncSession, order_id: int) -> dict[str, str]:
+    """kind → yookassa_payment_id ожидающих платежей заказа (последний платёж каждого вида)."""
+    rows = await session.execute(
+        select(Payment.kind, Payment.yookassa_payment_id)
+        .where(Payment.order_id == order_id, Payment.status == "pending")
+        .order_by(Payment.id)
+    )
+    return {kind: payment_id for kind, payment_id in rows}
+
+
+async def set_payment_status(session: AsyncSession, yookassa_payment_id: str, status: str):
+    row = (await session.execute(
+        update(Payment)
+        .where(Payment.yookassa_payment_id == yookassa_payment_id, Payment.status != status)
+        .values(status=status, updated_at=datetime.now(timezone.utc))
+        .returning(Payment.order_id, Payment.kind)
+        .execution_options(synchronize_session=False)
+    )).first()
+    if row is not None:
+        record_order_event(row.order_id, "payment", to_status=status,
+                           detail=f"{row.kind}:{yookassa_payment_id}", session=session)
+
+
+# ==================== Журнал событий заказов ====================
+
+ORDER_EVENTS_BATCH = 1000
+
+
+async def flush_order_events(batch: int = ORDER_EVENTS_BATCH) -> int:
+    """Пишет накопленные события пачками (одна транзакция на пачку). Возвращает число записанных."""
+    written = 0
+    while events := take_buffered(batch):
+        try:
+            async with get_async_engine().begin() as conn:
+                await conn.execute(insert(OrderEvent), events)
+        except Exception:
+            requeue(events)
+            raise
+        written += len(events)
+    return written
+
+
+async def get_order_timeline(session: AsyncSession, order_id: int) -> list[OrderEvent]:
+    result = await session.scalars(
+        select(OrderEvent)
+        .where(OrderEvent.order_id == order_id)
+        .order_by(OrderEvent.created_at, OrderEvent.id)
+    )
+    return list(result.all())
+
+
+async def get_time_in_state_stats(session: AsyncSession, since: datetime) -> list[tuple[str, int, float, float]]:
+    """
+    Сколько заказы проводят в каждом статусе: (статус, переходов, среднее с, максимум с)
+    по статусам, в которые заказы вошли начиная с since. Время в статусе — до следующего
+    события смены статуса того же заказа (LEAD по индексу order_id, created_at).
+    """
+    recent_orders = (
+        select(OrderEvent.order_id)
+        .where(OrderEvent.kind == "status", OrderEvent.created_at >= since)
+        .distinct()
+    )
+    spans = (
+        select(
+            OrderEvent.to_status.label("status"),
+            OrderEvent.created_at.label("entered_at"),
+            func.lead(OrderEvent.created_at).over(
+                partition_by=OrderEvent.order_id,
+                order_by=(OrderEvent.created_at, OrderEvent.id),
+            ).label("left_at"),
+        )
+        .where(OrderEvent.kind == "status", OrderEvent.order_id.in_(recent_orders))
+        .subquery()
+    )
+    if session.get_bind().dialect.name == "postgresql":
+        seconds = func.extract("epoch", spans.c.left_at - spans.c.entered_at)
+    else:
+        seconds = (func.julianday(spans.c.left_at) - func.julianday(spans.c.entered_at)) * 86400
+    rows = await session.execute(
+        select(spans.c.status, func.count(), func.avg(seconds), func.max(seconds))
+        .where(spans.c.left_at.is_not(None), spans.c.entered_at >= since)
+        .group_by(spans.c.status)
+        .order_by(func.avg(seconds).desc())
+    )
+    return [(status, count, avg or 0.0, max_ or 0.0) for status, count, avg, max_ in rows]
+
+
+# ==================== Архивация заказов ====================
+# archived/abandoned заказы, не менявшиеся дольше срока хранения, переносятся
+# с платежами в orders_archive/payments_archive небольшими пачками: каждая пачка —
+# своя короткая транзакция, между пачками пауза, чтобы не держать блокировку
+# записи и не задерживать обработчики.
+
+ARCHIVABLE_STATUSES = ("archived", "abandoned")
+ARCHIVE_BATCH = 500
+
+
+async def archive_orders_batch(session: AsyncSession, before: datetime,
+                               batch: int = ARCHIVE_BATCH) -> tuple[int, int]:
+    """Переносит до batch заказов (и их платежи) в архив. Возвращает (заказов, платежей). Commit — за вызывающим."""
+    ids = list((await session.scalars(
+        select(Order.id)
+        .where(
+            Order.status.in_(ARCHIVABLE_STATUSES),
+            Order.updated_at < before,
+            # Последний заказ не трогаем: без AUTOINCREMENT SQLite выдаёт id = MAX(id) + 1,
+            # и перенос максимального id привёл бы к повтору id в orders_all
+            Order.id < select(func.max(Order.id)).scalar_subquery(),
+        )
+        .order_by(Order.id)
+        .limit(batch)
+    )).all())
+    if not ids:
+        return 0, 0
+
+    now = datetime.now(timezone.utc)
+    orders_table, payments_table = Order.__table__, Payment.__table__
+    conn = await session.connection()
+    await conn.execute(
+        insert(orders_archive).from_select(
+            [c.name for c in orders_table.columns] + ["archived_at"],
+            select(*orders_table.columns, literal(now, TZDateTime)).where(orders_table.c.id.in_(ids)),
+        )
+    )
+    payments_moved = (await conn.execute(
+        insert(payments_archive).from_select(
+            ["payment_id" if c.name == "id" else c.name for c in payments_table.columns] + ["archived_at"],
+            select(*payments_table.columns, literal(now, TZDateTime)).where(payments_table.c.order_id.in_(ids)),
+        )
+    )).rowcount
+    await conn.execute(delete(payments_table).where(payments_table.c.order_id.in_(ids)))
+    await conn.execute(delete(orders_table).where(orders_table.c.id.in_(ids)))
+    return len(ids), payments_moved
+
+
+async def archive_old_orders(retention_days: int, batch: int = ARCHIVE_BATCH,
+                             pause: float = 0.05) -> tuple[int, int]:
+    """Архивирует все подходящие заказы пачками. Возвращает (заказов, платежей) за проход."""
+    before = datetime.now(timezone.utc) - timedelta(days=retention_days)
+    orders_total = payments_total = 0
+    while True:
+        async with AsyncSessionLocal() as sess:
+            orders_moved, payments_moved = await archive_orders_batch(sess, before, batch)
+            await sess.commit()
+        orders_total += orders_moved
+        payments_total += payments_moved
+        if orders_moved < batch:
+            return orders_total, payments_total
+        await asyncio.sleep(pause)
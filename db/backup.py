@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+from .repo import database_url
+
+logger = logging.getLogger("box_bot")
+
+# ==================== Снимки SQLite (online backup API) ====================
+# В файле БД — оплаченные заказы и использованные коды. Снимок снимается
+# sqlite3.Connection.backup, пока бот работает: по BACKUP_PAGES_PER_STEP страниц за шаг,
+# с паузой BACKUP_STEP_SLEEP_MS между шагами. Каждый шаг — короткая транзакция
+# чтения; в WAL она не мешает писателям, а между шагами БД свободна целиком.
+#
+# Если БД меняют во время копирования, SQLite начинает копию заново. После
+# BACKUP_MAX_RESTARTS таких перезапусков копируем одним шагом — одна транзакция
+# чтения, в WAL писатели её тоже не ждут.
+#
+# Копия пишется в <имя>.part, проверяется PRAGMA quick_check, переводится в
+# journal_mode=DELETE (снимок — один самодостаточный файл) и только потом
+# переименовывается. В BACKUP_DIR хранятся BACKUP_KEEP последних снимков.
+# Всё это идёт в потоке (asyncio.to_thread): обработчики снимок не ждут.
+#
+# Только для SQLite: PostgreSQL резервируется его средствами (pg_dump, архив WAL).
+
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP", "256"))
+BACKUP_STEP_SLEEP_MS = float(os.getenv("BACKUP_STEP_SLEEP_MS", "5"))
+BACKUP_MAX_RESTARTS = int(os.getenv("BACKUP_MAX_RESTARTS", "20"))
+
+
+@dataclass(slots=True, frozen=True)
+class Snapshot:
+    path: str
+    size_bytes: int
+    pages: int
+    duration: float
+    restarts: int
+    removed: tuple[str, ...]  # старые снимки, удалённые ротацией
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def sqlite_path(db: str) -> str | None:
+    """Путь к файлу SQLite из пути/URL бота (Config.DB_URL); None — не SQLite."""
+    url = database_url(db)
+    if url.get_backend_name() != "sqlite" or url.database in (None, "", ":memory:"):
+        return None
+    return url.database
+
+
+def snapshot_sqlite(db_path: str, backup_dir: str = BACKUP_DIR, keep: int = BACKUP_KEEP,
+                    pages_per_step: int = BACKUP_PAGES_PER_STEP,
+                    step_sleep: float = BACKUP_STEP_SLEEP_MS / 1000,
+                    max_restarts: int = BACKUP_MAX_RESTARTS) -> Snapshot:
+    """Снимок db_path в backup_dir с ротацией. Синхронная — вызывать в потоке."""
+    started = time.perf_counter()
+    os.makedirs(backup_dir, exist_ok=True)
+    name = os.path.splitext(os.path.basename(db_path))[0]
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+    final_path = os.path.join(backup_dir, f"{name}-{stamp}.sqlite3")
+    part_path = final_path + ".part"
+    if os.path.exists(part_path):
+        os.remove(part_path)
+
+    restarts = 0
+    last_remaining = None
+    total_pages = 0
+
+    def progress(_status: int, remaining: int, total: int):
+        nonlocal restarts, last_remaining, total_pages
+        total_pages = total
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts > max_restarts:
+                raise _TooManyRestarts()
+        last_remaining = remaining
+
+    source = sqlite3.connect(db_path, timeout=30)
+    target = sqlite3.connect(part_path)
+    try:
+        try:
+            source.backup(target, pages=pages_per_step, progress=progress, sleep=step_sleep)
+        except _TooManyRestarts:
+            logger.warning(f"Снимок {db_path}: {restarts} перезапусков копии из-за записи, копируем одним шагом")
+            source.backup(target, pages=-1, progress=progress)
+        check = target.execute("PRAGMA quick_check").fetchone()[0]
+        if check != "ok":
+            raise RuntimeError(f"Снимок {part_path} не прошёл quick_check: {check}")
+        target.execute("PRAGMA journal_mode=DELETE")
+    except BaseException:
+        target.close()
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    finally:
+        source.close()
+    target.close()
+    os.replace(part_path, final_path)
+
+    return Snapshot(
+        path=final_path,
+        size_bytes=os.path.getsize(final_path),
+        pages=total_pages,
+        duration=time.perf_counter() - started,
+        restarts=restarts,
+        removed=tuple(_rotate(backup_dir, name, keep)),
+    )
+
+
+def _rotate(backup_dir: str, name: str, keep: int) -> list[str]:
+    # Имена с меткой времени UTC сортируются по возрасту
+    snapshots = sorted(
+        f for f in os.listdir(backup_dir)
+        if f.startswith(f"{name}-") and f.endswith(".sqlite3")
+    )
+    removed = []
+    for stale in snapshots[:-keep] if keep > 0 else []:
+        os.remove(os.path.join(backup_dir, stale))
+        removed.append(stale)
+    return removed
+
+
+class Snapshotter:
+    def __init__(self, backup_dir: str = BACKUP_DIR, keep: int = BACKUP_KEEP,
+                 pages_per_step: int = BACKUP_PAGES_PER_STEP, step_sleep: float = BACKUP_STEP_SLEEP_MS / 1000):
+        self.backup_dir = backup_dir
+        self.keep = keep
+        self.pages_per_step = pages_per_step
+        self.step_sleep = step_sleep
+        self._lock = asyncio.Lock()
+        self.snapshots = 0
+        self.failures = 0
+        self.last: Snapshot | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    async def snapshot(self, db: str) -> Snapshot:
+        """Снимок БД бота в фоне (поток). Одновременно идёт не больше одного снимка."""
+        db_path = sqlite_path(db)
+        if db_path is None:
+            raise ValueError("Снимки поддерживаются только для SQLite")
+        async with self._lock:
+            try:
+                snap = await asyncio.to_thread(
+                    snapshot_sqlite, db_path, self.backup_dir, self.keep, self.pages_per_step, self.step_sleep,
+                )
+            except Exception:
+                self.failures += 1
+                raise
+        self.snapshots += 1
+        self.last = snap
+        logger.info(
+            f"Снимок БД: {snap.path}, {snap.size_bytes / 1024:.0f} КБ, {snap.pages} страниц "
+            f"за {snap.duration:.2f} с (перезапусков {snap.restarts}, удалено старых {len(snap.removed)})"
+        )
+        return snap
+
+    def stats(self) -> dict:
+        return {
+            "snapshots": self.snapshots,
+            "failures": self.failures,
+            "running": self.running,
+            "last_path": self.last.path if self.last else None,
+            "last_size_bytes": self.last.size_bytes if self.last else None,
+            "last_duration_sec": round(self.last.duration, 3) if self.last else None,
+        }
+
+
+snapshotter = Snapshotter()
@@ -0,0 +1,42 @@
+from __future__ import annotations
+
+from typing import Iterable
+
+# ==================== Каталог практик и права доступа ====================
+# Какие практики открыты пользователю — битовая маска users.practices_mask:
+# бит i = практика PRACTICE_TITLES[i]. Проверка доступа — одна битовая операция,
+# без разбора JSON-списка названий.
+#
+# Номер практики = номер бита = индекс в медиа-массивах Config.PRACTICE_* и
+# в callback_data "practice:<id>". Поэтому практики в каталоге можно переименовывать
+# и дописывать в конец, но не удалять и не переставлять.
+
+PRACTICE_TITLES: tuple[str, ...] = (
+    "Дыхательная практика",
+    "Зеркало",
+    "Снять тревогу с тревоги",
+    "Внутренний ребенок",
+    "Антихрупкость",
+    "Созидать жизнь",
+    "Спокойный сон",
+)
+PRACTICE_IDS = {title: practice_id for practice_id, title in enumerate(PRACTICE_TITLES)}
+
+# Все практики коробочки — то, что открывает код активации
+ALL_PRACTICES_MASK = (1 << len(PRACTICE_TITLES)) - 1
+
+
+def practice_mask(practice_ids: Iterable[int]) -> int:
+    mask = 0
+    for practice_id in practice_ids:
+        mask |= 1 << practice_id
+    return mask
+
+
+def has_practice(mask: int, practice_id: int) -> bool:
+    return 0 <= practice_id < len(PRACTICE_TITLES) and (mask >> practice_id) & 1 == 1
+
+
+def practice_ids(mask: int) -> list[int]:
+    """Номера открытых практик по возрастанию (для списка практик)."""
+    return [practice_id for practice_id in range(len(PRACTICE_TITLES)) if (mask >> practice_id) & 1]
@@ -1,19 +1,19 @@
 from sqlalchemy.orm import Session
+from typing import Iterable
 import logging
 
-from .models import Base
-from .repo import ensure_product, bulk_insert_redeem_codes
+from .migrations import run_migrations
+from .repo import ensure_product, import_redeem_codes
 
 logger = logging.getLogger("box_bot")
 
 
 def init_db(engine):
-    logger.info("Начало пересоздания БД: drop_all + create_all")
-    Base.metadata.drop_all(engine)
-    Base.metadata.create_all(engine)
-    logger.info("Таблицы пересозданы успешно")
+    # Данные не трогаем: применяем только недостающие миграции (см. db/migrations.py)
+    applied = run_migrations(engine)
+    logger.info(f"Инициализация БД завершена, применено миграций: {applied}")
 
-def seed_data(session: Session, anxiety_codes: list[str] | None = None):
+def seed_data(session: Session, anxiety_codes: Iterable[str] | None = None):
     try:
         # Основная коробочка
         anxiety = ensure_product(
@@ -24,8 +24,9 @@ def seed_data(session: Session, anxiety_codes: list[str] | None = None):
             price_kop=599000  # 5990.00 руб
         )
 
-        if anxiety_codes:
-            bulk_insert_redeem_codes(session, anxiety.id, anxiety_codes)
+        if anxiety_codes is not None:
+            inserted, skipped = import_redeem_codes(session, anxiety.id, anxiety_codes)
+            logger.info(f"Коды anxiety: добавлено {inserted}, пропущено {skipped} (уже есть или повтор)")
 
         session.commit()
         logger.info("seed_data завершено успешно.")
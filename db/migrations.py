@@ -0,0 +1,392 @@
+from __future__ import annotations
+
+import json
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Callable
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+from .entitlements import PRACTICE_IDS, practice_mask
+from .models import Base, orders_all_select
+
+logger = logging.getLogger("box_bot")
+
+
+# ==================== Версионные миграции схемы ====================
+# Вместо drop_all + create_all на каждом старте: в таблице schema_version
+# хранится номер последнего применённого шага, на старте применяются только
+# недостающие шаги. Если схема актуальна — это один SELECT.
+#
+# Новый шаг = новая функция step_NNN(conn) + строка в MIGRATIONS.
+# Уже выпущенные шаги не меняем — только добавляем следующие.
+# Каждый шаг выполняется в своей транзакции вместе с записью в schema_version.
+#
+# Шаги 2–6 — история SQLite-баз. PostgreSQL-база всегда создаётся с нуля сразу
+# в версии LATEST_VERSION (ветка fresh в run_migrations), поэтому новые шаги
+# должны работать на обоих диалектах (conn.dialect.name — если иначе нельзя).
+
+def step_001_baseline(conn: Connection):
+    """Исходная схема: users, products, orders, payments, access, redeem_codes, redeem_uses."""
+    baseline = ["users", "products", "orders", "payments", "access", "redeem_codes", "redeem_uses"]
+    Base.metadata.create_all(conn, tables=[Base.metadata.tables[name] for name in baseline], checkfirst=True)
+
+
+def _create_indexes(conn: Connection, table: str, names: list[str]):
+    indexes = {ix.name: ix for ix in Base.metadata.tables[table].indexes}
+    for name in names:
+        indexes[name].create(conn, checkfirst=True)
+
+
+def step_002_hot_query_indexes(conn: Connection):
+    """Составные индексы под горячие запросы (заказы по статусу/пользователю, ввод кода)."""
+    _create_indexes(conn, "orders", [
+        "ix_orders_status_created_at", "ix_orders_status_payment_kind", "ix_orders_user_id",
+    ])
+    # ix_redeem_code(code) поглощается ix_redeem_code_is_used(code, is_used)
+    conn.execute(text("DROP INDEX IF EXISTS ix_redeem_code"))
+    _create_indexes(conn, "redeem_codes", ["ix_redeem_code_is_used"])
+
+
+def _add_columns(conn: Connection, table: str, names: list[str]):
+    existing = {c["name"] for c in inspect(conn).get_columns(table)}
+    columns = Base.metadata.tables[table].columns
+    for name in names:
+        if name not in existing:
+            column = columns[name]
+            ddl = f"ALTER TABLE {table} ADD COLUMN {name} {column.type.compile(conn.dialect)}"
+            if column.server_default is not None:
+                default = column.server_default.arg
+                # text("0") — как есть, false() и т.п. — в синтаксисе диалекта
+                sql = default.text if hasattr(default, "text") else default.compile(dialect=conn.dialect)
+                ddl += f" DEFAULT {sql}"
+                if not column.nullable:
+                    ddl += " NOT NULL"
+            conn.execute(text(ddl))
+
+
+def _drop_columns(conn: Connection, table: str, names: list[str]):
+    existing = {c["name"] for c in inspect(conn).get_columns(table)}
+    for name in names:
+        if name in existing:
+            conn.execute(text(f"ALTER TABLE {table} DROP COLUMN {name}"))
+
+
+def step_003_promote_extra_data(conn: Connection):
+    """Горячие ключи orders.extra_data → колонки, pending_payments → строки payments."""
+    _add_columns(conn, "orders", ["pvz_code", "city_code", "cdek_uuid", "cdek_number", "yookassa_payment_id"])
+    _add_columns(conn, "payments", ["kind"])
+
+    conn.execute(text("""
+        UPDATE orders SET
+            pvz_code = json_extract(extra_data, '$.pvz_code'),
+            city_code = CAST(json_extract(extra_data, '$.city_code') AS TEXT),
+            cdek_uuid = COALESCE(cdek_uuid, json_extract(extra_data, '$.cdek_uuid')),
+            cdek_number = CAST(json_extract(extra_data, '$.cdek_number') AS TEXT),
+            yookassa_payment_id = json_extract(extra_data, '$.yookassa_payment_id')
+    """))
+    # Сумма платежа в JSON не хранилась — восстанавливаем по тем же правилам, что send_payment_keyboard
+    conn.execute(text("""
+        INSERT INTO payments (order_id, yookassa_payment_id, amount_kop, status, kind, created_at, updated_at)
+        SELECT o.id, p.value,
+               CASE p.key
+                   WHEN 'full' THEN o.total_price_kop
+                   WHEN 'pre' THEN ((o.total_price_kop / 100 * 30 + 99) / 100) * 100
+                   ELSE o.total_price_kop - ((o.total_price_kop / 100 * 30 + 99) / 100) * 100
+               END,
+               CASE WHEN p.value = json_extract(o.extra_data, '$.yookassa_payment_id')
+                    THEN 'succeeded' ELSE 'pending' END,
+               p.key, o.created_at, o.updated_at
+        FROM orders o, json_each(o.extra_data, '$.pending_payments') p
+        WHERE p.value IS NOT NULL
+        ON CONFLICT (yookassa_payment_id) DO NOTHING
+    """))
+    conn.execute(text("""
+        UPDATE orders SET extra_data = json_remove(
+            extra_data, '$.pvz_code', '$.city_code', '$.cdek_uuid', '$.cdek_number',
+            '$.pending_payments', '$.yookassa_payment_id'
+        )
+        WHERE extra_data IS NOT NULL
+    """))
+
+    _create_indexes(conn, "orders", ["ix_orders_cdek_uuid", "ix_orders_cdek_number", "ix_orders_yookassa_payment_id"])
+    # ix_payments_order_id(order_id) поглощается ix_payments_order_id_status(order_id, status)
+    conn.execute(text("DROP INDEX IF EXISTS ix_payments_order_id"))
+    _create_indexes(conn, "payments", ["ix_payments_order_id_status"])
+
+
+def step_004_order_events(conn: Connection):
+    """Журнал событий заказов order_events."""
+    Base.metadata.create_all(conn, tables=[Base.metadata.tables["order_events"]], checkfirst=True)
+
+
+# Счётчики order_status_counts ведутся триггерами: их обновляет любая запись в
+# orders — ORM, массовый UPDATE, архиватор, ручной SQL. Ключ — (status, payment_kind),
+# payment_kind NULL хранится как ''.
+ORDER_STATUS_COUNT_TRIGGERS = {
+    "trg_orders_count_insert": """
+        CREATE TRIGGER IF NOT EXISTS trg_orders_count_insert AFTER INSERT ON orders
+        BEGIN
+            INSERT INTO order_status_counts (status, payment_kind, count)
+            VALUES (NEW.status, COALESCE(NEW.payment_kind, ''), 1)
+            ON CONFLICT (status, payment_kind) DO UPDATE SET count = count + 1;
+        END
+    """,
+    "trg_orders_count_update": """
+        CREATE TRIGGER IF NOT EXISTS trg_orders_count_update AFTER UPDATE OF status, payment_kind ON orders
+        WHEN OLD.status IS NOT NEW.status OR OLD.payment_kind IS NOT NEW.payment_kind
+        BEGIN
+            UPDATE order_status_counts SET count = count - 1
+            WHERE status = OLD.status AND payment_kind = COALESCE(OLD.payment_kind, '');
+            INSERT INTO order_status_counts (status, payment_kind, count)
+            VALUES (NEW.status, COALESCE(NEW.payment_kind, ''), 1)
+            ON CONFLICT (status, payment_kind) DO UPDATE SET count = count + 1;
+        END
+    """,
+    "trg_orders_count_delete": """
+        CREATE TRIGGER IF NOT EXISTS trg_orders_count_delete AFTER DELETE ON orders
+        BEGIN
+            UPDATE order_status_counts SET count = count - 1
+            WHERE status = OLD.status AND payment_kind = COALESCE(OLD.payment_kind, '');
+        END
+    """,
+}
+
+
+def _create_order_status_count_triggers(conn: Connection):
+    for ddl in ORDER_STATUS_COUNT_TRIGGERS.values():
+        conn.execute(text(ddl))
+
+
+def step_005_order_status_counts(conn: Connection):
+    """Счётчики заказов по статусам (триггеры) и индекс для постраничных списков."""
+    Base.metadata.create_all(conn, tables=[Base.metadata.tables["order_status_counts"]], checkfirst=True)
+    conn.execute(text("DELETE FROM order_status_counts"))
+    conn.execute(text(
+        "INSERT INTO order_status_counts (status, payment_kind, count) "
+        "SELECT status, COALESCE(payment_kind, ''), COUNT(*) FROM orders GROUP BY 1, 2"
+    ))
+    _create_order_status_count_triggers(conn)
+    _create_indexes(conn, "orders", ["ix_orders_status_id"])
+
+
+# Архивные заказы остаются в счётчиках: перенос orders → orders_archive
+# (DELETE + INSERT) в сумме их не меняет, «Архив заказов» показывает всё.
+ORDER_ARCHIVE_COUNT_TRIGGERS = {
+    "trg_orders_archive_count_insert": """
+        CREATE TRIGGER IF NOT EXISTS trg_orders_archive_count_insert AFTER INSERT ON orders_archive
+        BEGIN
+            INSERT INTO order_status_counts (status, payment_kind, count)
+            VALUES (NEW.status, COALESCE(NEW.payment_kind, ''), 1)
+            ON CONFLICT (status, payment_kind) DO UPDATE SET count = count + 1;
+        END
+    """,
+    "trg_orders_archive_count_delete": """
+        CREATE TRIGGER IF NOT EXISTS trg_orders_archive_count_delete AFTER DELETE ON orders_archive
+        BEGIN
+            UPDATE order_status_counts SET count = count - 1
+            WHERE status = OLD.status AND payment_kind = COALESCE(OLD.payment_kind, '');
+        END
+    """,
+}
+
+
+# В PostgreSQL те же счётчики ведёт одна plpgsql-функция на orders и orders_archive
+POSTGRES_ORDER_STATUS_COUNT_DDL = [
+    """
+    CREATE OR REPLACE FUNCTION order_status_counts_apply() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            UPDATE order_status_counts SET count = count - 1
+            WHERE status = OLD.status AND payment_kind = COALESCE(OLD.payment_kind, '');
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            INSERT INTO order_status_counts AS c (status, payment_kind, count)
+            VALUES (NEW.status, COALESCE(NEW.payment_kind, ''), 1)
+            ON CONFLICT (status, payment_kind) DO UPDATE SET count = c.count + 1;
+        END IF;
+        RETURN NULL;
+    END
+    $$
+    """,
+    "DROP TRIGGER IF EXISTS trg_orders_count_insert_delete ON orders",
+    """
+    CREATE TRIGGER trg_orders_count_insert_delete AFTER INSERT OR DELETE ON orders
+    FOR EACH ROW EXECUTE FUNCTION order_status_counts_apply()
+    """,
+    "DROP TRIGGER IF EXISTS trg_orders_count_update ON orders",
+    """
+    CREATE TRIGGER trg_orders_count_update AFTER UPDATE OF status, payment_kind ON orders
+    FOR EACH ROW
+    WHEN (OLD.status IS DISTINCT FROM NEW.status OR OLD.payment_kind IS DISTINCT FROM NEW.payment_kind)
+    EXECUTE FUNCTION order_status_counts_apply()
+    """,
+    "DROP TRIGGER IF EXISTS trg_orders_archive_count ON orders_archive",
+    """
+    CREATE TRIGGER trg_orders_archive_count AFTER INSERT OR DELETE ON orders_archive
+    FOR EACH ROW EXECUTE FUNCTION order_status_counts_apply()
+    """,
+]
+
+
+def _create_count_triggers(conn: Connection):
+    """Все триггеры счётчиков (orders и orders_archive) для диалекта conn."""
+    if conn.dialect.name == "postgresql":
+        ddl_list = POSTGRES_ORDER_STATUS_COUNT_DDL
+    else:
+        ddl_list = [*ORDER_STATUS_COUNT_TRIGGERS.values(), *ORDER_ARCHIVE_COUNT_TRIGGERS.values()]
+    for ddl in ddl_list:
+        conn.execute(text(ddl))
+
+
+def _create_orders_all_view(conn: Connection):
+    # Пересоздаётся целиком: после добавления колонок в orders/orders_archive
+    # шаг миграции вызывает эту функцию ещё раз
+    conn.execute(text("DROP VIEW IF EXISTS orders_all"))
+    conn.execute(text(f"CREATE VIEW orders_all AS {orders_all_select.compile(conn)}"))
+
+
+def step_006_orders_archive(conn: Connection):
+    """Холодный архив orders_archive/payments_archive и VIEW orders_all."""
+    Base.metadata.create_all(
+        conn, tables=[Base.metadata.tables["orders_archive"], Base.metadata.tables["payments_archive"]],
+        checkfirst=True,
+    )
+    for ddl in ORDER_ARCHIVE_COUNT_TRIGGERS.values():
+        conn.execute(text(ddl))
+    _create_orders_all_view(conn)
+
+
+def step_007_practices_mask(conn: Connection):
+    """Списки названий практик users.practices → битовая маска users.practices_mask."""
+    _add_columns(conn, "users", ["practices_mask"])
+    masks: list[dict] = []
+    unknown: set[str] = set()
+    rows = conn.execute(text("SELECT telegram_id, practices FROM users WHERE practices IS NOT NULL"))
+    for telegram_id, practices in rows:
+        titles = json.loads(practices) if isinstance(practices, str) else practices
+        unknown.update(t for t in titles or [] if t not in PRACTICE_IDS)
+        mask = practice_mask(PRACTICE_IDS[t] for t in titles or [] if t in PRACTICE_IDS)
+        if mask:
+            masks.append({"uid": telegram_id, "mask": mask})
+    if masks:
+        conn.execute(text("UPDATE users SET practices_mask = :mask WHERE telegram_id = :uid"), masks)
+    if unknown:
+        logger.warning(f"Миграция 7: названия практик не из каталога пропущены: {sorted(unknown)}")
+    logger.info(f"Миграция 7: маска практик заполнена у {len(masks)} пользователей")
+
+    # Дубли права на практики: теперь это practices_mask != 0 (access.channel_access остаётся)
+    _drop_columns(conn, "users", ["practices", "practices_access"])
+    _drop_columns(conn, "access", ["practices_access"])
+
+
+def step_008_cdek_delivery_points(conn: Connection):
+    """Локальный справочник ПВЗ СДЭК cdek_delivery_points."""
+    Base.metadata.create_all(conn, tables=[Base.metadata.tables["cdek_delivery_points"]], checkfirst=True)
+
+
+def step_009_cdek_city_names(conn: Connection):
+    """Названия городов СДЭК → city_code: cdek_city_names."""
+    Base.metadata.create_all(conn, tables=[Base.metadata.tables["cdek_city_names"]], checkfirst=True)
+
+
+def step_010_cdek_tariff_quotes(conn: Connection):
+    """Кэш расчётов тарифов СДЭК: cdek_tariff_quotes."""
+    Base.metadata.create_all(conn, tables=[Base.metadata.tables["cdek_tariff_quotes"]], checkfirst=True)
+
+
+def step_011_payments_archive_surrogate_key(conn: Connection):
+    """payments_archive: свой ключ archive_id, исходный payments.id — в колонке payment_id."""
+    payment_columns = [c.name for c in Base.metadata.tables["payments"].columns if c.name != "id"]
+    columns = ", ".join(payment_columns + ["archived_at"])
+    conn.execute(text("CREATE TABLE payments_archive_old AS SELECT * FROM payments_archive"))
+    conn.execute(text("DROP TABLE payments_archive"))
+    Base.metadata.create_all(conn, tables=[Base.metadata.tables["payments_archive"]])
+    moved = conn.execute(text(
+        f"INSERT INTO payments_archive (payment_id, {columns}) "
+        f"SELECT id, {columns} FROM payments_archive_old ORDER BY archived_at, id"
+    )).rowcount
+    conn.execute(text("DROP TABLE payments_archive_old"))
+    logger.info(f"Миграция 11: перенесено {moved} архивных платежей")
+
+
+def step_012_cdek_points_sync_state(conn: Connection):
+    """Время полной синхронизации справочника ПВЗ — cdek_sync_state; точки из поиска по коду — partial."""
+    Base.metadata.create_all(conn, tables=[Base.metadata.tables["cdek_sync_state"]], checkfirst=True)
+    _add_columns(conn, "cdek_delivery_points", ["partial"])
+
+
+MIGRATIONS: list[tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "baseline", step_001_baseline),
+    (2, "hot query indexes", step_002_hot_query_indexes),
+    (3, "promote extra_data keys to columns", step_003_promote_extra_data),
+    (4, "order events log", step_004_order_events),
+    (5, "order status counters", step_005_order_status_counts),
+    (6, "orders archive", step_006_orders_archive),
+    (7, "practices bitmask", step_007_practices_mask),
+    (8, "cdek delivery points", step_008_cdek_delivery_points),
+    (9, "cdek city names", step_009_cdek_city_names),
+    (10, "cdek tariff quotes", step_010_cdek_tariff_quotes),
+    (11, "payments archive surrogate key", step_011_payments_archive_surrogate_key),
+    (12, "cdek points sync state", step_012_cdek_points_sync_state),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def _ensure_version_table(conn: Connection):
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_version ("
+        " version INTEGER PRIMARY KEY,"
+        " description VARCHAR(128) NOT NULL,"
+        " applied_at TIMESTAMP NOT NULL"
+        ")"
+    ))
+
+
+def _record_version(conn: Connection, version: int, description: str):
+    conn.execute(
+        text("INSERT INTO schema_version (version, description, applied_at) VALUES (:v, :d, :t)"),
+        {"v": version, "d": description, "t": datetime.now(timezone.utc)},
+    )
+
+
+def get_schema_version(conn: Connection) -> int:
+    return conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_version")).scalar_one()
+
+
+def run_migrations(engine: Engine) -> int:
+    """Применяет недостающие шаги миграций. Возвращает количество применённых шагов."""
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        _ensure_version_table(conn)
+        current = get_schema_version(conn)
+        fresh = current == 0 and not (set(inspect(conn).get_table_names()) - {"schema_version"})
+
+        if fresh:
+            # Пустая БД: создаём сразу актуальную схему и помечаем все шаги применёнными
+            Base.metadata.create_all(conn)
+            _create_count_triggers(conn)
+            _create_orders_all_view(conn)
+            for version, description, _ in MIGRATIONS:
+                _record_version(conn, version, description)
+            logger.info(f"Создана новая БД, схема версии {LATEST_VERSION}")
+            return len(MIGRATIONS)
+
+    pending = [m for m in MIGRATIONS if m[0] > current]
+    if not pending:
+        logger.info(f"Схема БД актуальна (версия {current}), проверка {(time.perf_counter() - started) * 1000:.1f} мс")
+        return 0
+
+    for version, description, step in pending:
+        logger.info(f"Миграция {version}: {description}...")
+        with engine.begin() as conn:
+            step(conn)
+            _record_version(conn, version, description)
+        logger.info(f"Миграция {version} применена")
+
+    logger.info(f"Схема БД обновлена: {current} → {pending[-1][0]} за {(time.perf_counter() - started) * 1000:.1f} мс")
+    return len(pending)
@@ -5,18 +5,30 @@ from sqlalchemy import text
 
 from sqlalchemy import (
     BigInteger, Integer, String, Text, Boolean, DateTime,
-    ForeignKey, UniqueConstraint, Index
+    ForeignKey, UniqueConstraint, Index, Column, Table, false, select, union_all
 )
-from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.mutable import MutableDict
+from sqlalchemy.orm import Mapped, aliased, mapped_column, relationship
 
 from .base import Base
 
+# Типы, одинаково работающие в SQLite и PostgreSQL:
+# - JSON в PostgreSQL хранится как JSONB;
+# - extra_data — MutableDict: obj.extra_data["key"] = ... попадает в UPDATE
+#   без flag_modified (отслеживается только верхний уровень словаря);
+# - DateTime с часовым поясом: в PostgreSQL — timestamptz (asyncpg не принимает
+#   aware-datetime в колонку без пояса), в SQLite хранение не меняется.
+JSONType = JSON().with_variant(JSONB(), "postgresql")
+ExtraData = MutableDict.as_mutable(JSON().with_variant(JSONB(), "postgresql"))  # свой экземпляр типа
+TZDateTime = DateTime(timezone=True)
+
 
 class User(Base):
     __tablename__ = "users"
 
     # ==================== Основные данные пользователя ====================
-    telegram_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    telegram_id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=False)  # id из Telegram, не последовательность
     username: Mapped[str | None] = mapped_column(String(64), nullable=True)
     full_name: Mapped[str | None] = mapped_column(String(128), nullable=True)
     phone: Mapped[str | None] = mapped_column(String(32), nullable=True)
@@ -25,34 +37,34 @@ class User(Base):
     # ==================== Флаги прогресса и доступа ====================
     gallery_viewed: Mapped[bool] = mapped_column(Boolean, default=False)
     team_viewed: Mapped[bool] = mapped_column(Boolean, default=False)
-    practices_access: Mapped[bool] = mapped_column(Boolean, default=False)
     is_authorized: Mapped[bool] = mapped_column(Boolean, default=False)
 
     # ==================== Практики и временные данные ====================
-    practices: Mapped[list[str]] = mapped_column(JSON, default=list)  # список названий практик
-    temp_pvz_list: Mapped[list[dict] | None] = mapped_column(JSON, nullable=True, default=None)
-    temp_selected_pvz: Mapped[dict | None] = mapped_column(JSON, nullable=True)
+    # Открытые практики — битовая маска по каталогу db.entitlements.PRACTICE_TITLES
+    practices_mask: Mapped[int] = mapped_column(BigInteger, default=0, server_default=text("0"), nullable=False)
+    temp_pvz_list: Mapped[list[dict] | None] = mapped_column(JSONType, nullable=True, default=None)
+    temp_selected_pvz: Mapped[dict | None] = mapped_column(JSONType, nullable=True)
 
     # ==================== Дополнительные данные ====================
     extra_data: Mapped[dict] = mapped_column(
-        JSON, default=dict, server_default=text("'{}'"), nullable=False
+        ExtraData, default=dict, server_default=text("'{}'"), nullable=False
     )
 
     # ==================== Состояния ожидания ввода ====================
     awaiting_auth: Mapped[bool] = mapped_column(
-        Boolean, default=False, server_default=text("0"), nullable=False
+        Boolean, default=False, server_default=false(), nullable=False
     )
     awaiting_gift_message: Mapped[bool] = mapped_column(
-        Boolean, default=False, server_default=text("0"), nullable=False
+        Boolean, default=False, server_default=false(), nullable=False
     )
     awaiting_pvz_address: Mapped[bool] = mapped_column(
-        Boolean, default=False, server_default=text("0"), nullable=False
+        Boolean, default=False, server_default=false(), nullable=False
     )
     awaiting_manual_pvz: Mapped[bool] = mapped_column(
-        Boolean, default=False, server_default=text("0"), nullable=False
+        Boolean, default=False, server_default=false(), nullable=False
     )
     awaiting_redeem_code: Mapped[bool] = mapped_column(
-        Boolean, default=False, server_default=text("0"), nullable=False
+        Boolean, default=False, server_default=false(), nullable=False
     )
     awaiting_manual_track: Mapped[bool] = mapped_column(Boolean, default=False)
 
@@ -63,9 +75,9 @@ class User(Base):
 
     # ==================== Метаданные ====================
     created_at: Mapped[datetime] = mapped_column(
-        DateTime, default=lambda: datetime.now(timezone.utc)
+        TZDateTime, default=lambda: datetime.now(timezone.utc)
     )
-    updated_at: Mapped[datetime] = mapped_column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc),)
+    updated_at: Mapped[datetime] = mapped_column(TZDateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc),)
 
     # ==================== Связи ====================
     orders: Mapped[list["Order"]] = relationship(back_populates="user", lazy="selectin")
@@ -86,7 +98,7 @@ class Product(Base):
     is_active: Mapped[bool] = mapped_column(Boolean, default=True)
 
     created_at: Mapped[datetime] = mapped_column(
-        DateTime, default=lambda: datetime.now(timezone.utc)
+        TZDateTime, default=lambda: datetime.now(timezone.utc)
     )
 
     # Связи
@@ -111,13 +123,19 @@ class Order(Base):
     address: Mapped[str] = mapped_column(Text, nullable=False, default="")
     shipping_method: Mapped[str] = mapped_column(String(32), default="cdek_pvz")
     track: Mapped[str | None] = mapped_column(String(64), nullable=True)
+
+    # Ключи, вынесенные из extra_data: по ним фильтруют поллеры и пишут обработчики
+    pvz_code: Mapped[str | None] = mapped_column(String(16), nullable=True)  # "KZN3"
+    city_code: Mapped[str | None] = mapped_column(String(16), nullable=True)  # код города СДЭК
     cdek_uuid: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    cdek_number: Mapped[str | None] = mapped_column(String(32), nullable=True)
+    yookassa_payment_id: Mapped[str | None] = mapped_column(String(128), nullable=True)  # успешный платёж
 
     created_at: Mapped[datetime] = mapped_column(
-        DateTime, default=lambda: datetime.now(timezone.utc)
+        TZDateTime, default=lambda: datetime.now(timezone.utc)
     )
     updated_at: Mapped[datetime] = mapped_column(
-        DateTime, default=lambda: datetime.now(timezone.utc),
+        TZDateTime, default=lambda: datetime.now(timezone.utc),
         onupdate=lambda: datetime.now(timezone.utc)
     )
 
@@ -127,9 +145,23 @@ class Order(Base):
     payments: Mapped[list["Payment"]] = relationship(back_populates="order", cascade="all, delete-orphan")
     redeem_use: Mapped["RedeemUse | None"] = relationship(back_populates="order", uselist=False)
 
-    extra_data: Mapped[dict] = mapped_column(JSON, default=dict, server_default=text("'{}'"), nullable=False)
+    extra_data: Mapped[dict] = mapped_column(ExtraData, default=dict, server_default=text("'{}'"), nullable=False)
     payment_kind: Mapped[str | None] = mapped_column(String(32), nullable=True)  # "full", "pre", "remainder"
 
+    __table_args__ = (
+        # check_pending_timeouts: status = ? AND created_at < ?
+        Index("ix_orders_status_created_at", "status", "created_at"),
+        # админские списки: status = ? AND payment_kind = ? / IN (...)
+        Index("ix_orders_status_payment_kind", "status", "payment_kind"),
+        # постраничные админские списки: status = ? AND id > ? ORDER BY id LIMIT n
+        Index("ix_orders_status_id", "status", "id"),
+        # get_user_orders_db: user_id = ? ORDER BY id DESC (id — rowid, уже в индексе)
+        Index("ix_orders_user_id", "user_id"),
+        Index("ix_orders_cdek_uuid", "cdek_uuid"),
+        Index("ix_orders_cdek_number", "cdek_number"),
+        Index("ix_orders_yookassa_payment_id", "yookassa_payment_id"),
+    )
+
     @property
     def remainder_amount(self) -> int:
         prepay = (self.total_price_kop * 30) // 100
@@ -153,12 +185,13 @@ class Payment(Base):
     yookassa_payment_id: Mapped[str] = mapped_column(String(128), nullable=False)
     amount_kop: Mapped[int] = mapped_column(Integer, nullable=False)
     status: Mapped[str] = mapped_column(String(32), default="pending", nullable=False)
+    kind: Mapped[str | None] = mapped_column(String(16), nullable=True)  # "full", "pre", "rem"
 
     created_at: Mapped[datetime] = mapped_column(
-        DateTime, default=lambda: datetime.now(timezone.utc)
+        TZDateTime, default=lambda: datetime.now(timezone.utc)
     )
     updated_at: Mapped[datetime] = mapped_column(
-        DateTime, default=lambda: datetime.now(timezone.utc),
+        TZDateTime, default=lambda: datetime.now(timezone.utc),
         onupdate=lambda: datetime.now(timezone.utc)
     )
 
@@ -166,7 +199,8 @@ class Payment(Base):
 
     __table_args__ = (
         UniqueConstraint("yookassa_payment_id", name="uq_payment_yookassa_id"),
-        Index("ix_payments_order_id", "order_id"),
+        # ожидающие платежи заказа: order_id = ? AND status = 'pending'
+        Index("ix_payments_order_id_status", "order_id", "status"),
     )
 
 
@@ -176,10 +210,9 @@ class Access(Base):
     user_id: Mapped[int] = mapped_column(BigInteger, ForeignKey("users.telegram_id"), primary_key=True)
 
     channel_access: Mapped[bool] = mapped_column(Boolean, default=False)
-    practices_access: Mapped[bool] = mapped_column(Boolean, default=False)
 
     updated_at: Mapped[datetime] = mapped_column(
-        DateTime, default=lambda: datetime.now(timezone.utc),
+        TZDateTime, default=lambda: datetime.now(timezone.utc),
         onupdate=lambda: datetime.now(timezone.utc)
     )
 
@@ -195,13 +228,14 @@ class RedeemCode(Base):
 
     is_used: Mapped[bool] = mapped_column(Boolean, default=False)
     used_by: Mapped[int | None] = mapped_column(BigInteger, ForeignKey("users.telegram_id"), nullable=True)
-    used_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    used_at: Mapped[datetime | None] = mapped_column(TZDateTime, nullable=True)
 
     product: Mapped["Product"] = relationship(back_populates="redeem_codes")
 
     __table_args__ = (
         UniqueConstraint("product_id", "code", name="uq_redeem_product_code"),
-        Index("ix_redeem_code", "code"),
+        # ввод кода: code = ? AND is_used = 0
+        Index("ix_redeem_code_is_used", "code", "is_used"),
     )
 
 
@@ -214,7 +248,154 @@ class RedeemUse(Base):
     order_id: Mapped[int | None] = mapped_column(Integer, ForeignKey("orders.id"), nullable=True)
 
     created_at: Mapped[datetime] = mapped_column(
-        DateTime, default=lambda: datetime.now(timezone.utc)
+        TZDateTime, default=lambda: datetime.now(timezone.utc)
+    )
+
+    order: Mapped["Order | None"] = relationship(back_populates="redeem_use")
+
+class OrderEvent(Base):
+    """Журнал заказа (только добавление): смены статуса, платежи, статусы СДЭК."""
+    __tablename__ = "order_events"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    # Без внешнего ключа: история остаётся и для заказов, убранных в архив
+    order_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    kind: Mapped[str] = mapped_column(String(16), nullable=False)  # "status", "payment", "cdek"
+    from_status: Mapped[str | None] = mapped_column(String(32), nullable=True)
+    to_status: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    detail: Mapped[str | None] = mapped_column(String(255), nullable=True)
+
+    created_at: Mapped[datetime] = mapped_column(
+        TZDateTime, default=lambda: datetime.now(timezone.utc), nullable=False
+    )
+
+    __table_args__ = (
+        # таймлайн заказа и окно LEAD() для времени в статусе
+        Index("ix_order_events_order_id_created_at", "order_id", "created_at"),
+        # статистика за период: kind = 'status' AND created_at >= ?
+        Index("ix_order_events_kind_created_at", "kind", "created_at"),
+    )
+
+
+class OrderStatusCount(Base):
+    """
+    Сколько заказов в каждой паре (статус, тип оплаты) — для счётчиков админки.
+    Поддерживается триггерами на orders (db.migrations), приложение сюда не пишет.
+    """
+    __tablename__ = "order_status_counts"
+
+    status: Mapped[str] = mapped_column(String(32), primary_key=True)
+    # '' вместо NULL: NULL не годится в первичный ключ для ON CONFLICT
+    payment_kind: Mapped[str] = mapped_column(String(32), primary_key=True, default="")
+    count: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+
+
+class CdekDeliveryPoint(Base):
+    """
+    Локальная копия справочника ПВЗ СДЭК (/v2/deliverypoints), ведёт cdek.points.
+    data — объект точки как его отдаёт API, data_hash — чтобы при синхронизации
+    перезаписывать только изменившиеся точки. partial — точка найдена по коду в
+    городе, которого в справочнике ещё нет: список ПВЗ этого города неполон.
+    """
+    __tablename__ = "cdek_delivery_points"
+
+    code: Mapped[str] = mapped_column(String(32), primary_key=True)
+    city_code: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    data: Mapped[dict] = mapped_column(JSONType, nullable=False)
+    data_hash: Mapped[str] = mapped_column(String(32), nullable=False)
+    synced_at: Mapped[datetime] = mapped_column(TZDateTime, nullable=False)  # время записи строки
+    partial: Mapped[bool] = mapped_column(Boolean, default=False, server_default=false(), nullable=False)
+
+    __table_args__ = (
+        Index("ix_cdek_delivery_points_city_code", "city_code"),
     )
 
-    order: Mapped["Order | None"] = relationship(back_populates="redeem_use")
\ No newline at end of file
+
+class CdekSyncState(Base):
+    """Время последней полной синхронизации справочника СДЭК (name — "delivery_points")."""
+    __tablename__ = "cdek_sync_state"
+
+    name: Mapped[str] = mapped_column(String(32), primary_key=True)
+    synced_at: Mapped[datetime] = mapped_column(TZDateTime, nullable=False)
+
+
+class CdekCityName(Base):
+    """
+    Нормализованное название города → city_code СДЭК (cdek.cities).
+    source: "pvz" — из справочника ПВЗ, "api" — выучено из ответа /v2/location/cities.
+    weight — число ПВЗ в городе: из одноимённых городов выбирается крупнейший.
+    """
+    __tablename__ = "cdek_city_names"
+
+    name: Mapped[str] = mapped_column(String(128), primary_key=True)
+    code: Mapped[int] = mapped_column(Integer, nullable=False)
+    title: Mapped[str] = mapped_column(String(128), nullable=False)
+    region: Mapped[str | None] = mapped_column(String(128), nullable=True)
+    weight: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    source: Mapped[str] = mapped_column(String(8), nullable=False)
+
+
+class CdekTariffQuote(Base):
+    """
+    Ответ /v2/calculator/tarifflist (tariff_codes) для пары пунктов и габаритов посылки — кэш
+    cdek.tariffs. profile — вес и габариты («750g-26x19x8»): другие габариты — другой ключ.
+    """
+    __tablename__ = "cdek_tariff_quotes"
+
+    from_point: Mapped[str] = mapped_column(String(32), primary_key=True)
+    to_point: Mapped[str] = mapped_column(String(32), primary_key=True)
+    profile: Mapped[str] = mapped_column(String(32), primary_key=True)
+    from_city: Mapped[int] = mapped_column(Integer, nullable=False)
+    to_city: Mapped[int] = mapped_column(Integer, nullable=False)
+    tariffs: Mapped[list] = mapped_column(JSONType, nullable=False)
+    fetched_at: Mapped[datetime] = mapped_column(TZDateTime, nullable=False)
+
+
+# ==================== Холодный архив заказов ====================
+# Старые archived/abandoned заказы вместе с платежами переносятся из orders/payments
+# в orders_archive/payments_archive (db.async_repo.archive_orders_batch), чтобы
+# горячие таблицы и их индексы оставались маленькими.
+# Колонки копируются из Order/Payment: новую колонку в orders миграция должна
+# добавить и в orders_archive (_add_columns), а view orders_all — пересоздать.
+
+def _archive_columns(source: Table) -> list[Column]:
+    # Без внешних ключей и автоинкремента: строки приезжают со своими id
+    return [
+        Column(c.name, c.type, primary_key=c.primary_key, nullable=c.nullable, autoincrement=False)
+        for c in source.columns
+    ]
+
+
+orders_archive = Table(
+    "orders_archive", Base.metadata,
+    *_archive_columns(Order.__table__),
+    Column("archived_at", TZDateTime, nullable=False),
+    Index("ix_orders_archive_user_id", "user_id"),
+    Index("ix_orders_archive_status_id", "status", "id"),
+)
+
+# У платежей свой суррогатный ключ archive_id, исходный payments.id — в payment_id:
+# payments без AUTOINCREMENT, и после архивации платежа с максимальным id SQLite
+# выдаёт тот же id новому платежу — в архиве он был бы повтором первичного ключа.
+# (orders_archive хранит id как ключ: последний заказ archive_orders_batch не трогает.)
+payments_archive = Table(
+    "payments_archive", Base.metadata,
+    Column("archive_id", Integer, primary_key=True, autoincrement=True),
+    Column("payment_id", Integer, nullable=False),
+    *(c for c in _archive_columns(Payment.__table__) if c.name != "id"),
+    Column("archived_at", TZDateTime, nullable=False),
+    Index("ix_payments_archive_order_id", "order_id"),
+)
+
+# orders UNION ALL orders_archive. Из этого же запроса db.migrations создаёт
+# VIEW orders_all для ручных запросов; ORM читает через подзапрос — так
+# SQLAlchemy правильно строит JOIN связей (Order.user), а SQLite проталкивает
+# WHERE id = ? / user_id = ? в обе ветки и идёт по индексам.
+orders_all_select = union_all(
+    select(Order.__table__),
+    select(*(orders_archive.c[c.name] for c in Order.__table__.columns)),
+)
+
+# Order поверх orders_all: чтение заказов вместе с архивом. Только для чтения —
+# изменения такого объекта уйдут UPDATE-ом в orders, где архивной строки нет.
+OrderAll = aliased(Order, orders_all_select.subquery("orders_all"), name="OrderAll")
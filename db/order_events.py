@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import os
+from collections import deque
+from datetime import datetime, timezone
+from itertools import chain
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from .models import Order, Payment
+
+# ==================== Журнал событий заказов ====================
+# События копятся в памяти и пишутся в order_events пачкой фоновой задачей
+# (flush_order_events в db.async_repo), поэтому обработчики не платят за
+# журнал лишним commit.
+#
+# Смены Order.status и новые строки payments ловятся хуками сессии
+# автоматически и попадают в буфер только после commit (откат — выбрасываются).
+# Остальное (успех платежа, статусы СДЭК) пишется явно через record_order_event.
+#
+# Буфер ограничен: если БД долго недоступна, старые события вытесняются.
+
+_MAX_BUFFERED = int(os.getenv("ORDER_EVENTS_MAX_BUFFERED", "100000"))
+_buffer: deque[dict] = deque(maxlen=_MAX_BUFFERED)
+
+
+def _make_event(order_id: int, kind: str, from_status: str | None, to_status: str | None,
+                detail: str | None) -> dict:
+    return {
+        "order_id": order_id,
+        "kind": kind,
+        "from_status": from_status,
+        "to_status": to_status,
+        "detail": detail[:255] if detail else detail,
+        "created_at": datetime.now(timezone.utc),
+    }
+
+
+def record_order_event(order_id: int, kind: str, from_status: str | None = None,
+                       to_status: str | None = None, detail: str | None = None,
+                       session: Session | None = None):
+    """
+    Добавляет событие в журнал. С session — событие попадёт в буфер только
+    после commit этой сессии; без session — сразу.
+    """
+    ev = _make_event(order_id, kind, from_status, to_status, detail)
+    if session is None:
+        _buffer.append(ev)
+    else:
+        session.info.setdefault("order_events", []).append(ev)
+
+
+def take_buffered(limit: int | None = None) -> list[dict]:
+    """Забирает из буфера до limit событий (в порядке поступления)."""
+    n = len(_buffer) if limit is None else min(limit, len(_buffer))
+    return [_buffer.popleft() for _ in range(n)]
+
+
+def requeue(events: list[dict]):
+    """Возвращает неудачно записанную пачку в начало буфера."""
+    _buffer.extendleft(reversed(events))
+
+
+def buffered_count() -> int:
+    return len(_buffer)
+
+
+# ---- хуки сессии: смены статуса заказа и новые платежи ----
+
+@event.listens_for(Session, "after_flush")
+def _collect_order_events(session: Session, _flush_context):
+    pending = session.info.setdefault("order_events", [])
+    for obj in chain(session.new, session.dirty):
+        if isinstance(obj, Order):
+            if obj in session.new:
+                pending.append(_make_event(obj.id, "status", None, obj.status, None))
+                continue
+            history = inspect(obj).attrs.status.history
+            if history.added:
+                old = history.deleted[0] if history.deleted else None
+                if old != history.added[0]:
+                    pending.append(_make_event(obj.id, "status", old, history.added[0], None))
+        elif isinstance(obj, Payment) and obj in session.new:
+            pending.append(_make_event(obj.order_id, "payment", None, obj.status or "pending",
+                                       f"{obj.kind}:{obj.yookassa_payment_id}"))
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_order_events(session: Session):
+    events = session.info.pop("order_events", None)
+    if events:
+        _buffer.extend(events)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _drop_order_events(session: Session, _previous_transaction):
+    session.info.pop("order_events", None)
@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+from sqlalchemy import Row, lambda_stmt, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import Order, OrderAll, User
+from .state_cache import STATE_FIELDS
+
+# ==================== Read-model горячих проверок ====================
+# Меню, кабинет, список заказов и оплата на каждое нажатие читали целый ORM-объект
+# (все колонки users/orders, identity map, хуки сессии), чтобы посмотреть одно-два поля.
+# Здесь — узкие Core-запросы через lambda_stmt: выражение и ключ кэша строятся
+# один раз на место вызова, скомпилированный SQL берётся из кэша Engine
+# (query_cache_size), результат — кортеж или slotted dataclass без identity map.
+#
+# Только чтение: всё, что меняет данные, идёт через ORM (db.async_repo, write_queue).
+
+
+@dataclass(slots=True, frozen=True)
+class UserCard:
+    telegram_id: int
+    is_authorized: bool
+    full_name: str | None
+
+
+@dataclass(slots=True, frozen=True)
+class PracticeAccess:
+    is_authorized: bool
+    practices_mask: int  # см. db.entitlements
+
+
+@dataclass(slots=True)
+class OrderHead:
+    """Поля заказа для проверки владельца и оплаты. Не frozen: send_payment_keyboard
+    меняет status у переданного объекта только в памяти, как у отсоединённого Order."""
+    id: int
+    user_id: int
+    status: str
+    payment_kind: str | None
+    total_price_kop: int
+
+
+@dataclass(slots=True, frozen=True)
+class OrderNotice:
+    """Заказ с именем пользователя — для уведомлений админам."""
+    id: int
+    user_id: int
+    status: str
+    payment_kind: str | None
+    address: str
+    track: str | None
+    full_name: str | None  # None — не авторизован или пользователя нет
+
+
+async def get_user_card(session: AsyncSession, telegram_id: int) -> UserCard | None:
+    row = (await session.execute(lambda_stmt(
+        lambda: select(User.telegram_id, User.is_authorized, User.full_name)
+        .where(User.telegram_id == telegram_id)
+    ))).first()
+    return UserCard(*row) if row is not None else None
+
+
+async def get_practice_access(session: AsyncSession, telegram_id: int) -> PracticeAccess | None:
+    row = (await session.execute(lambda_stmt(
+        lambda: select(User.is_authorized, User.practices_mask).where(User.telegram_id == telegram_id)
+    ))).first()
+    return PracticeAccess(*row) if row is not None else None
+
+
+_STATE_COLUMNS = tuple(getattr(User, f) for f in STATE_FIELDS)
+
+
+async def get_user_state_row(session: AsyncSession, telegram_id: int) -> Row | None:
+    """Поля STATE_FIELDS одной строкой (промах db.state_cache)."""
+    return (await session.execute(lambda_stmt(
+        lambda: select(*_STATE_COLUMNS).where(User.telegram_id == telegram_id)
+    ))).first()
+
+
+async def get_order_head(session: AsyncSession, order_id: int) -> OrderHead | None:
+    """Горячий заказ (архивный оплатить нельзя)."""
+    row = (await session.execute(lambda_stmt(
+        lambda: select(Order.id, Order.user_id, Order.status, Order.payment_kind, Order.total_price_kop)
+        .where(Order.id == order_id)
+    ))).first()
+    return OrderHead(*row) if row is not None else None
+
+
+async def get_user_order_ids(session: AsyncSession, user_id: int) -> list[int]:
+    """id заказов пользователя, включая архив, от новых к старым."""
+    result = await session.scalars(lambda_stmt(
+        lambda: select(OrderAll.id).where(OrderAll.user_id == user_id).order_by(OrderAll.id.desc())
+    ))
+    return list(result.all())
+
+
+async def get_owned_order(session: AsyncSession, order_id: int, user_id: int) -> Order | None:
+    """
+    Заказ (горячий или архивный, только для показа), если он принадлежит user_id.
+    Владелец проверяется в WHERE — чужой заказ не загружается вовсе, пользователь не джойнится.
+    """
+    return (await session.scalars(lambda_stmt(
+        lambda: select(OrderAll).where(OrderAll.id == order_id, OrderAll.user_id == user_id)
+    ))).first()
+
+
+async def get_order_notice(session: AsyncSession, order_id: int) -> OrderNotice | None:
+    """Заказ (горячий или архивный) и full_name пользователя одним SELECT с LEFT JOIN."""
+    row = (await session.execute(lambda_stmt(
+        lambda: select(OrderAll.id, OrderAll.user_id, OrderAll.status, OrderAll.payment_kind,
+                       OrderAll.address, OrderAll.track, User.full_name)
+        .outerjoin(User, User.telegram_id == OrderAll.user_id)
+        .where(OrderAll.id == order_id)
+    ))).first()
+    return OrderNotice(*row) if row is not None else None
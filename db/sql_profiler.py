@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import logging
+import os
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger("box_bot")
+
+# ==================== Профилирование SQL по обработчикам ====================
+# Хуки before/after_cursor_execute на Engine считают каждый SQL-запрос и его время
+# и приписывают их «апдейту», который сейчас выполняется: обработчик aiogram
+# оборачивается в sql_profiler.profile(имя обработчика) (middleware в bot.py).
+# Текущий апдейт хранится в contextvar — AsyncSession выполняет SQL в том же
+# контексте, что и обработчик, поэтому параллельные апдейты не смешиваются.
+#
+# В конце апдейта:
+#   - одинаковый текст SQL N_PLUS_ONE_THRESHOLD раз и больше → N+1 (warning);
+#   - больше SQL_UPDATE_BUDGET запросов → превышение бюджета (warning);
+#   - итог апдейта — в debug-лог.
+# Суммы по обработчикам — sql_profiler.stats() (GET /metrics в bot.py).
+# SQL вне апдейтов (фоновые задачи, старт) копится под именем BACKGROUND.
+
+SQL_PROFILING = os.getenv("SQL_PROFILING", "1") == "1"
+SQL_UPDATE_BUDGET = int(os.getenv("SQL_UPDATE_BUDGET", "12"))
+N_PLUS_ONE_THRESHOLD = int(os.getenv("SQL_N_PLUS_ONE_THRESHOLD", "3"))
+
+BACKGROUND = "(фон)"
+
+
+class UpdateProfile:
+    __slots__ = ("handler", "statements", "sql_time", "repeats", "closed")
+
+    def __init__(self, handler: str):
+        self.handler = handler
+        self.statements = 0
+        self.sql_time = 0.0
+        self.repeats: Counter[str] = Counter()
+        self.closed = False
+
+
+def _new_totals() -> dict:
+    return {"updates": 0, "statements": 0, "sql_time_ms": 0.0, "max_statements": 0,
+            "n_plus_one": 0, "over_budget": 0}
+
+
+class SqlProfiler:
+    def __init__(self, budget: int = 12, n_plus_one_threshold: int = 3):
+        self.budget = budget
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self._current: ContextVar[UpdateProfile | None] = ContextVar("sql_profile", default=None)
+        self._totals: dict[str, dict] = {}
+
+    def install(self, engine):
+        """Подключает счётчики к Engine или AsyncEngine (один раз на engine)."""
+        sync_engine: Engine = getattr(engine, "sync_engine", engine)
+        if not event.contains(sync_engine, "before_cursor_execute", self._before):
+            event.listen(sync_engine, "before_cursor_execute", self._before)
+            event.listen(sync_engine, "after_cursor_execute", self._after)
+
+    def _before(self, conn, _cursor, _statement, _params, _context, _executemany):
+        # Одно соединение выполняет один запрос за раз; после ошибки значение просто перезапишется
+        conn.info["sql_profiler_started"] = time.perf_counter()
+
+    def _after(self, conn, _cursor, statement, _params, _context, _executemany):
+        elapsed = time.perf_counter() - conn.info["sql_profiler_started"]
+        profile = self._current.get()
+        if profile is None or profile.closed:
+            # Вне апдейта или уже после его конца (submit_nowait в очередь записи)
+            totals = self._totals_for(profile.handler if profile else BACKGROUND)
+            totals["statements"] += 1
+            totals["sql_time_ms"] += elapsed * 1000
+            return
+        profile.statements += 1
+        profile.sql_time += elapsed
+        profile.repeats[statement] += 1
+
+    def _totals_for(self, handler: str) -> dict:
+        totals = self._totals.get(handler)
+        if totals is None:
+            totals = self._totals[handler] = _new_totals()
+        return totals
+
+    def current(self) -> UpdateProfile | None:
+        return self._current.get()
+
+    @contextmanager
+    def profile(self, handler: str) -> Iterator[UpdateProfile]:
+        """Апдейт: весь SQL внутри блока приписывается handler."""
+        profile = UpdateProfile(handler)
+        token = self._current.set(profile)
+        try:
+            yield profile
+        finally:
+            self._current.reset(token)
+            self._close(profile)
+
+    @contextmanager
+    def attach(self, profile: UpdateProfile | None):
+        """SQL внутри блока — в чужой апдейт (очередь записи выполняет единицы отправителей)."""
+        token = self._current.set(profile)
+        try:
+            yield
+        finally:
+            self._current.reset(token)
+
+    def _close(self, profile: UpdateProfile):
+        profile.closed = True
+        totals = self._totals_for(profile.handler)
+        totals["updates"] += 1
+        totals["statements"] += profile.statements
+        totals["sql_time_ms"] += profile.sql_time * 1000
+        totals["max_statements"] = max(totals["max_statements"], profile.statements)
+
+        repeated = [(sql, n) for sql, n in profile.repeats.items() if n >= self.n_plus_one_threshold]
+        if repeated:
+            totals["n_plus_one"] += 1
+            for sql, n in repeated:
+                logger.warning(f"SQL N+1 в {profile.handler}: {n} одинаковых запросов за апдейт: {' '.join(sql.split())[:300]}")
+        if profile.statements > self.budget:
+            totals["over_budget"] += 1
+            logger.warning(f"SQL {profile.handler}: {profile.statements} запросов за апдейт (бюджет {self.budget})")
+        logger.debug(f"SQL {profile.handler}: {profile.statements} запросов, {profile.sql_time * 1000:.1f} мс")
+
+    def stats(self) -> dict[str, dict]:
+        """Суммы по обработчикам, самые дорогие по времени SQL — первыми."""
+        result = {}
+        for handler, totals in sorted(self._totals.items(), key=lambda kv: -kv[1]["sql_time_ms"]):
+            row = dict(totals, sql_time_ms=round(totals["sql_time_ms"], 2))
+            if totals["updates"]:
+                row["avg_statements"] = round(totals["statements"] / totals["updates"], 2)
+            result[handler] = row
+        return result
+
+    def reset(self):
+        self._totals.clear()
+
+
+sql_profiler = SqlProfiler(budget=SQL_UPDATE_BUDGET, n_plus_one_threshold=N_PLUS_ONE_THRESHOLD)
@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import os
+import time
+from collections import OrderedDict
+from itertools import chain
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from .models import User
+from .repo import database_url
+
+
+# ==================== Кэш состояния пользователя ====================
+# Маленький снимок строки users, по которому роутер решает, что делать с
+# сообщением: авторизация, флаги awaiting_* и временные id текущей операции.
+# LRU с ограничением размера + TTL (страховка от записей мимо ORM-сессий:
+# другой процесс, сырой SQL).
+#
+# Write-through: любая сессия, закоммитившая изменения User, кладёт свежий
+# снимок в кэш (хуки after_flush/after_commit ниже). Массовые UPDATE users
+# в обход ORM должны сами вызывать user_state_cache.invalidate() или, внутри
+# транзакции, invalidate_on_commit(session, telegram_id).
+#
+# Кэш живёт в event loop одного процесса — блокировки не нужны.
+#
+# Ограничение: кэш локален для процесса, а сбрасывают его только хуки сессий
+# этого же процесса. Если процессов несколько (PostgreSQL за несколькими
+# воркерами uvicorn), запись в одном не видна кэшу другого до TTL: флаг
+# awaiting_* выставил воркер A, следующее сообщение пришло в воркер B со
+# старым снимком — ввод ушёл не туда. Поэтому configure_for() (его вызывает
+# init_async_engine) выключает кэш, если БД не SQLite или WEB_CONCURRENCY > 1:
+# состояние тогда всегда читается лёгким SELECT. Межпроцессной инвалидации
+# (LISTEN/NOTIFY) нет.
+
+STATE_FIELDS = (
+    "is_authorized",
+    "awaiting_auth",
+    "awaiting_gift_message",
+    "awaiting_pvz_address",
+    "awaiting_manual_pvz",
+    "awaiting_redeem_code",
+    "awaiting_manual_track",
+    "pvz_for_order_id",
+    "temp_gift_order_id",
+    "temp_order_id_for_track",
+)
+AWAITING_FIELDS = tuple(f for f in STATE_FIELDS if f.startswith("awaiting_"))
+
+
+class UserStateCache:
+    def __init__(self, maxsize: int = 10_000, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[int, tuple[float, dict]] = OrderedDict()
+        # Счётчик записей: заполнение из БД отменяется, если за время чтения была запись
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.disabled_reason: str | None = None
+
+    def get(self, telegram_id: int) -> dict | None:
+        entry = self._data.get(telegram_id)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            if entry is not None:
+                del self._data[telegram_id]
+            self.misses += 1
+            return None
+        self._data.move_to_end(telegram_id)
+        self.hits += 1
+        return entry[1]
+
+    def write_token(self) -> int:
+        return self._writes
+
+    def fill(self, telegram_id: int, state: dict, token: int):
+        """Кладёт снимок, прочитанный из БД, если с момента write_token() не было записей."""
+        if token == self._writes:
+            self._store(telegram_id, state)
+
+    def put(self, telegram_id: int, state: dict):
+        self._writes += 1
+        self._store(telegram_id, state)
+
+    def invalidate(self, telegram_id: int | None = None):
+        self._writes += 1
+        if telegram_id is None:
+            self._data.clear()
+        else:
+            self._data.pop(telegram_id, None)
+
+    def disable(self, reason: str):
+        """Выключить кэш: get() всегда промах, записи не хранятся."""
+        self.disabled_reason = reason
+        self.ttl = 0.0
+        self.invalidate()
+
+    def _store(self, telegram_id: int, state: dict):
+        if self.ttl <= 0:
+            return
+        self._data[telegram_id] = (time.monotonic(), state)
+        self._data.move_to_end(telegram_id)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "disabled": self.disabled_reason,
+        }
+
+
+user_state_cache = UserStateCache(
+    maxsize=int(os.getenv("USER_STATE_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("USER_STATE_CACHE_TTL_SEC", "300")),
+)
+
+
+def configure_for(db: str, workers: int | None = None):
+    """Выключает кэш, если процессов с этой БД может быть несколько (см. ограничение выше)."""
+    if workers is None:
+        workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    backend = database_url(db).get_backend_name()
+    if backend != "sqlite":
+        user_state_cache.disable(f"БД {backend}: воркеров может быть несколько")
+    elif workers > 1:
+        user_state_cache.disable(f"WEB_CONCURRENCY={workers}")
+
+
+def snapshot(user: User) -> dict | None:
+    """Снимок состояния из загруженных атрибутов; None, если что-то не загружено."""
+    loaded = inspect(user).dict
+    if any(f not in loaded for f in STATE_FIELDS):
+        return None
+    return {f: loaded[f] for f in STATE_FIELDS}
+
+
+# ---- write-through: хуки на все ORM-сессии (sync и AsyncSession внутри) ----
+
+@event.listens_for(Session, "after_flush")
+def _collect_user_states(session: Session, _flush_context):
+    pending = session.info.setdefault("user_states", {})
+    for obj in chain(session.new, session.dirty):
+        if isinstance(obj, User):
+            pending[obj.telegram_id] = snapshot(obj)
+    for obj in session.deleted:
+        if isinstance(obj, User):
+            pending[obj.telegram_id] = None
+
+
+def invalidate_on_commit(session, telegram_id: int):
+    """
+    Для UPDATE users в обход ORM: снимок сбрасывается после commit сессии
+    (session — Session или AsyncSession), при откате ничего не происходит.
+    Сброс до commit не годится: параллельное чтение успело бы положить в кэш старую строку.
+    """
+    session.info.setdefault("user_states", {})[telegram_id] = None
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_user_states(session: Session):
+    for telegram_id, state in session.info.pop("user_states", {}).items():
+        if state is None:
+            user_state_cache.invalidate(telegram_id)
+        else:
+            user_state_cache.put(telegram_id, state)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _drop_user_states(session: Session, _previous_transaction):
+    session.info.pop("user_states", None)
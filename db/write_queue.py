@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Callable
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from .async_repo import AsyncSessionLocal
+from .sql_profiler import UpdateProfile, sql_profiler
+
+logger = logging.getLogger("box_bot")
+
+# ==================== Очередь записи (один писатель, групповой commit) ====================
+# SQLite пускает одного писателя за раз: обработчики, коммитящие каждый сам по себе,
+# встают в очередь на блокировку БД и платят за каждый commit отдельно.
+# Здесь запись идёт через одну фоновую задачу: обработчик отдаёт «единицу работы» —
+# async-функцию unit(session), которая меняет данные, но НЕ делает commit, —
+# а писатель применяет все накопившиеся единицы в одной транзакции и коммитит один раз.
+#
+#   order_id = await write_queue.submit(unit)   # дождаться commit (результат unit)
+#   write_queue.submit_nowait(unit)             # не ждать: ошибка уйдёт в лог
+#
+# Пачка = всё, что накопилось в очереди, пока шёл предыдущий commit (до MAX_BATCH).
+# Если пачка упала, каждая её единица выполняется заново в своей транзакции:
+# ошибка одной единицы не откатывает остальные. Поэтому unit должна быть
+# повторяемой — читать всё, что ей нужно, через переданную session.
+# Хуки сессий (кэш состояния, журнал заказов) срабатывают на commit пачки как обычно.
+# SQL единицы профилировщик приписывает апдейту, который её поставил (db.sql_profiler);
+# flush изменённых объектов и commit пачки общие и идут в «фон».
+#
+# Через очередь идут не все записи. В bot.py это самые частые короткие записи
+# пользователей: reset_states, cb_checkout_start и cb_pvz_select. Сюда же пишут
+# справочники СДЭК (cdek.points, cdek.cities, cdek.tariffs). Остальные обработчики
+# (успешная оплата, смена статуса админом, активация кода и т.д.) по-прежнему
+# коммитят сами через AsyncSessionLocal. Их commit перемежается с запросами к
+# ЮKassa/СДЭК и Telegram, и такую запись нельзя просто повторить как unit.
+# Эти commit конкурируют с пачками очереди за блокировку SQLite и не делят с
+# ними fsync. Чем больше таких писателей, тем меньше выигрыш; профиль mixed в
+# scripts/bench_write_queue.py показывает именно этот случай.
+
+WRITE_QUEUE_MAX_BATCH = int(os.getenv("WRITE_QUEUE_MAX_BATCH", "64"))
+# Дополнительное ожидание попутчиков после первой единицы пачки (0 — не ждать)
+WRITE_QUEUE_MAX_DELAY_MS = float(os.getenv("WRITE_QUEUE_MAX_DELAY_MS", "0"))
+
+WriteUnit = Callable[[AsyncSession], Awaitable[Any]]
+
+
+class WriteQueue:
+    def __init__(self, sessionmaker: async_sessionmaker, max_batch: int = 64, max_delay: float = 0.0):
+        self.sessionmaker = sessionmaker
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue: asyncio.Queue[tuple[WriteUnit, asyncio.Future, UpdateProfile | None] | None] | None = None
+        self._task: asyncio.Task | None = None
+        self.batches = 0
+        self.units = 0
+        self.fallbacks = 0
+        self.max_batch_seen = 0
+
+    def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Дописывает всё, что уже в очереди, и останавливает писателя."""
+        if self._task is None:
+            return
+        self._queue.put_nowait(None)
+        await self._task
+        self._task = None
+        self._queue = None
+
+    def _enqueue(self, unit: WriteUnit) -> asyncio.Future:
+        if self._task is None:
+            raise RuntimeError("Очередь записи не запущена — вызовите write_queue.start() при старте")
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((unit, future, sql_profiler.current()))
+        return future
+
+    async def submit(self, unit: WriteUnit) -> Any:
+        """Ставит unit в очередь и ждёт commit. Возвращает результат unit или бросает её ошибку."""
+        return await self._enqueue(unit)
+
+    def submit_nowait(self, unit: WriteUnit) -> asyncio.Future:
+        """Ставит unit в очередь, не дожидаясь commit. Ошибку никто не ждёт — она уходит в лог."""
+        future = self._enqueue(unit)
+        future.add_done_callback(_log_error)
+        return future
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            if self.max_delay:
+                await asyncio.sleep(self.max_delay)
+            while len(batch) < self.max_batch and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._apply(batch)
+
+    async def _apply(self, batch: list[tuple[WriteUnit, asyncio.Future, UpdateProfile | None]]):
+        self.batches += 1
+        self.units += len(batch)
+        self.max_batch_seen = max(self.max_batch_seen, len(batch))
+        try:
+            async with self.sessionmaker() as session:
+                results = [await _call(unit, session, profile) for unit, _, profile in batch]
+                await session.commit()
+        except Exception as e:
+            if len(batch) == 1:
+                _resolve(batch[0][1], error=e)
+                return
+            # Кто-то в пачке упал — прогоняем каждую единицу отдельно
+            self.fallbacks += 1
+            logger.warning(f"Очередь записи: пачка из {len(batch)} не записана ({e}), пишем по одной")
+            for unit, future, profile in batch:
+                try:
+                    async with self.sessionmaker() as session:
+                        result = await _call(unit, session, profile)
+                        await session.commit()
+                except Exception as unit_error:
+                    _resolve(future, error=unit_error)
+                else:
+                    _resolve(future, result=result)
+            return
+        for (_, future, _), result in zip(batch, results):
+            _resolve(future, result=result)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "units": self.units,
+            "avg_batch": self.units / self.batches if self.batches else 0.0,
+            "max_batch": self.max_batch_seen,
+            "fallbacks": self.fallbacks,
+            "queued": self._queue.qsize() if self._queue else 0,
+        }
+
+
+async def _call(unit: WriteUnit, session: AsyncSession, profile: UpdateProfile | None) -> Any:
+    with sql_profiler.attach(profile):
+        return await unit(session)
+
+
+def _resolve(future: asyncio.Future, result: Any = None, error: BaseException | None = None):
+    if future.cancelled():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+def _log_error(future: asyncio.Future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(f"Очередь записи: ошибка в единице работы: {future.exception()!r}")
+
+
+write_queue = WriteQueue(AsyncSessionLocal, max_batch=WRITE_QUEUE_MAX_BATCH, max_delay=WRITE_QUEUE_MAX_DELAY_MS / 1000)
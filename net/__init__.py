@@ -0,0 +1 @@
+# Пустой файл — делает папку пакетом Python
\ No newline at end of file
@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any
+
+import aiohttp
+
+logger = logging.getLogger("box_bot")
+
+# ==================== Исходящий HTTP (СДЭК, ЮKassa) ====================
+# Раньше каждый вызов шёл через requests в asyncio.to_thread: поток на вызов и
+# новое TCP+TLS-соединение к api.cdek.ru каждый раз (а get_available_tariffs
+# вызывал requests прямо в event loop). Здесь у каждого внешнего сервиса
+# (Upstream) одна долгоживущая aiohttp.ClientSession:
+#
+#   - keep-alive: соединения переиспользуются, рукопожатие — один раз;
+#   - не больше HTTP_LIMIT_PER_HOST соединений к хосту (остальные ждут в очереди);
+#   - DNS кэшируется на HTTP_DNS_TTL_SEC;
+#   - таймауты — HTTP_TIMEOUT_SEC на весь запрос, HTTP_CONNECT_TIMEOUT_SEC на подключение.
+#
+# Все настройки — здесь. Ответ читается целиком и отдаётся как HttpResponse с тем же
+# интерфейсом, что у requests.Response (status_code, text, json(), raise_for_status()),
+# поэтому вызывающему коду не нужно держать соединение.
+# Сессии создаются при первом запросе (внутри event loop); close_all() — при остановке.
+
+HTTP_LIMIT_PER_HOST = int(os.getenv("HTTP_LIMIT_PER_HOST", "20"))
+HTTP_TIMEOUT_SEC = float(os.getenv("HTTP_TIMEOUT_SEC", "15"))
+HTTP_CONNECT_TIMEOUT_SEC = float(os.getenv("HTTP_CONNECT_TIMEOUT_SEC", "5"))
+HTTP_DNS_TTL_SEC = int(os.getenv("HTTP_DNS_TTL_SEC", "300"))
+HTTP_KEEPALIVE_SEC = float(os.getenv("HTTP_KEEPALIVE_SEC", "60"))
+
+
+class HttpError(Exception):
+    def __init__(self, response: HttpResponse):
+        super().__init__(f"{response.status_code} для {response.url}")
+        self.response = response
+
+
+class HttpResponse:
+    __slots__ = ("status_code", "url", "content")
+
+    def __init__(self, status_code: int, url: str, content: bytes):
+        self.status_code = status_code
+        self.url = url
+        self.content = content
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.status_code < 400
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self) -> Any:
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise HttpError(self)
+
+
+class Upstream:
+    def __init__(self, name: str, base_url: str, limit_per_host: int = HTTP_LIMIT_PER_HOST,
+                 timeout: float = HTTP_TIMEOUT_SEC, connect_timeout: float = HTTP_CONNECT_TIMEOUT_SEC):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.limit_per_host = limit_per_host
+        self.timeout = aiohttp.ClientTimeout(total=timeout, connect=connect_timeout)
+        self._session: aiohttp.ClientSession | None = None
+        self.requests = 0
+        self.errors = 0
+        self.connections = 0  # новые соединения (остальные запросы — по keep-alive)
+        self.total_time = 0.0
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            trace = aiohttp.TraceConfig()
+            trace.on_connection_create_end.append(self._on_connection)
+            connector = aiohttp.TCPConnector(
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=HTTP_DNS_TTL_SEC,
+                keepalive_timeout=HTTP_KEEPALIVE_SEC,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector, timeout=self.timeout, trace_configs=[trace], raise_for_status=False,
+            )
+        return self._session
+
+    async def _on_connection(self, _session, _ctx, _params):
+        self.connections += 1
+
+    async def request(self, method: str, path: str, *, timeout: float | None = None, **kwargs) -> HttpResponse:
+        """
+        Запрос к base_url + path. kwargs — как у aiohttp (json, data, params, headers).
+        Сетевые ошибки и таймауты — исключения aiohttp/asyncio; статус ответа не проверяется.
+        """
+        url = path if "://" in path else f"{self.base_url}{path}"
+        if timeout is not None:
+            kwargs["timeout"] = aiohttp.ClientTimeout(total=timeout, connect=self.timeout.connect)
+        started = time.perf_counter()
+        self.requests += 1
+        try:
+            async with self._get_session().request(method, url, **kwargs) as resp:
+                return HttpResponse(resp.status, url, await resp.read())
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.errors += 1
+            raise
+        finally:
+            self.total_time += time.perf_counter() - started
+
+    async def get(self, path: str, **kwargs) -> HttpResponse:
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path: str, **kwargs) -> HttpResponse:
+        return await self.request("POST", path, **kwargs)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "connections": self.connections,
+            "avg_ms": round(self.total_time / self.requests * 1000, 1) if self.requests else None,
+        }
+
+
+cdek_http = Upstream("cdek", "https://api.cdek.ru")
+cdek_edu_http = Upstream("cdek_edu", "https://api.edu.cdek.ru")
+yookassa_http = Upstream("yookassa", "https://api.yookassa.ru")
+
+UPSTREAMS = (cdek_http, cdek_edu_http, yookassa_http)
+
+
+async def close_all():
+    for upstream in UPSTREAMS:
+        await upstream.close()
+
+
+def stats() -> dict[str, dict]:
+    return {upstream.name: upstream.stats() for upstream in UPSTREAMS}
@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+import uuid
+
+import aiohttp
+from yookassa import Configuration
+from yookassa.domain.request import PaymentRequest
+from yookassa.domain.response import PaymentResponse
+
+from .http import HttpError, yookassa_http
+
+# ==================== ЮKassa через общий HTTP-пул ====================
+# SDK yookassa синхронный (requests, новое соединение на каждый вызов), а
+# Payment.create / Payment.find_one вызывались прямо в обработчиках — event loop
+# стоял всё время запроса. Здесь те же два вызова через yookassa_http (net.http).
+# Запрос собирается и проверяется классами SDK (PaymentRequest), ответ — тот же
+# PaymentResponse, так что вызывающий код не меняется. Ключи — Configuration SDK.
+
+
+def _auth() -> aiohttp.BasicAuth:
+    return aiohttp.BasicAuth(str(Configuration.account_id), str(Configuration.secret_key))
+
+
+async def create_payment(params: dict, idempotency_key: str | None = None) -> PaymentResponse:
+    """Аналог Payment.create. Ошибка API — HttpError (в тексте ответа — описание от ЮKassa)."""
+    request = PaymentRequest(params)
+    request.validate()
+    resp = await yookassa_http.post(
+        "/v3/payments",
+        json=dict(request),
+        auth=_auth(),
+        headers={"Idempotence-Key": idempotency_key or str(uuid.uuid4())},
+    )
+    if resp.status_code != 200:
+        raise HttpError(resp)
+    return PaymentResponse(resp.json())
+
+
+async def find_payment(payment_id: str) -> PaymentResponse:
+    """Аналог Payment.find_one."""
+    if not isinstance(payment_id, str) or not payment_id:
+        raise ValueError("Invalid payment_id value")
+    resp = await yookassa_http.get(f"/v3/payments/{payment_id}", auth=_auth())
+    if resp.status_code != 200:
+        raise HttpError(resp)
+    return PaymentResponse(resp.json())
@@ -0,0 +1,44 @@
+"""
+Переносит старые archived/abandoned заказы с платежами в orders_archive
+(то же, что делает фоновая задача бота раз в ARCHIVE_INTERVAL_SEC).
+Удобно для первого прогона на большой БД или для запуска по cron.
+
+Запуск:  python scripts/archive_orders.py [путь к БД или URL] [дней хранения] [размер пачки]
+"""
+import asyncio
+import os
+import sys
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
+sys.path.append(PROJECT_ROOT)
+
+from sqlalchemy import func, select
+from db.async_repo import (
+    AsyncSessionLocal, init_async_engine, dispose_async_engine, archive_old_orders, ARCHIVE_BATCH,
+)
+from db.models import Order, orders_archive
+
+DB_PATH = os.getenv("DATABASE_URL") or os.getenv("DB_PATH", "app.sqlite3")
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "30"))
+
+
+async def main(db_path: str, days: int, batch: int):
+    init_async_engine(db_path)
+    started = time.perf_counter()
+    orders_moved, payments_moved = await archive_old_orders(days, batch=batch)
+    elapsed = time.perf_counter() - started
+    async with AsyncSessionLocal() as sess:
+        hot = await sess.scalar(select(func.count()).select_from(Order))
+        cold = await sess.scalar(select(func.count()).select_from(orders_archive))
+    await dispose_async_engine()
+    print(f"{db_path}: перенесено {orders_moved} заказов и {payments_moved} платежей за {elapsed:.1f} с; "
+          f"в orders {hot}, в orders_archive {cold}")
+
+
+if __name__ == "__main__":
+    db_path = sys.argv[1] if len(sys.argv) > 1 else DB_PATH
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else ARCHIVE_AFTER_DAYS
+    batch = int(sys.argv[3]) if len(sys.argv) > 3 else ARCHIVE_BATCH
+    asyncio.run(main(db_path, days, batch))
@@ -0,0 +1,173 @@
+"""
+Бенчмарк конкурентного доступа к SQLite: N пользователей + два фоновых поллера
+(аналоги check_all_shipped_orders и check_pending_timeouts) работают одновременно.
+
+Сравниваем профили:
+  default — journal_mode=DELETE, без прагм, чтения и записи через один пул
+  tuned   — SQLITE_PRAGMAS из db.repo (WAL и т.д.) + отдельный read-only пул
+
+Запуск:  python scripts/bench_concurrency.py [кол-во пользователей] [секунд на профиль]
+"""
+import os
+import sys
+import random
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone, timedelta
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
+sys.path.append(PROJECT_ROOT)
+
+from sqlalchemy import select, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+from db.models import Base, Order, Product, User
+from db.repo import make_engine, get_user_by_id, get_user_orders_db, SQLITE_PRAGMAS
+
+SEED_USERS = 500
+SEED_ORDERS = 5000
+
+
+def seed(engine):
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    now = datetime.now(timezone.utc)
+    with Session() as sess:
+        sess.add(Product(code="anxiety", title="Коробочка", price_kop=599000))
+        sess.add_all(User(telegram_id=uid) for uid in range(SEED_USERS))
+        sess.flush()
+        statuses = ["shipped", "pending_payment", "paid_full", "archived", "new"]
+        sess.add_all(
+            Order(
+                user_id=i % SEED_USERS, product_id=1, total_price_kop=599000,
+                status=statuses[i % len(statuses)],
+                created_at=now - timedelta(minutes=i % 60),
+            )
+            for i in range(SEED_ORDERS)
+        )
+        sess.commit()
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ops = 0
+        self.errors = 0
+        self.latencies: list[float] = []
+
+    def record(self, started: float, ok: bool):
+        with self.lock:
+            if ok:
+                self.ops += 1
+                self.latencies.append(time.perf_counter() - started)
+            else:
+                self.errors += 1
+
+
+def user_loop(uid: int, write_session, read_session, stop: threading.Event, stats: Stats):
+    rnd = random.Random(uid)
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            if rnd.random() < 0.7:
+                with read_session() as sess:
+                    get_user_by_id(sess, uid)
+                    get_user_orders_db(sess, uid)
+            else:
+                with write_session() as sess:
+                    user = get_user_by_id(sess, uid)
+                    user.awaiting_pvz_address = not user.awaiting_pvz_address
+                    sess.commit()
+            stats.record(started, True)
+        except OperationalError:
+            stats.record(started, False)
+
+
+def shipped_poller(write_session, read_session, stop: threading.Event, stats: Stats):
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            with read_session() as sess:
+                ids = list(sess.scalars(select(Order.id).where(Order.status == "shipped")))
+            with write_session() as sess:
+                for oid in ids[:20]:
+                    order = sess.get(Order, oid)
+                    order.track = f"T{random.randint(10 ** 9, 10 ** 10)}"
+                    sess.commit()
+            stats.record(started, True)
+        except OperationalError:
+            stats.record(started, False)
+        time.sleep(0.05)
+
+
+def pending_poller(write_session, read_session, stop: threading.Event, stats: Stats):
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            with write_session() as sess:
+                sess.execute(
+                    update(Order)
+                    .where(Order.status == "pending_payment",
+                           Order.created_at < datetime.now(timezone.utc) - timedelta(minutes=30))
+                    .values(updated_at=datetime.now(timezone.utc))
+                )
+                sess.commit()
+            stats.record(started, True)
+        except OperationalError:
+            stats.record(started, False)
+        time.sleep(0.05)
+
+
+def run_profile(label: str, n_users: int, seconds: float, tuned: bool):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.sqlite3")
+        pragmas = SQLITE_PRAGMAS if tuned else {}
+        engine = make_engine(db_path, pragmas=pragmas)
+        seed(engine)
+        write_session = sessionmaker(bind=engine)
+        if tuned:
+            read_engine = make_engine(db_path, pragmas=pragmas, readonly=True)
+            read_session = sessionmaker(bind=read_engine)
+        else:
+            read_engine = None
+            read_session = write_session
+
+        stop = threading.Event()
+        user_stats, poller_stats = Stats(), Stats()
+        threads = [
+            threading.Thread(target=user_loop, args=(uid, write_session, read_session, stop, user_stats))
+            for uid in range(n_users)
+        ]
+        threads.append(threading.Thread(target=shipped_poller, args=(write_session, read_session, stop, poller_stats)))
+        threads.append(threading.Thread(target=pending_poller, args=(write_session, read_session, stop, poller_stats)))
+        for t in threads:
+            t.start()
+        time.sleep(seconds)
+        stop.set()
+        for t in threads:
+            t.join()
+
+        engine.dispose()
+        if read_engine is not None:
+            read_engine.dispose()
+
+    lat = sorted(user_stats.latencies) or [0.0]
+    p50 = lat[len(lat) // 2] * 1000
+    p99 = lat[min(len(lat) - 1, int(len(lat) * 0.99))] * 1000
+    print(
+        f"{label:>8}: {user_stats.ops / seconds:,.0f} оп/с пользователей | "
+        f"p50 {p50:.1f} мс, p99 {p99:.1f} мс | "
+        f"ошибок 'database is locked': {user_stats.errors + poller_stats.errors} | "
+        f"проходов поллеров: {poller_stats.ops}"
+    )
+
+
+if __name__ == "__main__":
+    n_users = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    print(f"Пользователей: {n_users}, по {seconds:.0f} с на профиль")
+    run_profile("default", n_users, seconds, tuned=False)
+    run_profile("tuned", n_users, seconds, tuned=True)
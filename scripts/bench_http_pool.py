@@ -0,0 +1,136 @@
+"""
+Сравнение задержки исходящих запросов: как было (requests.post в asyncio.to_thread,
+новое соединение на каждый вызов) и общий пул net.http (aiohttp, keep-alive).
+
+Запросы идут в локальную заглушку /v2/calculator/tarifflist с ответом размером
+с настоящий. Если в системе есть openssl, заглушка работает по HTTPS с самоподписанным
+сертификатом — тогда в «как было» входит и TLS-рукопожатие, как с api.cdek.ru.
+Сетевой задержки до СДЭК (десятки мс на каждый RTT рукопожатия) здесь нет,
+поэтому в проде разница больше.
+
+Режимы: последовательно (один пользователь) и параллельно (CONCURRENCY одновременных).
+
+Запуск:  python scripts/bench_http_pool.py [запросов на режим]
+"""
+import asyncio
+import os
+import shutil
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
+sys.path.append(PROJECT_ROOT)
+
+import requests
+import urllib3
+from aiohttp import web
+from net.http import Upstream
+
+CONCURRENCY = 20
+TARIFFS = {"tariff_codes": [
+    {"tariff_code": code, "tariff_name": f"Тариф {code}", "delivery_mode": 4,
+     "delivery_sum": 300 + code, "period_min": 2, "period_max": 5}
+    for code in range(100, 130)
+]}
+PAYLOAD = {"type": 1, "from_location": {"code": 44}, "to_location": {"code": 270},
+           "packages": [{"weight": 750, "length": 30, "width": 20, "height": 10}],
+           "shipment_point": "MSK2296", "delivery_point": "NSK123"}
+
+
+def make_cert(tmp: str) -> ssl.SSLContext | None:
+    if shutil.which("openssl") is None:
+        return None
+    cert, key = os.path.join(tmp, "cert.pem"), os.path.join(tmp, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=127.0.0.1",
+         "-keyout", key, "-out", cert],
+        check=True, capture_output=True,
+    )
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert, key)
+    return context
+
+
+async def tarifflist(request: web.Request):
+    await request.json()
+    return web.json_response(TARIFFS)
+
+
+def summary(label: str, latencies: list[float], wall: float, connections: int | None) -> str:
+    ms = sorted(x * 1000 for x in latencies)
+    p95 = ms[int(len(ms) * 0.95)]
+    conns = f", соединений {connections}" if connections is not None else ""
+    return (f"{label:>32}: среднее {statistics.mean(ms):6.2f} мс, p50 {statistics.median(ms):6.2f}, "
+            f"p95 {p95:6.2f}, всего {wall:6.2f} с{conns}")
+
+
+async def run(call, n: int, concurrency: int) -> tuple[list[float], float]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            await call()
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(n)))
+    return latencies, time.perf_counter() - started
+
+
+async def main(n: int, tmp: str):
+    server_ssl = make_cert(tmp)
+    app = web.Application()
+    app.router.add_post("/v2/calculator/tarifflist", tarifflist)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0, ssl_context=server_ssl, backlog=1024)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    scheme = "https" if server_ssl else "http"
+    base = f"{scheme}://127.0.0.1:{port}"
+    urllib3.disable_warnings()
+    print(f"Заглушка: {base} ({'TLS' if server_ssl else 'без TLS — openssl не найден'}), {n} запросов на режим")
+
+    def old_call():
+        r = requests.post(f"{base}/v2/calculator/tarifflist", json=PAYLOAD,
+                          headers={"Authorization": "Bearer x"}, timeout=15, verify=False)
+        r.json()
+
+    async def old():
+        await asyncio.to_thread(old_call)
+
+    pool = Upstream("bench", base)
+
+    async def new():
+        r = await pool.post("/v2/calculator/tarifflist", json=PAYLOAD, headers={"Authorization": "Bearer x"},
+                            ssl=False)
+        r.json()
+
+    try:
+        await run(old, 20, 1)
+        await run(new, 20, 1)
+        for concurrency in (1, CONCURRENCY):
+            mode = "последовательно" if concurrency == 1 else f"параллельно по {concurrency}"
+            before = pool.connections
+            old_lat, old_wall = await run(old, n, concurrency)
+            new_lat, new_wall = await run(new, n, concurrency)
+            print(mode)
+            print("  " + summary("requests + to_thread", old_lat, old_wall, n))
+            print("  " + summary("net.http (aiohttp, keep-alive)", new_lat, new_wall, pool.connections - before))
+            print(f"  ускорение среднего: x{statistics.mean(old_lat) / statistics.mean(new_lat):.1f}")
+    finally:
+        await pool.close()
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(main(n, tmp))
@@ -0,0 +1,142 @@
+"""
+Микробенчмарк горячих проверок: ORM-путь обработчика против db.read_model.
+
+Для каждой проверки — сколько микросекунд уходит на один вызов (новая
+read-only сессия на вызов, как в обработчике):
+  user_flags     cb_menu:         get_user_by_id            → get_user_state (промах кэша)
+  user_card      cb_cabinet:      get_user_by_id            → get_user_card
+  order_head     cb_pay:          sess.get(Order)           → get_order_head
+  owned_order    get_order_by_id: get_order_any + проверка  → get_owned_order
+  user_order_ids cb_orders_list:  get_user_orders_db(архив) → get_user_order_ids
+
+Запуск:  python scripts/bench_read_model.py [вызовов на проверку]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
+sys.path.append(PROJECT_ROOT)
+
+from sqlalchemy.orm import Session
+from db.async_repo import (
+    AsyncReadSessionLocal, init_async_engine, dispose_async_engine,
+    get_user_by_id, get_user_state, get_order_any, get_user_orders_db,
+)
+from db.migrations import run_migrations
+from db.models import Order, User
+from db.read_model import get_user_card, get_order_head, get_owned_order, get_user_order_ids
+from db.repo import make_engine, ensure_product
+from db.state_cache import user_state_cache
+
+USERS = 500
+ORDERS_PER_USER = 5
+
+
+def seed(db_path: str):
+    engine = make_engine(db_path)
+    run_migrations(engine)
+    with Session(engine) as sess:
+        product = ensure_product(sess, "anxiety", "Коробочка", price_kop=599000)
+        sess.add_all(User(telegram_id=uid, full_name=f"Пользователь {uid}") for uid in range(USERS))
+        sess.flush()
+        sess.add_all(
+            Order(user_id=uid, product_id=product.id, total_price_kop=599000, address="Москва, ПВЗ")
+            for _ in range(ORDERS_PER_USER) for uid in range(USERS)
+        )
+        sess.commit()
+    engine.dispose()
+
+
+# ---- ORM-путь (как было в обработчиках) ----
+
+async def orm_user_flags(sess, uid, oid):
+    return (await get_user_by_id(sess, uid)).awaiting_auth
+
+
+async def orm_user_card(sess, uid, oid):
+    user = await get_user_by_id(sess, uid)
+    return user.is_authorized, user.full_name
+
+
+async def orm_order_head(sess, uid, oid):
+    order = await sess.get(Order, oid)
+    return order.user_id == uid and order.status
+
+
+async def orm_owned_order(sess, uid, oid):
+    order = await get_order_any(sess, oid)
+    return order if order and order.user_id == uid else None
+
+
+async def orm_user_order_ids(sess, uid, oid):
+    return [o.id for o in await get_user_orders_db(sess, uid, include_archive=True)]
+
+
+# ---- read-model ----
+
+async def rm_user_flags(sess, uid, oid):
+    user_state_cache.invalidate(uid)  # меряем SELECT, а не попадание в кэш
+    return (await get_user_state(sess, uid))["awaiting_auth"]
+
+
+async def rm_user_card(sess, uid, oid):
+    return await get_user_card(sess, uid)
+
+
+async def rm_order_head(sess, uid, oid):
+    return await get_order_head(sess, oid)
+
+
+async def rm_owned_order(sess, uid, oid):
+    return await get_owned_order(sess, oid, uid)
+
+
+async def rm_user_order_ids(sess, uid, oid):
+    return await get_user_order_ids(sess, uid)
+
+
+CHECKS = [
+    ("user_flags", orm_user_flags, rm_user_flags),
+    ("user_card", orm_user_card, rm_user_card),
+    ("order_head", orm_order_head, rm_order_head),
+    ("owned_order", orm_owned_order, rm_owned_order),
+    ("user_order_ids", orm_user_order_ids, rm_user_order_ids),
+]
+
+
+async def per_call_us(fn, n: int) -> float:
+    started = time.perf_counter()
+    for i in range(n):
+        uid = i % USERS
+        async with AsyncReadSessionLocal() as sess:
+            await fn(sess, uid, uid + 1)
+    return (time.perf_counter() - started) / n * 1e6
+
+
+async def main(db_path: str, n: int):
+    init_async_engine(db_path)
+    # Прогрев: пул соединений и кэш скомпилированных запросов
+    for _, orm_fn, rm_fn in CHECKS:
+        await per_call_us(orm_fn, 50)
+        await per_call_us(rm_fn, 50)
+
+    print(f"{'проверка':>15}  {'ORM, мкс':>9}  {'read-model, мкс':>15}  ускорение")
+    for label, orm_fn, rm_fn in CHECKS:
+        orm_us = await per_call_us(orm_fn, n)
+        rm_us = await per_call_us(rm_fn, n)
+        print(f"{label:>15}  {orm_us:>9.0f}  {rm_us:>15.0f}  x{orm_us / rm_us:.2f}")
+    await dispose_async_engine()
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.sqlite3")
+        seed(db_path)
+        print(f"Пользователей: {USERS}, заказов: {USERS * ORDERS_PER_USER}, по {n} вызовов на проверку")
+        asyncio.run(main(db_path, n))
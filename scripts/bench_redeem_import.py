@@ -0,0 +1,89 @@
+"""
+Бенчмарк импорта кодов активации.
+
+  before — старый bulk_insert_redeem_codes: SELECT на каждый код + session.add
+  after  — import_redeem_codes: пачки INSERT ... ON CONFLICT DO NOTHING
+
+Старый вариант гоняем на меньшем объёме (он линейный, но медленный) и
+пересчитываем в коды/с. Новый — на полном объёме из файла, затем повторно
+на тех же кодах (всё должно уйти в «пропущено»).
+
+Запуск:  python scripts/bench_redeem_import.py [кол-во кодов] [кол-во для before]
+"""
+import os
+import sys
+import tempfile
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
+sys.path.append(PROJECT_ROOT)
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from db.migrations import run_migrations
+from db.models import RedeemCode
+from db.repo import make_engine, ensure_product, import_redeem_codes, read_codes_file
+
+
+def legacy_bulk_insert(session: Session, product_id: int, codes):
+    # Копия прежней реализации bulk_insert_redeem_codes
+    inserted = 0
+    for code in codes:
+        code = code.strip()
+        if not code:
+            continue
+        exists = session.scalar(
+            select(RedeemCode.id).where(RedeemCode.product_id == product_id, RedeemCode.code == code)
+        )
+        if not exists:
+            session.add(RedeemCode(product_id=product_id, code=code))
+            inserted += 1
+    return inserted
+
+
+def fresh_db(tmp: str, name: str):
+    engine = make_engine(os.path.join(tmp, name))
+    run_migrations(engine)
+    with Session(engine) as sess:
+        product_id = ensure_product(sess, "anxiety", "Коробочка", price_kop=599000).id
+        sess.commit()
+    return engine, product_id
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    n_before = int(sys.argv[2]) if len(sys.argv) > 2 else 20_000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        codes_path = os.path.join(tmp, "codes.txt")
+        with open(codes_path, "w", encoding="utf-8") as f:
+            for i in range(n):
+                f.write(f"{i:08d}\n")
+            for i in range(0, n, 100):  # 1% повторов внутри файла
+                f.write(f"{i:08d}\n")
+
+        engine, product_id = fresh_db(tmp, "before.sqlite3")
+        started = time.perf_counter()
+        with Session(engine) as sess:
+            legacy_bulk_insert(sess, product_id, (f"{i:08d}" for i in range(n_before)))
+            sess.commit()
+        before = n_before / (time.perf_counter() - started)
+        print(f"before: {n_before:,} кодов → {before:,.0f} кодов/с (на {n:,} ≈ {n / before:.0f} с)")
+        engine.dispose()
+
+        engine, product_id = fresh_db(tmp, "after.sqlite3")
+        rates = {}
+        for label in ("after", "повтор"):
+            started = time.perf_counter()
+            with Session(engine) as sess:
+                inserted, skipped = import_redeem_codes(sess, product_id, read_codes_file(codes_path))
+                sess.commit()
+            elapsed = time.perf_counter() - started
+            rates[label] = (inserted + skipped) / elapsed
+            print(f"{label:>6}: добавлено {inserted:,}, пропущено {skipped:,} за {elapsed:.1f} с "
+                  f"→ {rates[label]:,.0f} кодов/с")
+        with engine.connect() as conn:
+            total = conn.scalar(select(func.count()).select_from(RedeemCode))
+        print(f"В таблице: {total:,} кодов, ускорение x{rates['after'] / before:.0f}")
+        engine.dispose()
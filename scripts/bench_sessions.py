@@ -0,0 +1,75 @@
+"""
+Бенчмарк: сколько апдейтов в секунду выдерживает БД-часть обработчика
+/webhook/telegram.
+
+Сравниваем:
+  before — как было: make_engine() + Session(engine) на каждый апдейт
+  after  — общий Engine процесса + SessionLocal()
+
+Один «апдейт» = то, что делает типичный обработчик (cb_menu, cb_cabinet...):
+get_user_by_id + изменение флага + commit.
+
+Запуск:  python scripts/bench_sessions.py [кол-во апдейтов]
+"""
+import os
+import sys
+import tempfile
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
+sys.path.append(PROJECT_ROOT)
+
+from sqlalchemy.orm import Session
+from db.models import Base
+from db.repo import (
+    make_engine, init_engine, dispose_engine, SessionLocal,
+    get_or_create_user, get_user_by_id,
+)
+
+USERS = 200
+
+
+def handle_update_before(db_path: str, user_id: int):
+    engine = make_engine(db_path)
+    with Session(engine) as sess:
+        user = get_user_by_id(sess, user_id)
+        user.gallery_viewed = not user.gallery_viewed
+        sess.commit()
+
+
+def handle_update_after(user_id: int):
+    with SessionLocal() as sess:
+        user = get_user_by_id(sess, user_id)
+        user.gallery_viewed = not user.gallery_viewed
+        sess.commit()
+
+
+def run(label: str, n: int, fn) -> float:
+    started = time.perf_counter()
+    for i in range(n):
+        fn(1000 + i % USERS)
+    elapsed = time.perf_counter() - started
+    rate = n / elapsed
+    print(f"{label:>7}: {n} апдейтов за {elapsed:.2f} с → {rate:,.0f} апдейтов/с")
+    return rate
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.sqlite3")
+
+        engine = init_engine(db_path)
+        Base.metadata.create_all(engine)
+        with SessionLocal() as sess:
+            for uid in range(1000, 1000 + USERS):
+                get_or_create_user(sess, uid, f"user{uid}")
+            sess.commit()
+
+        before = run("before", n, lambda uid: handle_update_before(db_path, uid))
+        after = run("after", n, handle_update_after)
+        print(f"Ускорение: x{after / before:.1f}")
+
+        dispose_engine()
@@ -0,0 +1,144 @@
+"""
+Бенчмарк записи: прямые commit из обработчиков против очереди записи (db.write_queue).
+
+N пользователей одновременно делают типичную запись обработчика — меняют флаги
+в users и статус своего заказа — и ждут commit:
+  direct — каждый в своей AsyncSession со своим commit (как было)
+  queue  — write_queue.submit(unit): один писатель, групповой commit
+  mixed  — половина пользователей через очередь, половина коммитит сама: так в
+           bot.py, где через очередь идут только часть обработчиков; прямые commit
+           конкурируют с пачками очереди за блокировку
+
+Оба профиля гоняются при synchronous=NORMAL (по умолчанию в db.repo) и FULL
+(fsync на каждый commit — здесь групповой commit выигрывает больше всего).
+
+Запуск:  python scripts/bench_write_queue.py [кол-во пользователей] [секунд на профиль]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
+sys.path.append(PROJECT_ROOT)
+
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import Session
+from db.async_repo import make_async_engine, get_user_by_id
+from db.migrations import run_migrations
+from db.models import Order, User
+from db.repo import make_engine, ensure_product, SQLITE_PRAGMAS
+from db.write_queue import WriteQueue
+
+
+def seed(db_path: str, n_users: int):
+    engine = make_engine(db_path)
+    run_migrations(engine)
+    with Session(engine) as sess:
+        product = ensure_product(sess, "anxiety", "Коробочка", price_kop=599000)
+        sess.add_all(User(telegram_id=uid) for uid in range(n_users))
+        sess.flush()
+        sess.add_all(Order(user_id=uid, product_id=product.id, total_price_kop=599000) for uid in range(n_users))
+        sess.commit()
+    engine.dispose()
+
+
+def make_unit(uid: int, flip: bool):
+    async def unit(session):
+        user = await get_user_by_id(session, uid)
+        user.awaiting_pvz_address = flip
+        order = await session.scalar(select(Order).where(Order.user_id == uid))
+        order.status = "new" if flip else "pending_payment"
+    return unit
+
+
+async def user_loop(uid: int, write, stop: asyncio.Event, latencies: list[float], errors: list[int]):
+    flip = False
+    while not stop.is_set():
+        flip = not flip
+        started = time.perf_counter()
+        try:
+            await write(make_unit(uid, flip))
+            latencies.append(time.perf_counter() - started)
+        except OperationalError:
+            errors[0] += 1
+
+
+def summary(latencies: list[float], seconds: float) -> tuple[float, float, float]:
+    lat = sorted(latencies) or [0.0]
+    p50 = lat[len(lat) // 2] * 1000
+    p99 = lat[min(len(lat) - 1, int(len(lat) * 0.99))] * 1000
+    return len(latencies) / seconds, p50, p99
+
+
+async def run_profile(label: str, db_path: str, n_users: int, seconds: float, synchronous: str, mode: str):
+    """mode: "direct", "queue" или "mixed" (чётные пользователи — очередь, нечётные — свой commit)."""
+    engine = make_async_engine(db_path, pragmas={**SQLITE_PRAGMAS, "synchronous": synchronous})
+    sessionmaker = async_sessionmaker(engine, expire_on_commit=False)
+
+    queue = WriteQueue(sessionmaker, max_batch=64)
+    queued = mode != "direct"
+    if queued:
+        queue.start()
+
+    async def direct(unit):
+        async with sessionmaker() as sess:
+            await unit(sess)
+            await sess.commit()
+
+    def path(uid: int) -> str:
+        return mode if mode != "mixed" else ("queue" if uid % 2 == 0 else "direct")
+
+    stop = asyncio.Event()
+    latencies: dict[str, list[float]] = {"queue": [], "direct": []}
+    errors = [0]
+    tasks = [
+        asyncio.create_task(user_loop(
+            uid, queue.submit if path(uid) == "queue" else direct, stop, latencies[path(uid)], errors,
+        ))
+        for uid in range(n_users)
+    ]
+    await asyncio.sleep(seconds)
+    stop.set()
+    await asyncio.gather(*tasks)
+    if queued:
+        await queue.stop()
+    await engine.dispose()
+
+    rate, p50, p99 = summary(latencies["queue"] + latencies["direct"], seconds)
+    batch = f" | пачка в среднем {queue.stats()['avg_batch']:.1f}" if queued else ""
+    print(
+        f"{label:>14}: {rate:,.0f} записей/с | p50 {p50:.1f} мс, p99 {p99:.1f} мс | "
+        f"ошибок 'database is locked': {errors[0]}{batch}"
+    )
+    if mode == "mixed":
+        for name in ("queue", "direct"):
+            part_rate, part_p50, part_p99 = summary(latencies[name], seconds)
+            print(f"{'':>14}  {name}: {part_rate:,.0f} записей/с | p50 {part_p50:.1f} мс, p99 {part_p99:.1f} мс")
+    return rate, p99
+
+
+async def main(n_users: int, seconds: float):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.sqlite3")
+        seed(db_path, n_users)
+        for synchronous in ("NORMAL", "FULL"):
+            direct = await run_profile(f"direct {synchronous}", db_path, n_users, seconds, synchronous, "direct")
+            queued = await run_profile(f"queue {synchronous}", db_path, n_users, seconds, synchronous, "queue")
+            print(f"{'':>14}  пропускная способность x{queued[0] / direct[0]:.1f}, "
+                  f"p99 {direct[1]:.1f} → {queued[1]:.1f} мс")
+            mixed = await run_profile(f"mixed {synchronous}", db_path, n_users, seconds, synchronous, "mixed")
+            print(f"{'':>14}  пополам с прямыми commit: x{mixed[0] / direct[0]:.1f} к direct, "
+                  f"p99 {mixed[1]:.1f} мс")
+
+
+if __name__ == "__main__":
+    n_users = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    print(f"Пользователей: {n_users}, по {seconds:.0f} с на профиль")
+    asyncio.run(main(n_users, seconds))
@@ -0,0 +1,128 @@
+"""
+Проверка снимков SQLite (db.backup) на временной БД:
+  - снимок снимается, пока идут записи через очередь записи, и писатели его не ждут
+    (задержка commit во время снимка против задержки без него);
+  - в снимке все строки, он проходит integrity_check и открывается как отдельный файл
+    (journal_mode=delete);
+  - в каталоге остаются BACKUP_KEEP последних снимков.
+
+Запуск:  python scripts/check_backup.py [заказов в БД]
+"""
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
+sys.path.append(PROJECT_ROOT)
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from db.async_repo import init_async_engine, dispose_async_engine
+from db.backup import Snapshotter
+from db.migrations import run_migrations
+from db.models import Order, User
+from db.repo import make_engine, ensure_product
+from db.write_queue import write_queue
+
+KEEP = 3
+# Мелкие шаги, чтобы снимок заведомо шёл одновременно с записью
+PAGES_PER_STEP = 16
+
+
+def check(label: str, ok: bool, detail: str = ""):
+    print(f"  {'ok ' if ok else 'FAIL'} {label}{': ' + detail if detail else ''}")
+    if not ok:
+        raise SystemExit(1)
+
+
+def seed(db_path: str, orders: int) -> int:
+    engine = make_engine(db_path)
+    run_migrations(engine)
+    with Session(engine) as sess:
+        product = ensure_product(sess, "anxiety", "Коробочка", price_kop=599000)
+        sess.add(User(telegram_id=1, full_name="Снимок"))
+        sess.flush()
+        sess.execute(insert(Order), [
+            {"user_id": 1, "product_id": product.id, "total_price_kop": 599000, "address": "Москва, ПВЗ " + "x" * 200}
+            for _ in range(orders)
+        ])
+        sess.commit()
+        product_id = product.id
+    engine.dispose()
+    return product_id
+
+
+async def write_latencies(product_id: int, stop: asyncio.Event) -> list[float]:
+    """Заказы по одному через очередь записи, пока не выставлен stop; время каждого commit."""
+    latencies = []
+    while not stop.is_set():
+        async def unit(sess):
+            sess.add(Order(user_id=1, product_id=product_id, total_price_kop=100, address="во время снимка"))
+        started = time.perf_counter()
+        await write_queue.submit(unit)
+        latencies.append(time.perf_counter() - started)
+        await asyncio.sleep(0.002)
+    return latencies
+
+
+def p99(values: list[float]) -> float:
+    return sorted(values)[int(len(values) * 0.99)] * 1000 if values else 0.0
+
+
+async def main(db_path: str, backup_dir: str, product_id: int):
+    init_async_engine(db_path)
+    write_queue.start()
+    snapshotter = Snapshotter(backup_dir, keep=KEEP, pages_per_step=PAGES_PER_STEP)
+    try:
+        stop = asyncio.Event()
+        writer = asyncio.create_task(write_latencies(product_id, stop))
+        await asyncio.sleep(0.5)
+        stop.set()
+        idle = await writer
+
+        stop = asyncio.Event()
+        writer = asyncio.create_task(write_latencies(product_id, stop))
+        snap = await snapshotter.snapshot(db_path)
+        stop.set()
+        during = await writer
+    finally:
+        await write_queue.stop()
+        await dispose_async_engine()
+
+    print(f"Снимок: {snap.size_bytes / 1024 / 1024:.1f} МБ, {snap.pages} страниц за {snap.duration:.2f} с, "
+          f"перезапусков {snap.restarts}")
+    print(f"commit без снимка: p99 {p99(idle):.1f} мс ({len(idle)} записей); "
+          f"во время снимка: p99 {p99(during):.1f} мс, max {max(during) * 1000:.1f} мс ({len(during)} записей)")
+    check("писатели не стоят во время снимка", len(during) > 0 and max(during) < 1.0)
+
+    conn = sqlite3.connect(snap.path)
+    try:
+        integrity = conn.execute("PRAGMA integrity_check").fetchone()[0]
+        mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        in_snapshot = conn.execute("SELECT count(*) FROM orders").fetchone()[0]
+    finally:
+        conn.close()
+    check("integrity_check снимка", integrity == "ok")
+    check("снимок — отдельный файл", mode == "delete", mode)
+    check("в снимке все заказы до начала снимка", in_snapshot >= ORDERS + len(idle), str(in_snapshot))
+
+    # Ротация: снимки с разными метками времени, остаются KEEP последних
+    for _ in range(KEEP + 1):
+        await asyncio.sleep(1.05)
+        snap = await snapshotter.snapshot(db_path)
+    kept = sorted(f for f in os.listdir(backup_dir) if f.endswith(".sqlite3"))
+    check("ротация", len(kept) == KEEP and os.path.basename(snap.path) == kept[-1]
+          and not any(f.endswith(".part") for f in os.listdir(backup_dir)), ", ".join(kept))
+
+
+if __name__ == "__main__":
+    ORDERS = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "app.sqlite3")
+        product_id = seed(db_path, ORDERS)
+        asyncio.run(main(db_path, os.path.join(tmp, "backups"), product_id))
+    print("Все проверки пройдены")
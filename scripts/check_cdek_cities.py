@@ -0,0 +1,163 @@
+"""
+Проверка словаря городов СДЭК (cdek.cities) на временной БД:
+  - нормализация названий (регистр, ё/е, «г.», дефисы, регион);
+  - точное название и название в начале адреса — из памяти, без API;
+  - из одноимённых городов выбирается тот, где больше ПВЗ;
+  - промах — один запрос в API, ответ запоминается и переживает перезапуск (load());
+    «не нашёл» не повторяется;
+  - опечатка — только если API ничего не нашёл или не ответил; похожий город из
+    индекса не подменяет настоящий («Пушкино» — не «Пушкин», «Королево» — не «Королёв»);
+  - время поиска из памяти против задержки API (FETCH_DELAY).
+
+Запуск:  python scripts/check_cdek_cities.py [городов в словаре]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
+sys.path.append(PROJECT_ROOT)
+
+from cdek.cities import CityResolver, normalize_city
+from db.async_repo import init_async_engine, dispose_async_engine
+from db.migrations import run_migrations
+from db.repo import make_engine
+from db.write_queue import write_queue
+
+FETCH_DELAY = 0.05
+
+NORMALIZED = {
+    "г. Москва": "москва",
+    "Москва г": "москва",
+    "САНКТ-ПЕТЕРБУРГ": "санкт петербург",
+    "Ростов-на-Дону (Ростовская обл.)": "ростов на дону",
+    "Королёв, Московская обл.": "королев",
+    "Королёв Московская обл": "королев",
+    "Уфа Респ Башкортостан": "уфа",
+    "пгт Яблоновский": "яблоновский",
+    "г.Нижний Новгород": "нижний новгород",
+}
+
+# (city_code, город, регион, число ПВЗ) — как из DeliveryPointCatalog.cities()
+REAL = [
+    (44, "Москва", "Москва", 900),
+    (137, "Санкт-Петербург", "Санкт-Петербург", 500),
+    (414, "Нижний Новгород", "Нижегородская обл.", 120),
+    (438, "Ростов-на-Дону", "Ростовская обл.", 110),
+    (256, "Уфа", "Респ. Башкортостан", 90),
+    (5400, "Королёв", "Московская обл.", 15),
+    (5500, "Пушкин", "Санкт-Петербург", 12),
+    (7001, "Никольское", "Ленинградская обл.", 3),
+    (7002, "Никольское", "Московская обл.", 1),
+]
+
+
+class StandIn:
+    def __init__(self):
+        self.calls = 0
+        self.fail = False
+        self.cities = {
+            "зеленоград": {"code": 7003, "city": "Зеленоград", "region": "Москва"},
+            "пушкино": {"code": 7004, "city": "Пушкино", "region": "Московская обл."},
+        }
+
+    async def fetch(self, name: str):
+        self.calls += 1
+        await asyncio.sleep(FETCH_DELAY)
+        if self.fail:
+            return None
+        city = self.cities.get(normalize_city(name))
+        return [city] if city else []
+
+
+def check(label: str, ok: bool, detail: str = ""):
+    print(f"  {'ok ' if ok else 'FAIL'} {label}{': ' + detail if detail else ''}")
+    if not ok:
+        raise SystemExit(1)
+
+
+def per_call_us(fn, n: int) -> float:
+    started = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - started) / n * 1e6
+
+
+async def main(db_path: str, total: int):
+    bad = {raw: normalize_city(raw) for raw, want in NORMALIZED.items() if normalize_city(raw) != want}
+    check("нормализация названий", not bad, str(bad) if bad else f"{len(NORMALIZED)} примеров")
+
+    engine = make_engine(db_path)
+    run_migrations(engine)
+    init_async_engine(db_path)
+    write_queue.start()
+    stand_in = StandIn()
+    try:
+        resolver = CityResolver(stand_in.fetch)
+        generated = [(10_000 + n, f"Населённый пункт {n}", None, 1) for n in range(total - len(REAL))]
+        changed = await resolver.sync_from_points(REAL + generated)
+        check("словарь из справочника ПВЗ", changed == len(resolver) == total - 1,
+              f"{len(resolver)} названий")
+        check("повторная синхронизация ничего не пишет", await resolver.sync_from_points(REAL + generated) == 0)
+
+        cases = {
+            "Москва": 44,
+            "г. Санкт-Петербург": 137,
+            "Нижний Новгород Большая Покровская 5": 414,
+            "ростов на дону": 438,
+            "Королев Проспект Космонавтов": 5400,
+            "Никольское": 7001,
+        }
+        got = {name: await resolver.resolve(name) for name in cases}
+        check("точное и в начале адреса — без API", got == cases and stand_in.calls == 0,
+              f"{resolver.exact_hits} точных, {resolver.prefix_hits} по началу")
+        check("подсказки по началу названия — крупные первыми",
+              [e.code for e in resolver.suggest("Н", 2)] == [414, 7001])
+
+        got = [await resolver.resolve("Зеленоград") for _ in range(5)]
+        check("промах: один запрос в API, дальше из памяти", got == [7003] * 5 and stand_in.calls == 1)
+        got = [await resolver.resolve("Неизвестноград") for _ in range(5)]
+        check("«не нашёл» не повторяется", got == [None] * 5 and stand_in.calls == 2)
+
+        typos = {"Масква": 44, "Санкт Питербург": 137}
+        got = {name: await resolver.resolve(name) for name in typos}
+        check("опечатка: API не нашёл — ближайшее название", got == typos and stand_in.calls == 4,
+              f"{resolver.fuzzy_hits} с опечаткой")
+        got = [await resolver.resolve(name) for name in ("Пушкино", "Пушкино, Московская обл")]
+        check("город не из индекса — из API, а не похожий из индекса", got == [7004, 7004] and stand_in.calls == 5,
+              str(got))
+        check("отличие в последней букве — не опечатка", await resolver.resolve("Королево") is None)
+        stand_in.fail = True
+        got = {name: await resolver.resolve(name) for name in ("Мосва", "Королево Московская обл")}
+        check("API не ответил: опечатка — из памяти, другой город — нет",
+              got == {"Мосва": 44, "Королево Московская обл": None}, str(got))
+        stand_in.fail = False
+        calls = stand_in.calls
+
+        restarted = CityResolver(stand_in.fetch)
+        await restarted.load()
+        check("выученное переживает перезапуск",
+              await restarted.resolve("зеленоград") == 7003 and await restarted.resolve("Пушкино") == 7004
+              and stand_in.calls == calls)
+
+        n = 20_000
+        exact = per_call_us(lambda: restarted.lookup("Москва"), n)
+        prefix = per_call_us(lambda: restarted.lookup("Нижний Новгород Большая Покровская 5"), n)
+        fuzzy = per_call_us(lambda: restarted.correct("Санкт Питербург"), n // 20)
+        print(f"  из памяти: точное {exact:.1f} мкс, по началу {prefix:.1f} мкс, с опечаткой {fuzzy:.0f} мкс; "
+              f"API — {FETCH_DELAY * 1000:.0f} мс и больше")
+        print(f"  статистика: {resolver.stats()}")
+    finally:
+        await write_queue.stop()
+        await dispose_async_engine()
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(main(os.path.join(tmp, "cities.sqlite3"), total))
+    print("Все проверки пройдены")
@@ -0,0 +1,211 @@
+"""
+Проверка локального справочника ПВЗ (cdek.points) на временной БД и заглушке /v2/deliverypoints:
+  - первый sync() обходит все страницы и пишет все точки;
+  - повторный sync() без изменений ничего не пишет; изменённые точки перезаписываются,
+    исчезнувшие — удаляются; неполный ответ API ничего не удаляет;
+  - после перезапуска (load() из таблицы) поиск по коду и по городу не ходит в API,
+    время поиска — против прежнего скачивания справочника на каждый запрос;
+  - промах (новая точка, неизвестный город) — запрос в API, дальше из памяти;
+  - время полного обхода переживает перезапуск: обход без изменений его обновляет,
+    запись промаха — нет; город, известный по одной точке, и после перезапуска неполон.
+
+Запуск:  python scripts/check_cdek_points.py [точек в справочнике]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
+sys.path.append(PROJECT_ROOT)
+
+from aiohttp import web
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from cdek.points import DeliveryPointCatalog
+from db.async_repo import init_async_engine, dispose_async_engine
+from db.migrations import run_migrations
+from db.models import CdekDeliveryPoint
+from db.repo import make_engine
+from db.write_queue import write_queue
+from net.http import Upstream
+
+PAGE_SIZE = 500
+CITIES = 50
+
+
+def make_point(n: int, city: int, address: str | None = None) -> dict:
+    return {
+        "code": f"C{city:02d}{n:05d}" if n >= 0 else f"NEW{-n}",
+        "type": "PVZ",
+        "location": {"city_code": 1000 + city, "city": f"Город {city}",
+                     "address": address or f"ул. Тестовая, д. {n}",
+                     "address_full": f"Россия, Город {city}, ул. Тестовая, д. {n}"},
+        "work_time": "Пн-Пт 10:00-20:00",
+    }
+
+
+class StandIn:
+    def __init__(self, total: int):
+        self.points = {p["code"]: p for p in (make_point(n, n % CITIES) for n in range(total))}
+        self.requests = 0
+        self.truncate_to: int | None = None
+
+    async def deliverypoints(self, request: web.Request):
+        self.requests += 1
+        q = request.query
+        points = list(self.points.values())
+        if self.truncate_to is not None:
+            points = points[:self.truncate_to]
+        if "code" in q:
+            points = [p for p in points if p["code"] == q["code"]]
+        if "city_code" in q:
+            points = [p for p in points if p["location"]["city_code"] == int(q["city_code"])]
+        if "page" in q:
+            size = int(q["size"])
+            start = int(q["page"]) * size
+            points = points[start:start + size]
+        return web.json_response(points)
+
+
+def check(label: str, ok: bool, detail: str = ""):
+    print(f"  {'ok ' if ok else 'FAIL'} {label}{': ' + detail if detail else ''}")
+    if not ok:
+        raise SystemExit(1)
+
+
+def table_rows(engine) -> int:
+    with Session(engine) as sess:
+        return sess.scalar(select(func.count()).select_from(CdekDeliveryPoint))
+
+
+async def main(db_path: str, total: int):
+    engine = make_engine(db_path)
+    run_migrations(engine)
+    init_async_engine(db_path)
+    write_queue.start()
+
+    stand_in = StandIn(total)
+    app = web.Application()
+    app.router.add_get("/v2/deliverypoints", stand_in.deliverypoints)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    http = Upstream("stand-in", f"http://127.0.0.1:{port}")
+
+    async def fetch(params: dict):
+        r = await http.get("/v2/deliverypoints", params=params)
+        return r.json() if r.status_code == 200 else None
+
+    async def restart() -> DeliveryPointCatalog:
+        restarted = DeliveryPointCatalog(fetch, page_size=PAGE_SIZE)
+        await restarted.load()
+        return restarted
+
+    try:
+        # Поиск по коду до первого полного обхода не делает справочник «свежим»
+        never_synced = DeliveryPointCatalog(fetch, page_size=PAGE_SIZE)
+        await never_synced.get(next(iter(stand_in.points)))
+        never_synced = await restart()
+        check("запись промаха — не полный обход",
+              never_synced.last_sync_at is None and never_synced.sync_due_in(3600) == 0)
+
+        catalog = DeliveryPointCatalog(fetch, page_size=PAGE_SIZE)
+        result = await catalog.sync()
+        check("первый sync: все точки записаны",
+              result.complete and result.changed == total and table_rows(engine) == total,
+              f"страниц {result.pages}, {result.duration:.2f} с")
+
+        writes = write_queue.units
+        result = await catalog.sync()
+        check("повторный sync без изменений не пишет точки",
+              result.changed == 0 and result.removed == 0 and write_queue.units == writes + 1,
+              f"{result.duration:.2f} с")
+        quiet = await restart()
+        check("после перезапуска время sync — последнего обхода, а не последней записи точки",
+              abs((quiet.last_sync_at - catalog.last_sync_at).total_seconds()) < 0.001)
+
+        codes = list(stand_in.points)
+        for code in codes[:3]:
+            stand_in.points[code]["work_time"] = "Пн-Вс 09:00-21:00"
+        for code in codes[3:5]:
+            del stand_in.points[code]
+        result = await catalog.sync()
+        check("изменённые перезаписаны, исчезнувшие удалены",
+              result.changed == 3 and result.removed == 2 and table_rows(engine) == total - 2)
+
+        synced_at = catalog.last_sync_at
+        stand_in.truncate_to = total // 10
+        result = await catalog.sync()
+        check("неполный справочник ничего не удаляет", result.removed == 0 and table_rows(engine) == total - 2)
+        check("неполный обход не обновляет время sync",
+              abs(((await restart()).last_sync_at - synced_at).total_seconds()) < 0.001)
+        stand_in.truncate_to = None
+
+        # Перезапуск: индекс из таблицы, API не нужен
+        restarted = DeliveryPointCatalog(fetch, page_size=PAGE_SIZE)
+        await restarted.load()
+        requests = stand_in.requests
+        code = codes[10]
+        city = stand_in.points[code]["location"]["city_code"]
+        point = await restarted.get(code.lower())
+        city_points = await restarted.city_points(city)
+        check("после load(): код и город из памяти",
+              point == stand_in.points[code] and len(city_points) == sum(
+                  p["location"]["city_code"] == city for p in stand_in.points.values())
+              and stand_in.requests == requests and restarted.sync_due_in(3600) > 0)
+
+        n = 100_000
+        started = time.perf_counter()
+        for _ in range(n):
+            await restarted.get(code)
+        per_code = (time.perf_counter() - started) / n * 1e6
+        started = time.perf_counter()
+        for _ in range(n // 10):
+            await restarted.city_points(city)
+        per_city = (time.perf_counter() - started) / (n // 10) * 1e6
+        started = time.perf_counter()
+        all_points = await fetch({"type": "PVZ", "page": 0, "size": min(3000, total)})
+        [p for p in all_points if p["code"] == code]
+        before = (time.perf_counter() - started) * 1000
+        print(f"  поиск по коду {per_code:.2f} мкс, ПВЗ города {per_city:.2f} мкс; "
+              f"прежнее скачивание {min(3000, total)} точек с заглушки — {before:.1f} мс")
+
+        # Промахи: новая точка и её город (по одной точке город не считается известным) —
+        # по одному запросу, дальше из памяти
+        fresh = make_point(-1, 99)
+        stand_in.points[fresh["code"]] = fresh
+        requests = stand_in.requests
+        got = [await restarted.get(fresh["code"]) for _ in range(5)]
+        check("промах по коду: один запрос в API, потом из памяти",
+              got == [fresh] * 5 and stand_in.requests == requests + 1 and table_rows(engine) == total - 1)
+        second = make_point(-2, 99)
+        stand_in.points[second["code"]] = second
+        # Перезапуск: город по-прежнему известен только по одной точке
+        restarted = await restart()
+        got_city = [await restarted.city_points(1099) for _ in range(5)]
+        check("неполный город и после перезапуска: один запрос в API, потом из памяти",
+              got_city == [[fresh, second]] * 5 and stand_in.requests == requests + 2
+              and not (await restart())._partial_cities,
+              f"запросов {stand_in.requests - requests}")
+        requests = stand_in.requests
+        empty = [await restarted.city_points(7777) for _ in range(5)]
+        check("город без ПВЗ: один запрос", empty == [[]] * 5 and stand_in.requests == requests + 1)
+        print(f"  статистика: {restarted.stats()}")
+    finally:
+        await http.close()
+        await runner.cleanup()
+        await write_queue.stop()
+        await dispose_async_engine()
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(main(os.path.join(tmp, "points.sqlite3"), total))
+    print("Все проверки пройдены")
@@ -0,0 +1,104 @@
+"""
+Проверка кэша OAuth-токенов СДЭК (cdek.tokens) на локальной заглушке /v2/oauth/token:
+  - 50 одновременных вызовов на холодном кэше — один запрос токена (singleflight);
+  - дальше токен отдаётся из памяти;
+  - ближе REFRESH_AHEAD к истечению — старый токен сразу, новый обновляется в фоне;
+  - ближе EXPIRY_MARGIN — вызов ждёт обновления;
+  - неудачное фоновое обновление не выбрасывает ещё живой токен и не повторяется на каждый вызов;
+  - invalidate() после 401.
+
+Запуск:  python scripts/check_cdek_tokens.py
+"""
+import asyncio
+import os
+import sys
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
+sys.path.append(PROJECT_ROOT)
+
+from aiohttp import web
+from cdek.tokens import CdekTokenManager
+from net.http import Upstream
+
+# Токен «живёт» 3 с: обновление заранее за 2 с, запас 1 с
+EXPIRES_IN = 3
+REFRESH_AHEAD = 2.0
+EXPIRY_MARGIN = 1.0
+FETCH_DELAY = 0.2
+RETRY = 10.0
+
+
+class StandIn:
+    def __init__(self):
+        self.issued = 0
+        self.fail = False
+
+    async def token(self, request: web.Request):
+        form = await request.post()
+        await asyncio.sleep(FETCH_DELAY)
+        if self.fail or form.get("client_secret") != "secret":
+            return web.json_response({"error": "invalid_client"}, status=401)
+        self.issued += 1
+        return web.json_response({"access_token": f"token-{self.issued}", "expires_in": EXPIRES_IN})
+
+
+def check(label: str, ok: bool, detail: str = ""):
+    print(f"  {'ok ' if ok else 'FAIL'} {label}{': ' + detail if detail else ''}")
+    if not ok:
+        raise SystemExit(1)
+
+
+async def main():
+    stand_in = StandIn()
+    app = web.Application()
+    app.router.add_post("/v2/oauth/token", stand_in.token)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    http = Upstream("stand-in", f"http://127.0.0.1:{port}")
+    tokens = CdekTokenManager("stand-in", http, "account", "secret",
+                              refresh_ahead=REFRESH_AHEAD, expiry_margin=EXPIRY_MARGIN, retry_delay=RETRY)
+    try:
+        got = await asyncio.gather(*(tokens.get() for _ in range(50)))
+        check("холодный кэш: 50 вызовов — один запрос", stand_in.issued == 1 and set(got) == {"token-1"},
+              f"запросов {stand_in.issued}, ждали общий {tokens.joined}")
+
+        got = [await tokens.get() for _ in range(100)]
+        check("из памяти", stand_in.issued == 1 and set(got) == {"token-1"})
+
+        # Осталось < REFRESH_AHEAD: старый токен без ожидания, новый — в фоне
+        await asyncio.sleep(EXPIRES_IN - REFRESH_AHEAD + 0.1)
+        got = await asyncio.wait_for(tokens.get(), timeout=FETCH_DELAY / 2)
+        check("заранее: старый токен сразу", got == "token-1")
+        await asyncio.sleep(FETCH_DELAY * 2)
+        check("заранее: новый токен получен в фоне", await tokens.get() == "token-2" and stand_in.issued == 2,
+              f"фоновых обновлений {tokens.background_refreshes}")
+
+        # Фоновое обновление падает — живой токен остаётся
+        stand_in.fail = True
+        await asyncio.sleep(EXPIRES_IN - REFRESH_AHEAD + 0.1)
+        check("неудачное фоновое обновление", await tokens.get() == "token-2")
+        await asyncio.sleep(FETCH_DELAY * 2)
+        got = [await tokens.get() for _ in range(20)]
+        check("старый токен служит до запаса, повтор — не чаще RETRY",
+              set(got) == {"token-2"} and tokens.fetch_failures == 1 and tokens._inflight is None)
+
+        # Осталось < EXPIRY_MARGIN: вызов ждёт новый токен
+        stand_in.fail = False
+        await asyncio.sleep(REFRESH_AHEAD - EXPIRY_MARGIN)
+        check("истекает: ждём новый", await tokens.get() == "token-3")
+
+        tokens.invalidate("token-3")
+        check("invalidate после 401", await tokens.get() == "token-4" and tokens.invalidations == 1)
+        print(f"  статистика: {tokens.stats()}")
+    finally:
+        await http.close()
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
+    print("Все проверки пройдены")
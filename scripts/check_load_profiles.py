@@ -0,0 +1,124 @@
+"""
+Фиксирует, сколько SQL-запросов делают выборки с профилями загрузки из db.repo.
+
+Поднимает временную БД, создаёт пользователя с заказами и прогоняет каждый
+профиль через assert_query_count. Если число запросов изменилось (кто-то
+поменял lazy= в моделях или профиль), скрипт падает со списком SQL.
+
+Запуск:  python scripts/check_load_profiles.py
+"""
+import asyncio
+import os
+import sys
+import tempfile
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
+sys.path.append(PROJECT_ROOT)
+
+from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.orm import Session
+from db.async_repo import (
+    AsyncSessionLocal, init_async_engine, get_async_engine, dispose_async_engine,
+    get_user_by_id, get_user_state, abandon_new_orders, reset_user_input_state,
+)
+from db.migrations import run_migrations
+from db.models import Access, Order, User
+from db.read_model import get_order_notice
+from db.repo import make_engine, ensure_product, load_profile, assert_query_count
+from db.state_cache import user_state_cache
+
+USER_ID = 42
+ORDERS = 5
+
+
+def seed(db_path: str) -> int:
+    engine = make_engine(db_path)
+    run_migrations(engine)
+    with Session(engine) as sess:
+        product = ensure_product(sess, "anxiety", "Коробочка", price_kop=599000)
+        sess.add(User(telegram_id=USER_ID, full_name="Тест Тестов"))
+        sess.add(Access(user_id=USER_ID))
+        sess.flush()
+        orders = [Order(user_id=USER_ID, product_id=product.id, total_price_kop=599000, status="new") for _ in range(ORDERS)]
+        sess.add_all(orders)
+        sess.commit()
+        order_id = orders[0].id
+    engine.dispose()
+    return order_id
+
+
+async def check(label: str, expected: int, fn):
+    engine = get_async_engine()
+    async with AsyncSessionLocal() as sess:
+        with assert_query_count(engine, expected):
+            await fn(sess)
+    print(f"  ok  {label}: {expected} SQL")
+
+
+async def main(db_path: str, order_id: int):
+    init_async_engine(db_path)
+
+    # Как было: get + связи по умолчанию (joined access + selectin orders)
+    await check("User без профиля (lazy= из моделей)", 2, lambda s: s.get(User, USER_ID))
+
+    async def state_only(sess):
+        user = await get_user_by_id(sess, USER_ID)
+        try:
+            user.orders
+        except InvalidRequestError:
+            pass
+        else:
+            raise AssertionError("state-only не должен загружать User.orders")
+
+    await check("get_user_by_id, state-only", 1, state_only)
+
+    async def with_orders(sess):
+        user = await get_user_by_id(sess, USER_ID, profile="with-orders")
+        assert len(user.orders) == ORDERS
+
+    await check("get_user_by_id, with-orders", 2, with_orders)
+
+    async def with_access(sess):
+        user = await get_user_by_id(sess, USER_ID, profile="with-access")
+        assert user.access is not None
+
+    await check("get_user_by_id, with-access", 1, with_access)
+
+    async def admin_order_view(sess):
+        order = await sess.get(Order, order_id, options=load_profile("admin-order-view"))
+        assert order.user.full_name == "Тест Тестов"
+
+    await check("Order, admin-order-view", 1, admin_order_view)
+
+    user_state_cache.invalidate()
+    await check("get_user_state, промах кэша", 1, lambda s: get_user_state(s, USER_ID))
+    await check("get_user_state, попадание в кэш", 0, lambda s: get_user_state(s, USER_ID))
+
+    # Набор-ориентированные операции: один SQL независимо от числа заказов пользователя
+    async def notice(sess):
+        assert (await get_order_notice(sess, order_id)).full_name == "Тест Тестов"
+
+    await check("get_order_notice (заказ + имя)", 1, notice)
+
+    async def abandon(sess):
+        assert len(await abandon_new_orders(sess, USER_ID)) == ORDERS
+        await sess.rollback()
+
+    await check(f"abandon_new_orders, {ORDERS} заказов", 1, abandon)
+
+    async def reset(sess):
+        assert await reset_user_input_state(sess, USER_ID)
+        await sess.rollback()
+
+    await check("reset_user_input_state", 1, reset)
+
+    await dispose_async_engine()
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "profiles.sqlite3")
+        order_id = seed(db_path)
+        asyncio.run(main(db_path, order_id))
+    print("Число запросов для всех профилей совпадает с ожидаемым")
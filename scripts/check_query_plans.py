@@ -0,0 +1,131 @@
+"""
+Регрессионная проверка планов горячих запросов.
+
+Создаёт временную БД по миграциям из db.migrations, заливает в неё 1M заказов
+и прогоняет EXPLAIN QUERY PLAN по каждому горячему запросу бота. Если хотя бы
+один запрос читает таблицу полным сканированием (SCAN <таблица> без индекса),
+скрипт печатает план и завершается с кодом 1.
+
+Запуск:  python scripts/check_query_plans.py [кол-во заказов] [--analyze]
+  --analyze — выполнить ANALYZE перед проверкой (планировщик со статистикой)
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone, timedelta
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
+sys.path.append(PROJECT_ROOT)
+
+from sqlalchemy import insert, select, text
+from db.migrations import run_migrations
+from db.models import Order, OrderAll, OrderEvent, Payment, Product, RedeemCode, User
+from db.repo import make_engine
+
+USERS = 50_000
+CODES = 100_000
+CHUNK = 50_000
+
+STATUSES = ["archived"] * 6 + ["shipped", "assembled", "paid_full", "paid_partially", "pending_payment", "new", "abandoned"]
+PAYMENT_KINDS = ["full", "pre", "remainder", None]
+
+
+# Запросы в том виде, в каком их строят обработчики bot.py / db.repo
+HOT_QUERIES = {
+    "check_pending_timeouts": select(Order).where(
+        Order.status == "pending_payment",
+        Order.created_at < datetime.now(timezone.utc) - timedelta(seconds=600),
+    ),
+    "get_all_orders_by_status": select(Order).where(Order.status == "shipped"),
+    "get_shipped_orders_to_track": select(Order).where(Order.status == "shipped", Order.cdek_uuid.is_not(None)),
+    "order_by_cdek_number": select(Order).where(Order.cdek_number == "1234567890"),
+    "get_pending_payments": select(Payment.kind, Payment.yookassa_payment_id).where(
+        Payment.order_id == 4242, Payment.status == "pending"
+    ),
+    "cb_admin_orders_prepaid": select(Order).where(Order.status.in_(["paid_partially", "paid_full"])),
+    "cb_admin_orders_ready": select(Order).where(Order.status == "assembled", Order.payment_kind == "pre"),
+    "cb_admin_orders_to_ship": select(Order).where(
+        Order.status == "assembled", Order.payment_kind.in_(["full", "remainder"])
+    ),
+    "admin_list_page": select(Order).where(Order.status.in_(["shipped"]), Order.id > 500_000)
+    .order_by(Order.id).limit(21),
+    "admin_list_prev_page": select(Order).where(
+        Order.status.in_(["assembled"]), Order.payment_kind.in_(["full", "remainder"]), Order.id < 500_000
+    ).order_by(Order.id.desc()).limit(21),
+    "admin_list_all_page": select(Order).where(Order.id > 500_000).order_by(Order.id).limit(51),
+    "admin_archive_page": select(OrderAll).where(OrderAll.status.in_(["archived"]), OrderAll.id > 500_000)
+    .order_by(OrderAll.id).limit(21),
+    "get_order_any_archive": select(OrderAll).where(OrderAll.id == 4242),
+    "get_user_orders_db_with_archive": select(OrderAll).where(OrderAll.user_id == 4242).order_by(OrderAll.id.desc()),
+    "get_user_orders_db": select(Order).where(Order.user_id == 4242).order_by(Order.id.desc()),
+    "read_model_user_order_ids": select(OrderAll.id).where(OrderAll.user_id == 4242).order_by(OrderAll.id.desc()),
+    "read_model_owned_order": select(OrderAll).where(OrderAll.id == 4242, OrderAll.user_id == 4242),
+    "read_model_order_notice": select(OrderAll.id, User.full_name)
+    .outerjoin(User, User.telegram_id == OrderAll.user_id).where(OrderAll.id == 4242),
+    "redeem_code_lookup": select(RedeemCode).where(RedeemCode.code == "004242", RedeemCode.is_used == False),
+    "get_order_timeline": select(OrderEvent).where(OrderEvent.order_id == 4242).order_by(OrderEvent.created_at),
+    "order_events_recent_status": select(OrderEvent.order_id).where(
+        OrderEvent.kind == "status", OrderEvent.created_at >= datetime.now(timezone.utc) - timedelta(days=30)
+    ),
+}
+
+
+def seed(engine, n_orders: int):
+    now = datetime.now(timezone.utc)
+    with engine.begin() as conn:
+        conn.execute(insert(Product), [{"code": "anxiety", "title": "Коробочка", "description": "", "price_kop": 599000}])
+        conn.execute(insert(User), [{"telegram_id": uid} for uid in range(USERS)])
+        conn.execute(insert(RedeemCode), [
+            {"product_id": 1, "code": f"{i:06d}", "is_used": i % 3 == 0} for i in range(CODES)
+        ])
+    for start in range(0, n_orders, CHUNK):
+        with engine.begin() as conn:
+            conn.execute(insert(Order), [
+                {
+                    "user_id": i % USERS, "product_id": 1, "total_price_kop": 599000,
+                    "status": STATUSES[i % len(STATUSES)],
+                    "payment_kind": PAYMENT_KINDS[i % len(PAYMENT_KINDS)],
+                    "created_at": now - timedelta(minutes=i % 100_000),
+                    "extra_data": {},
+                }
+                for i in range(start, min(start + CHUNK, n_orders))
+            ])
+
+
+def full_scans(plan_rows) -> list[str]:
+    # "SCAN orders" — полный проход по таблице; "SCAN ... USING INDEX" / "SEARCH ..." — через индекс
+    return [row for row in plan_rows if row.startswith("SCAN ") and "USING" not in row]
+
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    n_orders = int(args[0]) if args else 1_000_000
+    analyze = "--analyze" in sys.argv
+
+    failed = []
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = make_engine(os.path.join(tmp, "plans.sqlite3"))
+        run_migrations(engine)
+
+        started = time.perf_counter()
+        seed(engine, n_orders)
+        print(f"Залито {n_orders:,} заказов за {time.perf_counter() - started:.1f} с")
+
+        with engine.connect() as conn:
+            if analyze:
+                conn.execute(text("ANALYZE"))
+            for name, stmt in HOT_QUERIES.items():
+                sql = str(stmt.compile(engine, compile_kwargs={"literal_binds": True}))
+                plan = [row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")]
+                scans = full_scans(plan)
+                print(f"{'FAIL' if scans else 'ok':>4}  {name}: {' | '.join(plan)}")
+                if scans:
+                    failed.append(name)
+        engine.dispose()
+
+    if failed:
+        print(f"Полное сканирование в запросах: {', '.join(failed)}")
+        sys.exit(1)
+    print("Все горячие запросы идут через индексы")
@@ -0,0 +1,121 @@
+"""
+Проверка профилировщика SQL (db.sql_profiler) на временной SQLite:
+  - N+1: одинаковый запрос в цикле отмечается и уходит в warning;
+  - бюджет SQL_UPDATE_BUDGET: апдейт с лишними запросами отмечается;
+  - параллельные апдейты не смешивают счётчики (contextvar);
+  - SQL единиц очереди записи приписывается поставившему их обработчику,
+    общий flush/commit пачки — фону.
+
+Запуск:  python scripts/check_sql_profiler.py
+"""
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
+sys.path.append(PROJECT_ROOT)
+
+from sqlalchemy import select
+from db.async_repo import AsyncReadSessionLocal, init_async_engine, dispose_async_engine, get_user_by_id
+from db.migrations import run_migrations
+from db.models import User
+from db.read_model import get_user_card
+from db.repo import make_engine
+from db.sql_profiler import BACKGROUND, sql_profiler
+from db.write_queue import write_queue
+
+USERS = 10
+
+
+class Warnings(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.messages: list[str] = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def check(label: str, ok: bool, detail: str = ""):
+    print(f"  {'ok ' if ok else 'FAIL'} {label}{': ' + detail if detail else ''}")
+    if not ok:
+        raise SystemExit(1)
+
+
+async def n_plus_one():
+    async with AsyncReadSessionLocal() as sess:
+        ids = (await sess.scalars(select(User.telegram_id))).all()
+        for uid in ids:
+            await get_user_card(sess, uid)
+
+
+async def one_query():
+    async with AsyncReadSessionLocal() as sess:
+        await get_user_by_id(sess, 1)
+
+
+async def slow_handler(uid: int):
+    async with AsyncReadSessionLocal() as sess:
+        await get_user_card(sess, uid)
+        await asyncio.sleep(0.01)
+        await get_user_card(sess, uid)
+
+
+async def writer():
+    async def unit(sess):
+        user = await sess.get(User, 1)
+        user.full_name = "Профиль"
+    await write_queue.submit(unit)
+
+
+async def run_update(name: str, fn, *args):
+    with sql_profiler.profile(name):
+        await fn(*args)
+
+
+async def main(db_path: str):
+    engine = make_engine(db_path)
+    run_migrations(engine)
+    engine.dispose()
+    init_async_engine(db_path)
+    write_queue.start()
+    async with write_queue.sessionmaker() as sess:
+        sess.add_all(User(telegram_id=uid) for uid in range(1, USERS + 1))
+        await sess.commit()
+    sql_profiler.reset()
+
+    warnings = Warnings()
+    logging.getLogger("box_bot").addHandler(warnings)
+    try:
+        await run_update("n_plus_one", n_plus_one)
+        await run_update("one_query", one_query)
+        await asyncio.gather(*(run_update("slow_handler", slow_handler, uid) for uid in range(1, 6)))
+        await run_update("writer", writer)
+    finally:
+        logging.getLogger("box_bot").removeHandler(warnings)
+        await write_queue.stop()
+        await dispose_async_engine()
+
+    stats = sql_profiler.stats()
+    n1 = stats["n_plus_one"]
+    check("N+1 найден", n1["n_plus_one"] == 1 and n1["statements"] == USERS + 1
+          and any("N+1 в n_plus_one" in m for m in warnings.messages), str(n1))
+    check("бюджет SQL_UPDATE_BUDGET", n1["over_budget"] == int(USERS + 1 > sql_profiler.budget),
+          f"{n1['statements']} запросов при бюджете {sql_profiler.budget}")
+    one = stats["one_query"]
+    check("обычный апдейт без предупреждений", one["statements"] == 1 and not one["n_plus_one"], str(one))
+    slow = stats["slow_handler"]
+    check("параллельные апдейты не смешиваются",
+          slow["updates"] == 5 and slow["max_statements"] == 2 and slow["statements"] == 10, str(slow))
+    wr = stats["writer"]
+    check("SQL единицы очереди записи — отправителю", wr["statements"] >= 2, str(wr))
+    check("flush/commit пачки — в фон", stats.get(BACKGROUND, {}).get("statements", 0) >= 1, str(stats.get(BACKGROUND)))
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(main(os.path.join(tmp, "profiler.sqlite3")))
+    print("Все проверки пройдены")
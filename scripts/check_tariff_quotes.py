@@ -0,0 +1,127 @@
+"""
+Проверка кэша расчётов тарифов СДЭК (cdek.tariffs) на временной БД и заглушке tarifflist:
+  - 20 одновременных нажатий на холодном кэше — один запрос в API;
+  - дальше — из памяти, без API;
+  - старше TTL — старый расчёт сразу, новый в фоне (stale-while-revalidate);
+  - старше MAX_STALE и API не отвечает — отдаётся последний расчёт;
+  - расчёты переживают перезапуск (load()), а смена габаритов их сбрасывает.
+
+Запуск:  python scripts/check_tariff_quotes.py
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
+sys.path.append(PROJECT_ROOT)
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from cdek.tariffs import PackageProfile, QuoteKey, TariffQuoteCache
+from db.async_repo import init_async_engine, dispose_async_engine
+from db.migrations import run_migrations
+from db.models import CdekTariffQuote
+from db.repo import make_engine
+from db.write_queue import write_queue
+
+TTL = 0.5
+MAX_STALE = 1.5
+FETCH_DELAY = 0.2
+PROFILE = PackageProfile(750, 26, 19, 8)
+KEY = QuoteKey(44, "MSK2296", 270, "NSK123", PROFILE)
+
+
+class StandIn:
+    def __init__(self):
+        self.calls = 0
+        self.fail = False
+
+    async def fetch(self, key: QuoteKey):
+        self.calls += 1
+        await asyncio.sleep(FETCH_DELAY)
+        if self.fail:
+            return None
+        return [{"tariff_code": 136, "delivery_mode": 4, "delivery_sum": 300 + self.calls,
+                 "period_min": 2, "period_max": 4}]
+
+
+def check(label: str, ok: bool, detail: str = ""):
+    print(f"  {'ok ' if ok else 'FAIL'} {label}{': ' + detail if detail else ''}")
+    if not ok:
+        raise SystemExit(1)
+
+
+def cost(tariffs) -> int | None:
+    return tariffs[0]["delivery_sum"] if tariffs else None
+
+
+def table_rows(engine) -> int:
+    with Session(engine) as sess:
+        return sess.scalar(select(func.count()).select_from(CdekTariffQuote))
+
+
+async def settle():
+    # Запись расчёта идёт через очередь без ожидания — дожидаемся её пустой единицей
+    async def noop(_session):
+        pass
+    await write_queue.submit(noop)
+
+
+async def main(db_path: str):
+    engine = make_engine(db_path)
+    run_migrations(engine)
+    init_async_engine(db_path)
+    write_queue.start()
+    stand_in = StandIn()
+    try:
+        cache = TariffQuoteCache(stand_in.fetch, ttl=TTL, max_stale=MAX_STALE)
+        got = await asyncio.gather(*(cache.get(KEY) for _ in range(20)))
+        check("холодный кэш: 20 нажатий — один запрос", stand_in.calls == 1 and {cost(t) for t in got} == {301},
+              f"ждали общий {cache.joined}")
+
+        started = time.perf_counter()
+        got = [await cache.get(KEY) for _ in range(1000)]
+        per_hit = (time.perf_counter() - started) / 1000 * 1e6
+        check("из памяти", stand_in.calls == 1 and {cost(t) for t in got} == {301},
+              f"{per_hit:.1f} мкс против {FETCH_DELAY * 1000:.0f} мс запроса")
+
+        await asyncio.sleep(TTL + 0.05)
+        started = time.perf_counter()
+        got = await cache.get(KEY)
+        waited = time.perf_counter() - started
+        check("старше TTL: старый расчёт без ожидания", cost(got) == 301 and waited < FETCH_DELAY / 2)
+        await asyncio.sleep(FETCH_DELAY * 1.5)
+        check("старше TTL: новый расчёт получен в фоне", cost(await cache.get(KEY)) == 302 and stand_in.calls == 2)
+
+        stand_in.fail = True
+        await asyncio.sleep(MAX_STALE + 0.05)
+        got = await cache.get(KEY)
+        check("API не отвечает: последний расчёт", cost(got) == 302 and cache.stale_on_error == 1)
+        stand_in.fail = False
+        await settle()
+
+        restarted = TariffQuoteCache(stand_in.fetch, ttl=60, max_stale=120)
+        await restarted.load(PROFILE)
+        calls = stand_in.calls
+        check("после перезапуска — из таблицы", cost(await restarted.get(KEY)) == 302 and stand_in.calls == calls)
+
+        bigger = PackageProfile(1200, 30, 20, 10)
+        resized = TariffQuoteCache(stand_in.fetch, ttl=60, max_stale=120)
+        await resized.load(bigger)
+        check("смена габаритов сбрасывает расчёты", resized.stats()["quotes"] == 0 and table_rows(engine) == 0)
+        await resized.get(QuoteKey(44, "MSK2296", 270, "NSK123", bigger))
+        check("новые габариты — новый запрос", stand_in.calls == calls + 1)
+        print(f"  статистика: {cache.stats()}")
+    finally:
+        await write_queue.stop()
+        await dispose_async_engine()
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(main(os.path.join(tmp, "tariffs.sqlite3")))
+    print("Все проверки пройдены")
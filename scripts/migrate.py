@@ -0,0 +1,29 @@
+"""
+Применяет недостающие миграции схемы к БД (то же, что делает бот на старте).
+
+Запуск:  python scripts/migrate.py [путь к БД или URL postgresql://...]
+"""
+import os
+import sys
+import logging
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
+sys.path.append(PROJECT_ROOT)
+
+from db.migrations import run_migrations, get_schema_version, LATEST_VERSION
+from db.repo import make_engine
+
+DB_PATH = os.getenv("DATABASE_URL") or os.getenv("DB_PATH", "app.sqlite3")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    db_path = sys.argv[1] if len(sys.argv) > 1 else DB_PATH
+
+    engine = make_engine(db_path)
+    applied = run_migrations(engine)
+    with engine.connect() as conn:
+        version = get_schema_version(conn)
+    engine.dispose()
+
+    print(f"{db_path}: применено шагов {applied}, версия схемы {version} (последняя {LATEST_VERSION})")
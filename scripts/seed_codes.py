@@ -7,11 +7,11 @@ PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
 sys.path.append(PROJECT_ROOT)
 
 from sqlalchemy.orm import Session
-from db.repo import make_engine, ensure_product, bulk_insert_redeem_codes
+from db.repo import make_engine, ensure_product, import_redeem_codes, read_codes_file
 from db.init_db import init_db
 
 # Путь к БД (тот же, что в боте)
-DB_PATH = os.getenv("DB_PATH", "app.sqlite3")
+DB_PATH = os.getenv("DATABASE_URL") or os.getenv("DB_PATH", "app.sqlite3")
 
 # Твои коды (все 40)
 ANXIETY_CODES = [
@@ -22,8 +22,11 @@ ANXIETY_CODES = [
 ]
 
 if __name__ == "__main__":
+    # python scripts/seed_codes.py [файл с кодами, по одному на строку]
+    codes_file = sys.argv[1] if len(sys.argv) > 1 else None
+
     engine = make_engine(DB_PATH)
-    init_db(engine)  # создаст таблицы, если их нет
+    init_db(engine)  # применит недостающие миграции, данные не трогает
 
     with Session(engine) as sess:
         # Создаём или получаем продукт "anxiety"
@@ -35,10 +38,11 @@ if __name__ == "__main__":
             price_kop=299000  # 2990.00 руб
         )
 
-        # Заливаем коды
-        inserted = bulk_insert_redeem_codes(sess, anxiety.id, ANXIETY_CODES)
-        print(f"Заливка завершена: добавлено {inserted} новых кодов (дубликаты пропущены)")
+        # Заливаем коды: из файла (потоково) или встроенный список
+        codes = read_codes_file(codes_file) if codes_file else ANXIETY_CODES
+        inserted, skipped = import_redeem_codes(sess, anxiety.id, codes)
+        print(f"Заливка завершена: добавлено {inserted} новых кодов, пропущено {skipped} (дубликаты)")
 
         sess.commit()
 
-    print("Готово! Коды в таблице redeem_codes.")
\ No newline at end of file
+    print("Готово! Коды в таблице redeem_codes.")